@@ -0,0 +1,179 @@
+"""
+Chunked label volumes that can be read partially. The voxels are split into bricks of chunk_size^3 voxels which are
+compressed independently with zlib, so reading a region only decompresses the bricks that intersect it. A volume
+consists of the .chunks file and a .json header with the same name, see RawVolume. The file starts with the chunk index,
+the byte offsets of all bricks followed by the end of the last one, as little-endian uint64. Bricks are ordered by z,
+then y, then x and bricks that contain only background are not stored at all, i.e. have a length of 0.
+"""
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+from RawVolume import read_header, write_header
+from VolumeCache import ImageGeometry
+from VolumeCropping import Bounds, union_bounding_box
+
+CHUNKED_EXTENSION = '.chunks'
+CHUNK_SIZE = 32
+
+
+def is_chunked_volume(path: str) -> bool:
+    return path.endswith(CHUNKED_EXTENSION)
+
+
+def _grid(dim: Tuple[int, int, int], chunk_size: int) -> Tuple[int, int, int]:
+    """
+    Returns the number of bricks along z, y and x.
+    """
+    return tuple(-(-n // chunk_size) for n in dim[::-1])
+
+
+def write_chunked_volume(path: str, volume: np.ndarray, geometry: ImageGeometry, chunk_size: int = CHUNK_SIZE,
+                         level: int = 1):
+    """
+    :param level: The zlib compression level, low levels compress label maps well already and decompress fastest.
+    """
+    assert is_chunked_volume(path)
+    assert volume.dtype == np.ubyte and volume.shape == geometry.dim
+    zyx = volume.reshape(geometry.dim[::-1])
+    grid = _grid(geometry.dim, chunk_size)
+    offsets = np.zeros(int(np.prod(grid)) + 1, dtype='<u8')
+    with open(path, 'wb') as f:
+        # the index is written again once the offsets are known
+        f.write(offsets.tobytes())
+        position = offsets[0] = offsets.nbytes
+        for idx, (z, y, x) in enumerate(np.ndindex(*grid)):
+            brick = zyx[z * chunk_size:(z + 1) * chunk_size, y * chunk_size:(y + 1) * chunk_size,
+                        x * chunk_size:(x + 1) * chunk_size]
+            if brick.any():
+                data = zlib.compress(np.ascontiguousarray(brick).tobytes(), level)
+                f.write(data)
+                position += len(data)
+
+            offsets[idx + 1] = position
+
+        f.seek(0)
+        f.write(offsets.tobytes())
+
+    bounds = union_bounding_box(volume[np.newaxis], geometry.dim)
+    write_header(path, geometry, chunk_size=chunk_size, codec='zlib',
+                 bounds=[list(b) for b in bounds] if bounds is not None else None)
+
+
+class ChunkedVolume:
+    """
+    A chunked volume which is read from disk on demand. Behaves like a read-only uint8 array of the shape (X, Y, Z)
+    where it matters for the application, converting it with np.asarray reads the whole volume.
+    """
+
+    def __init__(self, path: str, crop: Optional[Bounds] = None):
+        """
+        :param crop: If given, the volume is the region within these bounds of the stored volume, which is read without
+        the voxels outside of it.
+        """
+        header = read_header(path)
+        if header.get('codec', 'zlib') != 'zlib':
+            raise ValueError('Volume {} uses the unknown codec {}'.format(path, header['codec']))
+
+        geometry = ImageGeometry(tuple(header['extent']), tuple(header['spacing']), tuple(header['origin']))
+        self.__path = path
+        # the dimensions of the stored volume, which the bricks cover
+        self.__stored_dim = geometry.dim
+        self.__chunk_size = header['chunk_size']
+        self.__bounds = tuple(tuple(b) for b in header['bounds']) if header.get('bounds') is not None else None
+        self.__grid = _grid(self.__stored_dim, self.__chunk_size)
+        self.__offsets = np.fromfile(path, dtype='<u8', count=int(np.prod(self.__grid)) + 1)
+        self.__crop = crop
+        self.__geometry = geometry if crop is None else geometry.crop(crop)
+        if crop is not None and self.__bounds is not None:
+            self.__bounds = tuple((max(b, c) - c, min(e, end) - c) for (b, e), (c, end) in zip(self.__bounds, crop))
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def crop(self) -> Optional[Bounds]:
+        return self.__crop
+
+    @property
+    def geometry(self) -> ImageGeometry:
+        return self.__geometry
+
+    @property
+    def bounds(self) -> Optional[Bounds]:
+        """
+        The bounding box of the voxels that are not background or None if there are none, within the crop if any.
+        """
+        return self.__bounds
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.__geometry.dim
+
+    @property
+    def dtype(self):
+        return np.dtype(np.ubyte)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory held by the volume, which is only its chunk index.
+        """
+        return self.__offsets.nbytes
+
+    def read_region(self, bounds: Bounds) -> np.ndarray:
+        """
+        Reads the voxels within the [begin, end) ranges along x, y and z, relative to the crop if any. Only the bricks
+        that intersect the region are decompressed.
+        :return: The region in VTK order with the shape (x1 - x0, y1 - y0, z1 - z0), as returned by crop_volume.
+        """
+        if self.__crop is not None:
+            bounds = tuple((b + c, e + c) for (b, e), (c, _) in zip(bounds, self.__crop))
+        c = self.__chunk_size
+        dim_zyx = self.__stored_dim[::-1]
+        begin_zyx = tuple(b[0] for b in bounds[::-1])
+        end_zyx = tuple(b[1] for b in bounds[::-1])
+        region = np.zeros(tuple(e - b for b, e in zip(begin_zyx, end_zyx)), dtype=np.ubyte)
+        with open(self.__path, 'rb') as f:
+            for brick_zyx in np.ndindex(*(-(-e // c) - b // c for b, e in zip(begin_zyx, end_zyx))):
+                brick_zyx = tuple(b // c + i for b, i in zip(begin_zyx, brick_zyx))
+                idx = (brick_zyx[0] * self.__grid[1] + brick_zyx[1]) * self.__grid[2] + brick_zyx[2]
+                start, stop = int(self.__offsets[idx]), int(self.__offsets[idx + 1])
+                if start == stop:
+                    continue
+
+                f.seek(start)
+                brick_origin = tuple(i * c for i in brick_zyx)
+                brick = np.frombuffer(zlib.decompress(f.read(stop - start)), dtype=np.ubyte).reshape(
+                    tuple(min(c, n - o) for n, o in zip(dim_zyx, brick_origin)))
+                low = tuple(max(b, o) for b, o in zip(begin_zyx, brick_origin))
+                high = tuple(min(e, o + n) for e, o, n in zip(end_zyx, brick_origin, brick.shape))
+                region[tuple(slice(l - b, h - b) for l, h, b in zip(low, high, begin_zyx))] = \
+                    brick[tuple(slice(l - o, h - o) for l, h, o in zip(low, high, brick_origin))]
+
+        return region.reshape(region.shape[::-1])
+
+    def read(self) -> np.ndarray:
+        return self.read_region(tuple((0, n) for n in self.shape))
+
+    def unpack_slab(self, start: int, stop: int) -> np.ndarray:
+        """
+        Reads the slab [start, stop) along the first axis, as PackedVolume.unpack_slab. Only the z planes that hold
+        the slab are read.
+        """
+        x, y, z = self.shape
+        plane_size = x * y
+        begin, end = start * y * z, stop * y * z
+        z0, z1 = begin // plane_size, -(-end // plane_size)
+        planes = self.read_region(((0, x), (0, y), (z0, z1))).reshape(-1)
+        return planes[begin - z0 * plane_size:end - z0 * plane_size].reshape((stop - start, y, z))
+
+    def __array__(self, dtype=None, copy=None):
+        volume = self.read()
+        return volume if dtype is None else volume.astype(dtype, copy=False)
@@ -0,0 +1,39 @@
+"""
+Converts all MINC volumes of a directory to memory-mappable raw volumes, see RawVolume, or to chunked volumes, see
+ChunkedVolume. DataLoader prefers these formats over MINC when both are present, so the output may be written to the
+data directory itself.
+
+Usage: python ConvertMinc.py [--format {npy,raw,chunks}] [--chunk-size N] <input directory> [<output directory>]
+"""
+import argparse
+import os
+
+from ChunkedVolume import CHUNK_SIZE, write_chunked_volume
+from DataLoader import decode_minc_file
+from RawVolume import write_raw_volume
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts MINC label volumes to raw or chunked volumes.')
+    parser.add_argument('input', help='directory that contains the .mnc files')
+    parser.add_argument('output', nargs='?', default=None, help='output directory, defaults to the input directory')
+    parser.add_argument('--format', choices=['npy', 'raw', 'chunks'], default='npy', help='file format of the voxels')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='side length of the bricks of chunked volumes')
+    args = parser.parse_args()
+
+    output = args.output if args.output is not None else args.input
+    os.makedirs(output, exist_ok=True)
+    files = sorted(f for f in os.listdir(args.input) if f.endswith('.mnc'))
+    for idx, file in enumerate(files):
+        volume, geometry = decode_minc_file(os.path.join(args.input, file))
+        target = os.path.join(output, os.path.splitext(file)[0] + '.' + args.format)
+        if args.format == 'chunks':
+            write_chunked_volume(target, volume, geometry, args.chunk_size)
+        else:
+            write_raw_volume(target, volume, geometry)
+        print('[{}/{}] {} -> {}'.format(idx + 1, len(files), file, target))
+
+
+if __name__ == "__main__":
+    main()
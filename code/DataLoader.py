@@ -1,51 +1,602 @@
-from os import listdir
-from os.path import isfile, join
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from os import listdir, stat
+from os.path import getsize, isfile, join, splitext
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import numpy as np
+from vtkmodules.util.misc import calldata_type
 from vtkmodules.util.numpy_support import vtk_to_numpy
+from vtkmodules.util.vtkConstants import VTK_STRING
 from PySide6.QtCore import QThread, Signal
 from vtkmodules.vtkCommonDataModel import vtkImageData
 from vtkmodules.vtkIOMINC import vtkMINCImageReader
 from vtkmodules.vtkImagingCore import vtkImageCast
 
+from ChunkedVolume import ChunkedVolume, is_chunked_volume
+from LabelPacking import LabelVolume, PackedVolume, pack_labels, packed_size, to_vtk_labels
+from LazyVolumeStore import LazyVolumeStore, VolumeHeader
+from ProgressiveVolumeList import ProgressiveVolumeList
+from RawVolume import is_raw_volume, open_raw_volume, read_raw_header
+from SharedVolumes import register_shared_memory, unregister_shared_memory
+from VolumeCache import ImageGeometry, VolumeCache
+from VolumeCropping import Bounds, crop_volume, union_bounding_box
+
+
+class _MincPipeline:
+    """
+    A reader of MINC files and the cast of their voxels to labels, which is reused for many files. VTK does not raise if
+    a file cannot be read but reports an error event and keeps the output of the previous file, so errors are recorded
+    and raised by read.
+    """
+
+    def __init__(self):
+        self.__reader = vtkMINCImageReader()
+        self.__image_cast = vtkImageCast()
+        self.__image_cast.SetInputConnection(0, self.__reader.GetOutputPort())
+        self.__image_cast.SetOutputScalarTypeToUnsignedChar()
+        self.__errors: List[str] = []
+        for algorithm in (self.__reader, self.__image_cast):
+            algorithm.AddObserver('ErrorEvent', self._on_error)
+
+    @calldata_type(VTK_STRING)
+    def _on_error(self, caller, event, message: str):
+        self.__errors.append(message.strip().splitlines()[-1] if message.strip() else 'unknown error')
+
+    def read(self, path: str) -> vtkImageData:
+        self.__errors.clear()
+        self.__reader.SetFileName(path)
+        self.__reader.Update()
+        self.__image_cast.Update()
+        if self.__errors:
+            raise RuntimeError('Volume {} could not be read: {}'.format(path, self.__errors[0]))
+
+        return self.__image_cast.GetOutputDataObject(0)
+
+
+def _get_geometry(image: vtkImageData) -> ImageGeometry:
+    return ImageGeometry(tuple(image.GetExtent()), tuple(image.GetSpacing()), tuple(image.GetOrigin()))
+
+
+def _make_image(geometry: ImageGeometry) -> vtkImageData:
+    image = vtkImageData()
+    image.SetExtent(geometry.extent)
+    image.SetSpacing(geometry.spacing)
+    image.SetOrigin(geometry.origin)
+    return image
+
+
+def decode_minc_file(path: str) -> Tuple[np.ndarray, ImageGeometry]:
+    image = _MincPipeline().read(path)
+    geometry = _get_geometry(image)
+    return vtk_to_numpy(image.GetPointData().GetScalars()).reshape(geometry.dim), geometry
+
+
+def _format_rank(file: str) -> int:
+    """
+    Ranks the volume formats from the fastest to read to the slowest, -1 for files that are no volumes.
+    """
+    if is_raw_volume(file):
+        return 0
+    if is_chunked_volume(file):
+        return 1
+    if file.endswith('.mnc'):
+        return 2
+
+    return -1
+
+
+def _list_data_files(data_path: str) -> List[str]:
+    """
+    Lists the MINC, raw and chunked volumes in the directory. If a volume exists in several formats, only the one that
+    is fastest to read is listed.
+    """
+    files = {}
+    for f in listdir(data_path):
+        if isfile(join(data_path, f)) and _format_rank(f) >= 0:
+            name = splitext(f)[0]
+            if name not in files or _format_rank(f) < _format_rank(files[name]):
+                files[name] = f
+
+    return list(files.values())
+
+
+# Every worker process owns one reader pipeline which is reused for all files that are assigned to it.
+_worker_pipeline: Optional[_MincPipeline] = None
+
+
+def _init_worker():
+    global _worker_pipeline
+    _worker_pipeline = _MincPipeline()
+
+
+def _open_stack(target: Tuple[str, str], shape: Tuple[int, ...]) -> Tuple[Optional[SharedMemory], np.ndarray]:
+    """
+    Opens the volume stack that is described by target, which is either ('shm', <shared memory name>) or
+    ('file', <path of a memory-mapped file>).
+    """
+    kind, name = target
+    if kind == 'file':
+        return None, np.memmap(name, dtype=np.ubyte, mode='r+', shape=shape)
+
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.ubyte, buffer=shm.buf)
+
+
+def _decode_into_stack(slot: int, path: str, target: Tuple[str, str], shape: Tuple[int, int],
+                       dim: Tuple[int, int, int], packed: bool) -> int:
+    """
+    Decodes the MINC file at path and writes the voxels into the given slot of the volume stack described by target.
+    Runs in a worker process.
+    """
+    image = _worker_pipeline.read(path)
+    if _get_geometry(image).dim != dim:
+        raise RuntimeError('Volume {} does not match the dimensions of the data set'.format(path))
+
+    shm, stack = _open_stack(target, shape)
+    try:
+        voxels = vtk_to_numpy(image.GetPointData().GetScalars())
+        if packed:
+            pack_labels(voxels, out=stack[slot])
+        else:
+            stack[slot] = voxels.reshape(dim)
+        if isinstance(stack, np.memmap):
+            stack.flush()
+        del stack
+    finally:
+        if shm is not None:
+            shm.close()
+
+    return slot
+
 
 class DataLoader(QThread):
 
     progress = Signal(int)
+    # emitted as soon as image and data may be used, which is before done for progressive and lazy loads
+    ready = Signal()
+    volume_loaded = Signal(int, object)
+    # emitted for a volume that could not be loaded, which is skipped and stays None in data
+    volume_failed = Signal(int)
     done = Signal()
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, num_workers: int = 0, cache_dir: Optional[str] = None,
+                 stack_file: Optional[str] = None, lazy: bool = False, memory_limit: int = 1 << 11,
+                 progressive: bool = False, packed: bool = False, crop: bool = False, population: bool = False):
+        """
+        :param num_workers: Number of worker processes that decode files in parallel. With 0 or 1 all files are decoded
+        one after another in the loader thread.
+        :param cache_dir: Directory of the persistent cache of decoded volumes. No cache is used if None.
+        :param stack_file: If given, the volume stack is memory-mapped to this file instead of being held in memory.
+        :param lazy: If True, only the headers are read and data is a LazyVolumeStore which decodes volumes on request.
+        :param memory_limit: Limit in MB for the resident volumes of a lazy load.
+        :param progressive: If True, ready is emitted once the first volume is decoded and data is a
+        ProgressiveVolumeList to which the remaining volumes are added as they are decoded.
+        :param packed: If True, volumes are held as PackedVolume with two voxels per byte.
+        :param crop: If True, all volumes and the image are cropped to the bounding box of the non-background voxels of
+        all subjects. If all volumes are chunked, the bounding boxes in their headers are used in every mode and only
+        the cropped region is read. Otherwise the loaded volumes are cropped, which is only done if the whole data set
+        is loaded before ready, i.e. neither lazily nor progressively.
+        :param population: If True, volumes are loaded lazily and stay on disk, so that their users read them slab by
+        slab. Decoded MINC volumes are memory-mapped from the cache, which requires cache_dir.
+        """
         super().__init__(parent)
         self.__data_path = "../Data/"
-        self.__dataFiles = [f for f in listdir(self.__data_path)
-                            if isfile(join(self.__data_path, f))and f.endswith('.mnc')]
+        self.__dataFiles = _list_data_files(self.__data_path)
+        self.__num_workers = num_workers
+        self.__cache = VolumeCache(cache_dir) if cache_dir is not None else None
+        if population and self.__cache is None:
+            print('Population mode without a volume cache keeps decoded MINC volumes in memory.')
+        self.__stack_file = stack_file
+        self.__population = population
+        self.__lazy = lazy or population
+        self.__memory_limit = memory_limit
+        self.__progressive = progressive and not self.__lazy
+        # packing would read the whole volume into memory
+        self.__packed = packed and not population
+        self.__crop = crop
+        # the bounds of a cropped lazy load of chunked volumes
+        self.__lazy_bounds: Optional[Bounds] = None
+        self.__store: Optional[LazyVolumeStore] = None
+        self.__progressive_list: Optional[ProgressiveVolumeList] = None
+        self.__stack: Optional[np.ndarray] = None
+        # the position of a subject's volume in the stack
+        self.__stack_slots: Dict[int, int] = {}
         self.__npDataList = []
+        self.__shared_memory: Optional[SharedMemory] = None
         self.__image = None
+        self.__num_loaded = 0
+        self.__failed: Set[int] = set()
 
     def __len__(self):
         return len(self.__dataFiles)
 
     @property
-    def data(self):
+    def data(self) -> Union[List[np.ndarray], LazyVolumeStore, ProgressiveVolumeList]:
+        """
+        Per-subject views into the volume stack, the store that decodes the volumes on request for a lazy load or the
+        list that is filled during a progressive load.
+        """
+        if self.__lazy:
+            return self.__store
+        if self.__progressive:
+            return self.__progressive_list
+
         return self.__npDataList
 
+    @property
+    def stack(self) -> Optional[np.ndarray]:
+        """
+        The volumes in one contiguous (N, X, Y, Z) array with the subjects on the leading axis. For packed volumes the
+        array has the shape (N, packed_size((X, Y, Z))). Volumes that are memory-mapped from raw files or from the cache
+        are handed through to data instead of being copied, unless they are packed or cropped after loading, and are
+        not part of the stack then. None if no volume had to be copied.
+        """
+        return self.__stack
+
     @property
     def image(self) -> vtkImageData:
         return self.__image
 
+    @property
+    def fingerprint(self) -> str:
+        """
+        Identifies the data set by names, sizes and modification times of its files, which is stable across restarts.
+        """
+        digest = hashlib.sha1()
+        for file in self.__dataFiles:
+            file_stat = stat(self.__data_path + file)
+            digest.update('{}:{}:{};'.format(file, file_stat.st_size, file_stat.st_mtime_ns).encode('utf-8'))
+
+        return digest.hexdigest()
+
     def run(self):
-        reader = vtkMINCImageReader()
-        image_cast = vtkImageCast()
-        image_cast.SetInputConnection(0, reader.GetOutputPort())
-        image_cast.SetOutputScalarTypeToUnsignedChar()
-        for idx, file in enumerate(self.__dataFiles):
-            reader.SetFileName(self.__data_path + file)
-            reader.Update()
-            image_cast.Update()
-            image = image_cast.GetOutputDataObject(0)  # type: vtkImageData
-            ext = image.GetExtent()
-            dim = (ext[1] - ext[0] + 1, ext[3] - ext[2] + 1, ext[5] - ext[4] + 1)
-            self.__npDataList.append(vtk_to_numpy(image.GetPointData().GetScalars()).reshape(dim))
-            self.progress.emit(idx + 1)
-
-        self.__image = image
+        if not self.__dataFiles:
+            self.ready.emit()
+            self.done.emit()
+            return
+
+        self.__num_loaded = 0
+        self.__failed = set()
+        if self.__lazy:
+            self._run_lazy()
+            return
+
+        entries = [self._try_lookup(f) for f in self.__dataFiles]
+        geometry = next((e[1] for e in entries if e is not None), None)
+        if geometry is None:
+            geometry = next((g for f in self.__dataFiles if (g := self._try_read_geometry(f)) is not None), None)
+        if geometry is None:
+            self._skip_all()
+            return
+
+        missing = [idx for idx, entry in enumerate(entries) if entry is None or entry[1] != geometry]
+        # chunked volumes allow to read only the cropped region
+        bounds = self._chunked_bounds(entries) if self.__crop and not missing else None
+        if bounds is not None:
+            print('Volumes cropped from {} to {} voxels.'.format(geometry.dim, tuple(e - b for b, e in bounds)))
+            geometry = geometry.crop(bounds)
+
+        parallel = self.__num_workers > 1 and len(missing) > 1
+        crop_stack = self.__crop and bounds is None and not self.__progressive
+        if self.__packed or crop_stack:
+            mapped = set()
+        else:
+            mapped = {idx for idx, entry in enumerate(entries)
+                      if idx not in missing and isinstance(entry[0], np.memmap)}
+        stacked = [idx for idx in range(len(self.__dataFiles)) if idx not in mapped]
+        self.__stack_slots = {idx: slot for slot, idx in enumerate(stacked)}
+        volume_shape = (packed_size(geometry.dim),) if self.__packed else geometry.dim
+        target = self._allocate_stack((len(stacked),) + volume_shape, parallel) if stacked else None
+        self.__npDataList = [entries[idx][0] if idx in mapped else self.__stack[self.__stack_slots[idx]]
+                             for idx in range(len(self.__dataFiles))]
+        if self.__packed:
+            self.__npDataList = [PackedVolume(v, geometry.dim) for v in self.__npDataList]
+        self.__image = _make_image(geometry)
+        if self.__progressive:
+            # the size is only an estimate, since the geometry of the first volume is assumed for all
+            headers = [VolumeHeader(f, geometry, getsize(self.__data_path + f)) for f in self.__dataFiles]
+            self.__progressive_list = ProgressiveVolumeList(headers)
+            self.__progressive_list.moveToThread(self.thread())
+            self.volume_loaded.connect(self.__progressive_list.set_volume)
+            self.volume_failed.connect(self.__progressive_list.set_failed)
+
+        for idx, entry in enumerate(entries):
+            if idx in mapped:
+                self._loaded(idx)
+            elif idx not in missing:
+                try:
+                    self._put(idx, entry[0] if bounds is None else entry[0].read_region(bounds))
+                except Exception as e:
+                    self._failed(idx, e)
+                    continue
+
+                self._loaded(idx)
+
+        if missing:
+            if parallel:
+                self._run_parallel(missing, geometry, target)
+            else:
+                self._run_sequential(missing, geometry)
+
+        if crop_stack:
+            self._crop(geometry)
+
+        # a progressive load is ready with its first volume, unless no volume could be loaded
+        if not self.__progressive or self.__num_loaded == 0:
+            self.ready.emit()
+
+        self.done.emit()
+
+    def _run_lazy(self):
+        geometries = []
+        for file in self.__dataFiles:
+            geometries.append(self._try_read_geometry(file))
+            self.__num_loaded += 1
+            self.progress.emit(self.__num_loaded)
+
+        if (geometry := next((g for g in geometries if g is not None), None)) is None:
+            self._skip_all()
+            return
+
+        # volumes with unreadable headers are assumed to match the data set and fail once they are decoded
+        headers = [VolumeHeader(file, g or geometry, getsize(self.__data_path + file))
+                   for file, g in zip(self.__dataFiles, geometries)]
+
+        if self.__crop and all(is_chunked_volume(file) for file in self.__dataFiles):
+            bounds = self._chunked_bounds([self._try_lookup(file) for file in self.__dataFiles])
+            if bounds is not None:
+                print('Volumes cropped from {} to {} voxels.'.format(headers[0].geometry.dim,
+                                                                     tuple(e - b for b, e in bounds)))
+                self.__lazy_bounds = bounds
+                headers = [header._replace(geometry=header.geometry.crop(bounds)) for header in headers]
+
+        self.__store = LazyVolumeStore(self.__data_path, headers, self._open_volume, self.__memory_limit)
+        # the store has to deliver its results to the thread of the views, not to the loader thread
+        self.__store.moveToThread(self.thread())
+        self.__image = _make_image(headers[0].geometry)
+        self.ready.emit()
+        self.done.emit()
+
+    def _skip_all(self):
+        print('Error: none of the volumes could be read.')
+        self.__dataFiles = []
+        self.ready.emit()
         self.done.emit()
 
+    def _try_lookup(self, file: str) -> Optional[Tuple[Union[np.ndarray, ChunkedVolume], ImageGeometry]]:
+        """
+        Like _lookup, but a volume that cannot be opened is decoded like any other missing volume, which reports it.
+        """
+        try:
+            return self._lookup(file)
+        except Exception as e:
+            print('Error: could not open volume {}: {}'.format(file, e))
+            return None
+
+    def _lookup(self, file: str) -> Optional[Tuple[Union[np.ndarray, ChunkedVolume], ImageGeometry]]:
+        """
+        Returns the volume if it is available without decoding the MINC file, i.e. if it is memory-mapped from a raw
+        file or from the cache or if it is a chunked volume, which is only read when it is put into the stack.
+        """
+        path = self.__data_path + file
+        if is_raw_volume(file):
+            return open_raw_volume(path)
+        if is_chunked_volume(file):
+            volume = ChunkedVolume(path)
+            return volume, volume.geometry
+
+        return self.__cache.get(path) if self.__cache is not None else None
+
+    def _open_volume(self, path: str) -> Tuple[LabelVolume, ImageGeometry]:
+        """
+        Returns the volume at path and decodes it if necessary. Used by the lazy store on its worker thread. Chunked
+        volumes are not read here but slab by slab by their users, unless they are packed.
+        """
+        if is_raw_volume(path):
+            volume, geometry = open_raw_volume(path)
+        elif is_chunked_volume(path):
+            volume = ChunkedVolume(path, self.__lazy_bounds)
+            geometry = volume.geometry
+        else:
+            entry = self.__cache.get(path) if self.__cache is not None else None
+            if entry is None:
+                entry = decode_minc_file(path)
+                if self.__cache is not None:
+                    try:
+                        self.__cache.put(path, *entry)
+                        if self.__population:
+                            # the decoded volume is dropped in favor of its memory-mapped copy
+                            entry = self.__cache.get(path) or entry
+                    except OSError as e:
+                        print('Could not cache volume {}: {}'.format(path, e))
+
+            volume, geometry = entry
+
+        if self.__packed:
+            volume = PackedVolume.from_labels(np.asarray(volume))
+
+        return volume, geometry
+
+    def _read_geometry(self, file: str) -> ImageGeometry:
+        if is_raw_volume(file) or is_chunked_volume(file):
+            return read_raw_header(self.__data_path + file)
+
+        # Only the header is read here, the geometry is the same for all volumes of the data set.
+        reader = vtkMINCImageReader()
+        reader.SetFileName(self.__data_path + file)
+        reader.UpdateInformation()
+        if reader.GetImageAttributes().GetDimensionNames().GetNumberOfValues() == 0:
+            raise ValueError('the MINC header could not be read')
+
+        return ImageGeometry(tuple(reader.GetDataExtent()), tuple(reader.GetDataSpacing()),
+                             tuple(reader.GetDataOrigin()))
+
+    def _try_read_geometry(self, file: str) -> Optional[ImageGeometry]:
+        try:
+            return self._read_geometry(file)
+        except Exception as e:
+            print('Error: could not read the header of volume {}: {}'.format(file, e))
+            return None
+
+    def _allocate_stack(self, shape: Tuple[int, ...], shared: bool) -> Optional[Tuple[str, str]]:
+        """
+        Allocates the volume stack and returns its description for worker processes if it has to be shared.
+        """
+        if self.__stack_file is not None:
+            self.__stack = np.memmap(self.__stack_file, dtype=np.ubyte, mode='w+', shape=shape)
+            return 'file', self.__stack_file
+
+        if shared:
+            self.__shared_memory = shm = SharedMemory(create=True, size=int(np.prod(shape)))
+            register_shared_memory(shm)
+            self.__stack = np.ndarray(shape, dtype=np.ubyte, buffer=shm.buf)
+            return 'shm', shm.name
+
+        self.__stack = np.empty(shape, dtype=np.ubyte)
+        return None
+
+    @staticmethod
+    def _chunked_bounds(entries: List[Optional[Tuple[LabelVolume, ImageGeometry]]]) -> Optional[Bounds]:
+        """
+        Returns the union of the bounding boxes that are stored in the headers of chunked volumes or None if not all
+        volumes are chunked or if they contain only background.
+        """
+        if not all(entry is not None and isinstance(entry[0], ChunkedVolume) for entry in entries):
+            return None
+
+        boxes = [volume.bounds for volume, _ in entries if volume.bounds is not None]
+        if not boxes:
+            return None
+
+        return tuple((min(b[axis][0] for b in boxes), max(b[axis][1] for b in boxes)) for axis in range(3))
+
+    def _crop(self, geometry: ImageGeometry):
+        bounds = union_bounding_box(self.__stack, geometry.dim, self.__packed)
+        if bounds is None or all(b == (0, d) for b, d in zip(bounds, geometry.dim)):
+            return
+
+        cropped = geometry.crop(bounds)
+        n = len(self.__dataFiles)
+        shape = (n, packed_size(cropped.dim)) if self.__packed else (n,) + cropped.dim
+        volumes = self.__npDataList
+        if self.__stack_file is not None:
+            # compacted in place, which is safe since every volume only moves towards the start of the file
+            self.__stack = np.memmap(self.__stack_file, dtype=np.ubyte, mode='r+', shape=shape)
+        else:
+            self.__stack = np.empty(shape, dtype=np.ubyte)
+
+        for idx, volume in enumerate(volumes):
+            if volume is None:
+                self.__stack[idx] = 0
+            else:
+                self._put(idx, crop_volume(np.asarray(volume), geometry.dim, bounds))
+
+        del volume, volumes
+        if self.__packed:
+            self.__npDataList = [PackedVolume(v, cropped.dim) for v in self.__stack]
+        else:
+            self.__npDataList = list(self.__stack)
+        for idx in self.__failed:
+            self.__npDataList[idx] = None
+
+        # the workers are done, so the shared memory of the uncropped stack is not needed anymore
+        if self.__shared_memory is not None:
+            try:
+                self.__shared_memory.close()
+            except BufferError:
+                pass
+            unregister_shared_memory(self.__shared_memory)
+            self.__shared_memory.unlink()
+            self.__shared_memory = None
+
+        self.__image = _make_image(cropped)
+        self.__image.GetPointData().SetScalars(to_vtk_labels(next(v for v in self.__npDataList if v is not None)))
+        print('Volumes cropped from {} to {} voxels.'.format(geometry.dim, cropped.dim))
+
+    def _put(self, idx: int, volume: np.ndarray):
+        slot = self.__stack_slots[idx]
+        if self.__packed:
+            pack_labels(np.asarray(volume), out=self.__stack[slot])
+        else:
+            self.__stack[slot] = volume
+
+    def _loaded(self, idx: int):
+        self.__num_loaded += 1
+        if self.__num_loaded == 1:
+            self.__image.GetPointData().SetScalars(to_vtk_labels(self.__npDataList[idx]))
+
+        self.progress.emit(self.__num_loaded + len(self.__failed))
+        self.volume_loaded.emit(idx, self.__npDataList[idx])
+        if self.__progressive and self.__num_loaded == 1:
+            self.ready.emit()
+
+    def _failed(self, idx: int, error: Exception):
+        """
+        Skips a volume that could not be loaded. Its slot in the stack is cleared, such that it does not widen the crop.
+        """
+        print('Error: could not load volume {}: {}'.format(self.__dataFiles[idx], error))
+        self.__failed.add(idx)
+        self.__stack[self.__stack_slots[idx]] = 0
+        self.__npDataList[idx] = None
+        self.progress.emit(self.__num_loaded + len(self.__failed))
+        self.volume_failed.emit(idx)
+
+    def _store(self, idx: int, geometry: ImageGeometry):
+        if self.__cache is not None:
+            try:
+                volume = np.asarray(self.__npDataList[idx])
+                self.__cache.put(self.__data_path + self.__dataFiles[idx], volume, geometry)
+            except OSError as e:
+                print('Could not cache volume {}: {}'.format(self.__dataFiles[idx], e))
+
+    def _run_sequential(self, indices: List[int], geometry: ImageGeometry):
+        pipeline = _MincPipeline()
+        for idx in indices:
+            try:
+                image = pipeline.read(self.__data_path + self.__dataFiles[idx])
+                if _get_geometry(image).dim != geometry.dim:
+                    raise RuntimeError('Volume {} does not match the dimensions of the data set'.format(
+                        self.__dataFiles[idx]))
+
+                self._put(idx, vtk_to_numpy(image.GetPointData().GetScalars()).reshape(geometry.dim))
+            except Exception as e:
+                self._failed(idx, e)
+                continue
+
+            self._store(idx, geometry)
+            self._loaded(idx)
+
+    def _run_parallel(self, indices: List[int], geometry: ImageGeometry, target: Tuple[str, str]):
+        # spawn instead of fork, forking a process that runs Qt and VTK threads is not safe
+        with ProcessPoolExecutor(max_workers=self.__num_workers, mp_context=get_context('spawn'),
+                                 initializer=_init_worker) as pool:
+            futures = {pool.submit(_decode_into_stack, self.__stack_slots[idx],
+                                   self.__data_path + self.__dataFiles[idx], target, self.__stack.shape, geometry.dim,
+                                   self.__packed): idx
+                       for idx in indices}
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    # e.g. a file that cannot be decoded or a worker process that died
+                    self._failed(idx, e)
+                    continue
+
+                self._store(idx, geometry)
+                self._loaded(idx)
+
+    def release(self):
+        """
+        Unlinks the shared memory block that backs the volume stack of a parallel load and stops the decoding of a lazy
+        load. The memory stays mapped until the process exits, since the volumes may still be referenced by the views.
+        """
+        if self.__shared_memory is not None:
+            unregister_shared_memory(self.__shared_memory)
+            self.__shared_memory.unlink()
+
+        if self.__store is not None:
+            self.__store.shutdown()
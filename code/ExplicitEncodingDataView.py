@@ -1,29 +1,121 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
-from typing import Dict
+from itertools import groupby
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
-from PySide6.QtCore import Qt, QTimer
-from PySide6.QtWidgets import QVBoxLayout, QSplitter, QSizePolicy, QComboBox, QCheckBox
+from PySide6.QtCore import Qt, QTimer, Signal
+from PySide6.QtWidgets import QVBoxLayout, QSplitter, QSizePolicy, QComboBox, QCheckBox, QPushButton, \
+    QProgressBar, QSpinBox
 from vtkmodules.vtkCommonColor import vtkNamedColors
-from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkCommonCore import vtkLookupTable
+from vtkmodules.vtkCommonDataModel import vtkImageData, vtkPolyData
+from vtkmodules.vtkRenderingAnnotation import vtkScalarBarActor
 from vtkmodules.vtkRenderingCore import vtkRenderer, vtkActor, vtkPolyDataMapper
 
 from BrainWebLabelColorWidget import BrainWebLabelColorWidget
 from FixedQVTKRenderWindowInteractor import QVTKRenderWindowInteractor
-from VolumeOperators import Operator, rebuild
+from LabelMasks import LabelMasks
+from LabelPacking import LabelVolume
+from SurfaceBenchmark import benchmark_surface_distance, benchmark_surface_engines, format_distance_timings, \
+    format_timings
+from SurfaceCache import DistanceKey, SurfaceCache, SurfaceKey
+from SurfaceDistance import DISTANCE_ARRAY, DistanceMethod, label_surface_distance
+from VolumeOperators import LabelCounts, Operator, OperatorPool, SurfaceEngine, VARIABILITY_LABEL, \
+    VARIABILITY_OPERATORS, contour_value, decimate_surface, extract_surfaces, has_iso_value, iso_levels, reduce_labels
 from common import DataView, combo_box_add_enum_items, make_color_value, make_opacity_value
 from common import FloatSlider
 
 
+ShownKey = Union[SurfaceKey, DistanceKey]
+
+
 class ExplicitEncodingDataView(DataView):
+    # emitted by the worker threads with the SurfaceKey or DistanceKey and the surface
+    _surface_extracted = Signal(object, object)
+    # emitted by the worker threads with the key of the full surface, the triangle budget and the decimated surface
+    _lod_extracted = Signal(object, int, object)
+    # emitted by a worker thread with the timings of the surface engines
+    _benchmark_finished = Signal(object)
+    # emitted by a worker thread with the timings of the distance methods
+    _distance_benchmark_finished = Signal(object)
+
     @property
     def name(self):
         return 'Explicit Encoding'
 
-    def __init__(self, image: vtkImageData, gpu_limit: int, parent=None):
+    # time without wheel events after which the full surfaces are shown again
+    idle_delay_ms = 300
+
+    def __init__(self, image: vtkImageData, gpu_limit: int, parent=None, num_workers: int = 1,
+                 surface_cache: Optional[SurfaceCache] = None, lod_triangles: int = 100000,
+                 memory_limit: Optional[int] = None, operator_workers: int = 1):
+        """
+        :param num_workers: Number of threads that extract the surfaces of the labels concurrently.
+        :param surface_cache: Cache of the extracted surfaces. Every surface is extracted again if None.
+        :param lod_triangles: Triangle budget per label of the decimated surfaces that are shown while the camera moves.
+        :param memory_limit: Limit in MB for the operators, which then stream the volumes slab by slab instead of
+        keeping label counts of the selected subjects, see reduce_labels. UNION and INTERSECTION are reduced from
+        bitsets of the labels while they fit into half of the limit.
+        :param operator_workers: Number of worker processes that evaluate the operators slab by slab. Without a limit,
+        they compute the label counts of newly checked labels and the variability, the counts are then updated per
+        subject.
+        """
         super().__init__(gpu_limit, parent)
         self.__template_image = image
         self._volumes = {}
+        self.__surface_cache = surface_cache
+        # Counts and operator results are only accessed by the rebuild thread, which runs the rebuild requests and the
+        # updates of the counts in the order in which they were made. The surfaces are extracted by the workers.
+        self.__rebuilder = ThreadPoolExecutor(max_workers=1)
+        self.__executor = ThreadPoolExecutor(max_workers=max(1, num_workers))
+        # precomputes the iso levels of ADDITION in the background, see _update_sweep
+        self.__sweeper = ThreadPoolExecutor(max_workers=1)
+        self.__memory_limit = memory_limit
+        # full-size counts of every label would exceed the memory limit
+        self.__counts = LabelCounts() if memory_limit is None else None
+        # bitsets of the labels of the streamed subjects within half of the limit, which UNION and INTERSECTION reduce
+        self.__masks = LabelMasks(memory_limit << 19) if memory_limit is not None else None
+        # computes the counts of newly checked labels and the results that are not derived from counts, where the volume
+        # stack of a parallel load is shared with the workers instead of copied
+        self.__pool = OperatorPool(operator_workers) if operator_workers > 1 else None
+        # the operator results per label for the subjects and operator of __images_key, which are contoured again when
+        # the iso value changes. Only computed for labels whose surface is not cached. The variability operators have a
+        # single result under VARIABILITY_LABEL, and __images_key holds the selected labels that mask it.
+        self.__images: Dict[int, vtkImageData] = {}
+        self.__images_key = None
+        # a newer request cancels the pending one and stale work is skipped
+        self.__generation = 0
+        self.__request: Optional[Future] = None
+        # the surface that each checked label should show
+        self.__wanted: Dict[int, ShownKey] = {}
+        self.__sweep_generation = 0
+        self.__sweep_key = None
+        self.__sweep_keys: List[SurfaceKey] = []
+        self.__sweep_request: Optional[Future] = None
+        # the full surface that each checked label shows and its key, None if it is empty
+        self.__shown: Dict[int, Tuple[Optional[ShownKey], vtkPolyData]] = {}
+        # the decimated versions of the shown surfaces with the budget __lod_triangles
+        self.__lods: Dict[ShownKey, vtkPolyData] = {}
+        self.__lods_pending = set()
+        self.__lod_triangles = lod_triangles
+        self.__interacting = False
+        self.__idle_timer = QTimer()
+        self.__idle_timer.setSingleShot(True)
+        self.__idle_timer.timeout.connect(self._end_interaction)
+        self._surface_extracted.connect(self.__set_surface)
+        self._lod_extracted.connect(self.__set_lod)
+        self._benchmark_finished.connect(self.__show_benchmark)
+        self._distance_benchmark_finished.connect(self.__show_distance_benchmark)
+        # colors the surfaces by distance in the distance mode, from blue at 0 to red at the largest shown distance
+        self.__distance_lut = lut = vtkLookupTable()
+        lut.SetHueRange(0.667, 0)
+        lut.SetNanColor(0.5, 0.5, 0.5, 1)
+        lut.Build()
+        self.__distance_bar = bar = vtkScalarBarActor()
+        bar.SetLookupTable(lut)
+        bar.SetTitle('Distance')
+        bar.SetNumberOfLabels(5)
         self.__label_state: Dict[int, QCheckBox] = {}
 
         self.setLayout(layout := QVBoxLayout())
@@ -53,15 +145,28 @@ class ExplicitEncodingDataView(DataView):
         self.__renderer_widget.GetRenderWindow().AddRenderer(self.__renderer)
         self.__actors: Dict[int, vtkActor] = {}
         self.__mappers: Dict[int, vtkPolyDataMapper] = {}
+        # the variability operators contour one result of all checked labels, which replaces their surfaces
+        self.__variability_actor = actor = vtkActor()
+        actor.SetMapper(mapper := vtkPolyDataMapper())
+        mapper.ScalarVisibilityOff()
+        actor.GetProperty().SetOpacity(0.5)
+        actor.VisibilityOff()
+        self.__variability_mapper = mapper
+        self.__renderer.AddActor(actor)
         self._operator_type = next(iter(Operator))
-        self.__iso_slider.setHidden(self._operator_type != Operator.ADDITION)
+        self.__iso_slider.setHidden(not has_iso_value(self._operator_type))
 
         self.__renderer.AutomaticLightCreationOn()
 
         self.__renderer_widget.Initialize()
         self.__renderer_widget.Start()
+        for button in ('Left', 'Middle', 'Right'):
+            self.__renderer_widget.AddObserver(button + 'ButtonPressEvent', lambda *_: self._begin_interaction())
+            self.__renderer_widget.AddObserver(button + 'ButtonReleaseEvent', lambda *_: self._end_interaction())
+        for wheel in ('MouseWheelForwardEvent', 'MouseWheelBackwardEvent'):
+            self.__renderer_widget.AddObserver(wheel, lambda *_: (self._begin_interaction(),
+                                                                  self.__idle_timer.start(self.idle_delay_ms)))
         self.__camara_reset = False
-        self.__flying_edges = None
         self.__label_state[3].toggle()
 
     def __add_ui_to_label_color_widget(self, idx: int, layout):
@@ -79,12 +184,74 @@ class ExplicitEncodingDataView(DataView):
         slider.setMouseTracking(False)
         slider.value_changed += self._set_iso_value
         layout.addWidget(slider)
+        self.__sweep_progress = progress = QProgressBar()
+        progress.setFormat('%v / %m iso surfaces ready')
+        progress.hide()
+        layout.addWidget(progress)
         box.setCurrentIndex(0)
+        self.__surface_engine_box = box = QComboBox()
+        combo_box_add_enum_items(box, SurfaceEngine)
+        box.setToolTip('The algorithm that extracts the label surfaces. DISCRETE_FLYING_EDGES extracts all labels in '
+                       'one pass where their results do not overlap.')
+        box.currentIndexChanged.connect(self._set_surface_engine)
+        layout.addWidget(box)
+        self.__benchmark_btn = btn = QPushButton(text='Benchmark Surface Engines')
+        btn.setToolTip('Measures all surface engines on the shown labels and selects the fastest one.')
+        btn.clicked.connect(self._benchmark)
+        layout.addWidget(btn)
+        self.__distance_mode = check_box = QCheckBox('Surface Distance')
+        check_box.setToolTip('Colors the label surfaces of the first selected volume by their distance to the ones of '
+                             'the second selected volume. Requires exactly two selected volumes.')
+        check_box.toggled.connect(self._set_distance_mode)
+        layout.addWidget(check_box)
+        self.__distance_method_box = box = QComboBox()
+        combo_box_add_enum_items(box, DistanceMethod)
+        box.setToolTip('POINT_LOCATOR measures the distance to the nearest vertex of the other surface, '
+                       'DISTANCE_TRANSFORM interpolates the distance transform of the other label.')
+        box.currentIndexChanged.connect(self._set_distance_method)
+        box.hide()
+        layout.addWidget(box)
+        self.__distance_benchmark_btn = btn = QPushButton(text='Benchmark Distance Methods')
+        btn.setToolTip('Measures the build and query time of all distance methods on the first shown label and '
+                       'selects the fastest one.')
+        btn.clicked.connect(self._benchmark_distance)
+        btn.hide()
+        layout.addWidget(btn)
+        self.__lod_box = box = QSpinBox()
+        box.setRange(1000, 10000000)
+        box.setSingleStep(10000)
+        box.setValue(self.__lod_triangles)
+        box.setKeyboardTracking(False)
+        box.setPrefix('Interaction LOD: ')
+        box.setSuffix(' triangles per label')
+        box.setToolTip('Surfaces with more triangles are shown decimated while the camera moves.')
+        box.valueChanged.connect(self._set_lod_triangles)
+        layout.addWidget(box)
 
     @property
     def operator_type(self) -> Operator:
         return self.__operator_type_box.currentData(Qt.UserRole)
 
+    @property
+    def surface_engine(self) -> SurfaceEngine:
+        return self.__surface_engine_box.currentData(Qt.UserRole)
+
+    @property
+    def distance_method(self) -> DistanceMethod:
+        return self.__distance_method_box.currentData(Qt.UserRole)
+
+    @property
+    def distance_pair(self) -> Optional[Tuple[int, int]]:
+        """
+        The volume whose surfaces are colored and the one they are compared to, in the order of selection. None if not
+        in the distance mode or if not exactly two volumes are selected.
+        """
+        if not self.__distance_mode.isChecked() or len(self._volumes) != 2:
+            return None
+
+        source, target = self._volumes
+        return source, target
+
     def _activate(self):
         print('activate')
         self.__renderer.Render()
@@ -94,26 +261,74 @@ class ExplicitEncodingDataView(DataView):
 
     def add_volume(self, idx: int, volume: np.ndarray):
         self._volumes[idx] = volume
-        self.__iso_slider.set_interval(0, len(self._volumes))
+        self.__rebuilder.submit(self._update_counts, idx, volume)
+        self._update_iso_interval()
         self._update()
 
     def remove_volume(self, idx: int):
         del self._volumes[idx]
-        self.__iso_slider.set_interval(0, len(self._volumes))
+        self.__rebuilder.submit(self._update_counts, idx, None)
+        self._update_iso_interval()
         self._update()
 
     def _set_operator_type(self, idx):
         new_operator = self.__operator_type_box.currentData(Qt.UserRole)
         if self._operator_type != new_operator:
             self._operator_type = new_operator
-            self.__iso_slider.setHidden(new_operator != Operator.ADDITION)
+            self.__iso_slider.setHidden(self.__distance_mode.isChecked() or not has_iso_value(new_operator))
+            self._update_iso_interval()
             self._update()
 
+    def _update_iso_interval(self):
+        # the counts of ADDITION range up to the number of subjects, the variability operators are normalized
+        if self._operator_type in VARIABILITY_OPERATORS:
+            self.__iso_slider.set_interval(0, 1)
+        else:
+            self.__iso_slider.set_interval(0, len(self._volumes))
+
+    def _set_surface_engine(self, idx):
+        self._update()
+
+    def _set_distance_mode(self, checked: bool):
+        if checked and len(self._volumes) != 2:
+            print('The surface distance requires exactly two selected volumes.')
+        self.__operator_type_box.setEnabled(not checked)
+        self.__iso_slider.setHidden(checked or not has_iso_value(self._operator_type))
+        self.__distance_method_box.setVisible(checked)
+        self.__distance_benchmark_btn.setVisible(checked)
+        for mapper in self.__mappers.values():
+            self._configure_mapper(mapper)
+        if checked:
+            self.__renderer.AddViewProp(self.__distance_bar)
+        else:
+            self.__renderer.RemoveViewProp(self.__distance_bar)
+        self._update()
+
+    def _set_distance_method(self, idx):
+        self._update()
+
+    def _configure_mapper(self, mapper: vtkPolyDataMapper):
+        # the surfaces of the distance mode are colored by their distance scalars, the others by their actor
+        if self.__distance_mode.isChecked():
+            mapper.ScalarVisibilityOn()
+            mapper.SetLookupTable(self.__distance_lut)
+            mapper.UseLookupTableScalarRangeOn()
+        else:
+            mapper.ScalarVisibilityOff()
+
+    def _update_distance_range(self):
+        # all labels share the color scale, NaN distances of labels that the target lacks are skipped by GetRange
+        maxima = []
+        for key, surface in self.__shown.values():
+            if isinstance(key, DistanceKey) and (distances := surface.GetPointData().GetArray(DISTANCE_ARRAY)):
+                low, high = distances.GetRange()
+                if low <= high:
+                    maxima.append(high)
+        self.__distance_lut.SetTableRange(0, max(maxima, default=0) or 1)
+
     def _set_iso_value(self, value):
         self.__iso_slider.setMouseTracking(False)
-        for fe in self.__flying_edges:
-            fe.SetValue(0, value)
-        QTimer.singleShot(10, self.__renderer.GetRenderWindow().Render)
+        self._update()
 
     def _toggle_label(self, label: int, value):
         if not value:
@@ -122,13 +337,18 @@ class ExplicitEncodingDataView(DataView):
             actor.SetMapper(None)
             del self.__actors[label]
             del self.__mappers[label]
+            self.__shown.pop(label, None)
+            self.__rebuilder.submit(self._discard_label, label)
+            if self._operator_type in VARIABILITY_OPERATORS:
+                # the variability surface is masked by the remaining labels
+                self._update()
             self.__renderer.GetRenderWindow().Render()
         else:
             self.__renderer.AddActor(actor := vtkActor())
             actor.GetProperty().SetColor(make_color_value(self.__label_color_widget.colors[label]))
             actor.GetProperty().SetOpacity(make_opacity_value(self.__label_color_widget.opacities[label]))
             actor.SetMapper(mapper := vtkPolyDataMapper())
-            mapper.ScalarVisibilityOff()
+            self._configure_mapper(mapper)
             self.__actors[label] = actor
             self.__mappers[label] = mapper
             self._update()
@@ -151,10 +371,386 @@ class ExplicitEncodingDataView(DataView):
             self.__renderer.GetRenderWindow().Render()
 
     def _update(self):
-        labels = [i for i, check_box in self.__label_state.items() if check_box.isChecked()]
-        self.__flying_edges = rebuild(list(self._volumes.values()), labels, self.operator_type, self.__template_image,
-                                      self.__iso_slider.value)
-        for fe, label in zip(self.__flying_edges, labels):
-            self.__mappers[label].SetInputConnection(0, fe.GetOutputPort(0))
+        """
+        Requests the surfaces of all checked labels, or the single surface of the variability operators within them.
+        Surfaces that are cached in memory are handed to their mappers right away, the others are computed in the
+        background and handed to the mappers label by label as they arrive. Until then the mappers keep their previous
+        surfaces, or are emptied if there are no volumes. The request supersedes the previous one, which is cancelled if
+        it has not started yet and skipped where it has.
+        """
+        self.__generation += 1
+        if self.__request is not None:
+            self.__request.cancel()
+            self.__request = None
 
+        operator = self.operator_type
+        value = contour_value(operator, self.__iso_slider.value)
+        engine = self.surface_engine
+        distance_mode = self.__distance_mode.isChecked()
+        pair = self.distance_pair
+        variability = not distance_mode and operator in VARIABILITY_OPERATORS
+        self.__variability_actor.SetVisibility(variability)
+        for actor in self.__actors.values():
+            actor.SetVisibility(not variability)
+        keys = []
+        self.__wanted = {}
+        for label in [VARIABILITY_LABEL] if variability else self.__mappers:
+            if variability and not self.__mappers:
+                self._show(label, None, vtkPolyData())
+                continue
+            elif variability:
+                key = SurfaceKey(frozenset(self._volumes), label, int(operator), value, int(engine),
+                                 frozenset(self.__mappers))
+            elif not distance_mode:
+                key = SurfaceKey(frozenset(self._volumes), label, int(operator), value, int(engine))
+            elif pair is not None:
+                key = DistanceKey(*pair, label, int(self.distance_method), int(engine))
+            else:
+                self._show(label, None, vtkPolyData())
+                continue
+
+            self.__wanted[label] = key
+            if self.__surface_cache is not None and (surface := self.__surface_cache.get(key, load=False)) is not None:
+                self._show(label, key, surface)
+            else:
+                keys.append(key)
+
+        if not self._volumes:
+            for key in keys:
+                self._show(key.label, None, vtkPolyData())
+        elif distance_mode:
+            for key in keys:
+                self.__executor.submit(self._extract_distances, self.__generation, key, self._volumes[key.source],
+                                       self._volumes[key.target])
+        elif keys:
+            self.__request = self.__rebuilder.submit(self._rebuild, self.__generation, list(self._volumes.items()),
+                                                     operator, keys, value, engine)
+
+        self._update_sweep(operator, value, engine)
         self.__renderer_widget.Render()
+
+    def _update_sweep(self, operator: Operator, value: float, engine: SurfaceEngine):
+        """
+        Precomputes the surfaces of all iso levels of ADDITION for the checked labels in the background, the levels
+        nearest to the current one first, such that moving the iso slider only swaps cached surfaces. The sweep is
+        restarted when the subjects, labels or engine change but not when the iso value does. Requires a surface cache.
+        """
+        sweep_key = None
+        if operator == Operator.ADDITION and self.__surface_cache is not None and self._volumes and self.__mappers \
+                and not self.__distance_mode.isChecked():
+            sweep_key = (frozenset(self._volumes), tuple(sorted(self.__mappers)), engine)
+        if sweep_key == self.__sweep_key:
+            return
+
+        self.__sweep_key = sweep_key
+        self.__sweep_generation += 1
+        if self.__sweep_request is not None:
+            self.__sweep_request.cancel()
+            self.__sweep_request = None
+
+        self.__sweep_keys = []
+        if sweep_key is not None:
+            levels = sorted(iso_levels(len(self._volumes)), key=lambda level: abs(level - value))
+            self.__sweep_keys = [SurfaceKey(sweep_key[0], label, int(operator), level, int(engine))
+                                 for level in levels for label in sweep_key[1]]
+            if missing := [key for key in self.__sweep_keys if key not in self.__surface_cache]:
+                self.__sweep_request = self.__rebuilder.submit(self._start_sweep, self.__sweep_generation,
+                                                               list(self._volumes.items()), operator, missing, engine)
+
+        self._update_sweep_progress()
+
+    def _update_sweep_progress(self):
+        self.__sweep_progress.setVisible(bool(self.__sweep_keys))
+        if self.__sweep_keys:
+            ready = [key in self.__surface_cache for key in self.__sweep_keys]
+            self.__sweep_progress.setRange(0, len(ready))
+            self.__sweep_progress.setValue(sum(ready))
+            missing_levels = {key.value for key, r in zip(self.__sweep_keys, ready) if not r}
+            ready_levels = sorted({key.value for key in self.__sweep_keys} - missing_levels)
+            # a level k - 0.5 encloses the voxels of at least k subjects
+            self.__sweep_progress.setToolTip('Iso levels ready: {}'.format(
+                ', '.join(str(int(level + 0.5)) for level in ready_levels) or 'none'))
+
+    def _update_counts(self, idx: int, volume: Optional[LabelVolume]):
+        # runs on the rebuild thread, the pool shares the subjects with its workers just like the counts track them
+        for tracker in (self.__counts, self.__masks, self.__pool):
+            if tracker is None:
+                continue
+            try:
+                if volume is None:
+                    tracker.remove(idx)
+                else:
+                    tracker.add(idx, volume)
+            except Exception as e:
+                print('Could not update the operator state of volume {}: {}'.format(idx, e))
+
+    def _discard_label(self, label: int):
+        # runs on the rebuild thread
+        self.__images.pop(label, None)
+        for tracker in (self.__counts, self.__masks):
+            if tracker is not None:
+                tracker.discard(label)
+
+    def _reduce(self, volumes: List[Tuple[int, LabelVolume]], operator: Operator, labels: List[int],
+                selected: Sequence[int] = ()) -> List[vtkImageData]:
+        """
+        Returns the operator results of the labels, computing those that are missing. Runs on the rebuild thread.
+        :param selected: The labels whose union masks the result of the variability operators, for which labels is
+        [VARIABILITY_LABEL].
+        """
+        variability = operator in VARIABILITY_OPERATORS
+        images_key = (frozenset(idx for idx, _ in volumes), operator, frozenset(selected) if variability else None)
+        if images_key != self.__images_key:
+            self.__images = {}
+            self.__images_key = images_key
+
+        if missing := [label for label in labels if label not in self.__images]:
+            images = reduce_labels([volume for _, volume in volumes], sorted(selected) if variability else missing,
+                                   operator, self.__template_image, counts=self.__counts,
+                                   memory_limit=self.__memory_limit, pool=self.__pool, masks=self.__masks)
+            self.__images.update(zip(missing, images))
+
+        return [self.__images[label] for label in labels]
+
+    def _rebuild(self, generation: int, volumes: List[Tuple[int, LabelVolume]], operator: Operator,
+                 keys: List[SurfaceKey], value: float, engine: SurfaceEngine):
+        # runs on the rebuild thread
+        try:
+            missing = []
+            for key in keys:
+                if self.__surface_cache is not None and (surface := self.__surface_cache.load(key)) is not None:
+                    self._surface_extracted.emit(key, surface)
+                else:
+                    missing.append(key)
+
+            if not missing or generation != self.__generation:
+                return
+
+            images = self._reduce(volumes, operator, [key.label for key in missing], missing[0].labels)
+            if generation != self.__generation:
+                return
+
+            if engine == SurfaceEngine.DISCRETE_FLYING_EDGES:
+                # one pass over a label map of all labels
+                self.__executor.submit(self._extract_surfaces, generation, missing, images, value, engine)
+            else:
+                for key, image in zip(missing, images):
+                    self.__executor.submit(self._extract_surfaces, generation, [key], [image], value, engine)
+        except Exception as e:
+            print('Could not rebuild the surfaces: {}'.format(e))
+
+    def _extract_surfaces(self, generation: int, keys: List[SurfaceKey], images: List[vtkImageData], value: float,
+                          engine: SurfaceEngine):
+        # runs on a worker thread
+        if generation != self.__generation:
+            return
+
+        labels = [key.label for key in keys]
+        try:
+            for key, surface in zip(keys, extract_surfaces(images, labels, value, engine)):
+                if self.__surface_cache is not None:
+                    self.__surface_cache.store(key, surface)
+                self._surface_extracted.emit(key, surface)
+        except Exception as e:
+            print('Could not extract the surfaces of labels {}: {}'.format(labels, e))
+
+    def _extract_distances(self, generation: int, key: DistanceKey, volume: LabelVolume, other: LabelVolume):
+        # runs on a worker thread
+        if generation != self.__generation:
+            return
+
+        try:
+            if self.__surface_cache is None or (surface := self.__surface_cache.load(key)) is None:
+                surface = label_surface_distance(volume, other, key.label, self.__template_image,
+                                                 DistanceMethod(key.method), SurfaceEngine(key.engine))
+                if self.__surface_cache is not None:
+                    self.__surface_cache.store(key, surface)
+            self._surface_extracted.emit(key, surface)
+        except Exception as e:
+            print('Could not compute the surface distance of label {}: {}'.format(key.label, e))
+
+    def _start_sweep(self, generation: int, volumes: List[Tuple[int, LabelVolume]], operator: Operator,
+                     keys: List[SurfaceKey], engine: SurfaceEngine):
+        # runs on the rebuild thread, which owns the counts that all levels are contoured from
+        if generation != self.__sweep_generation:
+            return
+
+        try:
+            labels = sorted({key.label for key in keys})
+            images = dict(zip(labels, self._reduce(volumes, operator, labels)))
+            self.__sweeper.submit(self._sweep, generation, keys, images, engine)
+        except Exception as e:
+            print('Could not precompute the iso levels: {}'.format(e))
+
+    def _sweep(self, generation: int, keys: List[SurfaceKey], images: Dict[int, vtkImageData],
+               engine: SurfaceEngine):
+        # runs on the sweep thread, level by level in the order of keys
+        for level, level_keys in groupby(keys, key=lambda k: k.value):
+            if generation != self.__sweep_generation:
+                return
+
+            try:
+                missing = []
+                for key in level_keys:
+                    if (surface := self.__surface_cache.load(key)) is not None:
+                        self._surface_extracted.emit(key, surface)
+                    else:
+                        missing.append(key)
+
+                labels = [key.label for key in missing]
+                for key, surface in zip(missing, extract_surfaces([images[label] for label in labels], labels, level,
+                                                                  engine)):
+                    self.__surface_cache.store(key, surface)
+                    self._surface_extracted.emit(key, surface)
+            except Exception as e:
+                print('Could not precompute the iso level {}: {}'.format(level, e))
+                return
+
+    def __set_surface(self, key: ShownKey, surface: vtkPolyData):
+        # results of earlier requests are still worth caching
+        if self.__surface_cache is not None:
+            self.__surface_cache.put(key, surface, store=False)
+        if self.__wanted.get(key.label) == key and self._mapper(key.label) is not None:
+            self._show(key.label, key, surface)
+            self.__renderer_widget.Render()
+        if isinstance(key, SurfaceKey) and key.operator == Operator.ADDITION:
+            self._update_sweep_progress()
+
+    def _show(self, label: int, key: Optional[ShownKey], surface: vtkPolyData):
+        """
+        Hands the full surface to the mapper of the label, or its decimated version while the camera moves, and
+        requests the decimated version if there is none.
+        """
+        self.__shown[label] = (key, surface)
+        shown_keys = {k for k, _ in self.__shown.values()}
+        self.__lods = {k: lod for k, lod in self.__lods.items() if k in shown_keys}
+        if key is not None and key not in self.__lods and key not in self.__lods_pending:
+            if surface.GetNumberOfCells() <= self.__lod_triangles:
+                self.__lods[key] = surface
+            else:
+                self.__lods_pending.add(key)
+                self.__executor.submit(self._decimate, key, surface, self.__lod_triangles)
+
+        lod = self.__lods.get(key) if self.__interacting else None
+        self._mapper(label).SetInputDataObject(0, lod if lod is not None else surface)
+        self._update_distance_range()
+
+    def _mapper(self, label: int) -> Optional[vtkPolyDataMapper]:
+        return self.__variability_mapper if label == VARIABILITY_LABEL else self.__mappers.get(label)
+
+    def _decimate(self, key: ShownKey, surface: vtkPolyData, max_triangles: int):
+        # runs on a worker thread
+        try:
+            # the decimated surfaces of the distance mode keep their colors
+            point_arrays = (DISTANCE_ARRAY,) if isinstance(key, DistanceKey) else ()
+            self._lod_extracted.emit(key, max_triangles, decimate_surface(surface, max_triangles, point_arrays))
+        except Exception as e:
+            print('Could not decimate the surface of label {}: {}'.format(key.label, e))
+
+    def __set_lod(self, key: ShownKey, max_triangles: int, lod: vtkPolyData):
+        self.__lods_pending.discard(key)
+        if max_triangles == self.__lod_triangles and any(k == key for k, _ in self.__shown.values()):
+            self.__lods[key] = lod
+            if self.__interacting:
+                self._apply_lods()
+                self.__renderer_widget.Render()
+
+    def _apply_lods(self):
+        for label, (key, surface) in self.__shown.items():
+            lod = self.__lods.get(key) if self.__interacting else None
+            self._mapper(label).SetInputDataObject(0, lod if lod is not None else surface)
+
+    def _begin_interaction(self):
+        self.__idle_timer.stop()
+        if not self.__interacting:
+            self.__interacting = True
+            self._apply_lods()
+
+    def _end_interaction(self):
+        self.__idle_timer.stop()
+        if self.__interacting:
+            self.__interacting = False
+            self._apply_lods()
+            self.__renderer_widget.Render()
+
+    def _set_lod_triangles(self, value: int):
+        self.__lod_triangles = value
+        self.__lods = {}
+        self.__lods_pending = set()
+        for label, (key, surface) in list(self.__shown.items()):
+            self._show(label, key, surface)
+
+    def _benchmark(self):
+        if not self._volumes or not self.__mappers:
+            print('Select volumes and labels to benchmark the surface engines.')
+            return
+
+        self.__benchmark_btn.setEnabled(False)
+        operator = self.operator_type
+        selected = list(self.__mappers)
+        labels = [VARIABILITY_LABEL] if operator in VARIABILITY_OPERATORS else selected
+        self.__rebuilder.submit(self._reduce_for_benchmark, list(self._volumes.items()), operator, labels, selected,
+                                contour_value(operator, self.__iso_slider.value))
+
+    def _reduce_for_benchmark(self, volumes: List[Tuple[int, LabelVolume]], operator: Operator, labels: List[int],
+                              selected: List[int], value: float):
+        # runs on the rebuild thread, the benchmark itself on a worker such that it does not hold up rebuilds
+        try:
+            self.__executor.submit(self._run_benchmark, labels, self._reduce(volumes, operator, labels, selected),
+                                   value)
+        except Exception as e:
+            print('Could not benchmark the surface engines: {}'.format(e))
+            self._benchmark_finished.emit([])
+
+    def _run_benchmark(self, labels: List[int], images: List[vtkImageData], value: float):
+        # runs on a worker thread
+        try:
+            timings = benchmark_surface_engines(images, labels, value)
+        except Exception as e:
+            print('Could not benchmark the surface engines: {}'.format(e))
+            timings = []
+
+        self._benchmark_finished.emit(timings)
+
+    def __show_benchmark(self, timings):
+        self.__benchmark_btn.setEnabled(True)
+        if timings:
+            print('Surface engines on {} volumes:\n{}'.format(len(self._volumes), format_timings(timings)))
+            fastest = min(timings, key=lambda t: t.seconds)
+            # the items are in the order of the enum
+            self.__surface_engine_box.setCurrentIndex(list(SurfaceEngine).index(fastest.engine))
+
+    def _benchmark_distance(self):
+        if (pair := self.distance_pair) is None or not self.__mappers:
+            print('Select two volumes and a label to benchmark the distance methods.')
+            return
+
+        self.__distance_benchmark_btn.setEnabled(False)
+        self.__executor.submit(self._run_distance_benchmark, self._volumes[pair[0]], self._volumes[pair[1]],
+                               next(iter(self.__mappers)), self.surface_engine)
+
+    def _run_distance_benchmark(self, volume: LabelVolume, other: LabelVolume, label: int, engine: SurfaceEngine):
+        # runs on a worker thread
+        try:
+            timings = benchmark_surface_distance(volume, other, label, self.__template_image, engine)
+        except Exception as e:
+            print('Could not benchmark the distance methods: {}'.format(e))
+            timings = []
+
+        self._distance_benchmark_finished.emit(timings)
+
+    def __show_distance_benchmark(self, timings):
+        self.__distance_benchmark_btn.setEnabled(True)
+        if timings:
+            print('Distance methods:\n{}'.format(format_distance_timings(timings)))
+            fastest = min(timings, key=lambda t: t.seconds)
+            self.__distance_method_box.setCurrentIndex(list(DistanceMethod).index(fastest.method))
+
+    def closeEvent(self, event):
+        super().closeEvent(event)
+        self.__sweep_generation += 1
+        self.__sweeper.shutdown(wait=False, cancel_futures=True)
+        self.__rebuilder.shutdown(wait=False, cancel_futures=True)
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+        if self.__pool is not None:
+            self.__pool.shutdown()
@@ -0,0 +1,98 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from LabelPacking import LabelVolume, get_slab, iter_slabs
+
+
+class LabelMasks:
+    """
+    Per-label masks of a set of subjects as bitsets, packed with np.packbits along the last axis into uint64 words. A
+    mask is computed when it is first needed and kept until its subject is removed or its label discarded, so UNION and
+    INTERSECTION reduce one bit per voxel and subject instead of comparing and reducing one byte. The masks are packed
+    slab by slab, memory-mapped or chunked volumes are never read in full.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        """
+        :param max_bytes: Limit for the memory of all masks, see fits. Unlimited if None.
+        """
+        self.__max_bytes = max_bytes
+        self.__volumes: Dict[int, LabelVolume] = {}
+        self.__masks: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def __len__(self):
+        return len(self.__volumes)
+
+    def add(self, idx: int, volume: LabelVolume):
+        self.remove(idx)
+        self.__volumes[idx] = volume
+
+    def remove(self, idx: int):
+        self.__volumes.pop(idx, None)
+        for key in [k for k in self.__masks if k[0] == idx]:
+            del self.__masks[key]
+
+    def discard(self, label: int):
+        """
+        Drops the masks of the label.
+        """
+        for key in [k for k in self.__masks if k[1] == label]:
+            del self.__masks[key]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(m.nbytes for m in self.__masks.values())
+
+    def _mask_shape(self) -> Tuple[int, ...]:
+        # every row is padded to whole words, the padding bits are 0
+        shape = next(iter(self.__volumes.values())).shape
+        return shape[:-1] + (-(-shape[-1] // 64),)
+
+    def fits(self, labels: Sequence[int]) -> bool:
+        """
+        Whether the masks of the labels and the ones that are kept already stay within max_bytes for all subjects.
+        """
+        if self.__max_bytes is None or not self.__volumes:
+            return True
+
+        kept = {label for _, label in self.__masks}
+        mask_bytes = 8 * int(np.prod(self._mask_shape()))
+        return len(kept.union(labels)) * len(self.__volumes) * mask_bytes <= self.__max_bytes
+
+    def _update(self, labels: Sequence[int]):
+        """
+        Computes the missing masks of the labels, unpacking or reading every subject at most once.
+        """
+        mask_shape = self._mask_shape()
+        for idx, volume in self.__volumes.items():
+            missing = [label for label in labels if (idx, label) not in self.__masks]
+            if not missing:
+                continue
+
+            masks = [np.zeros(mask_shape, dtype=np.uint64) for _ in missing]
+            for start, stop in iter_slabs(volume.shape):
+                slab = get_slab(volume, start, stop)
+                for label, mask in zip(missing, masks):
+                    packed = np.packbits(slab == label, axis=-1)
+                    mask[start:stop].view(np.ubyte)[..., :packed.shape[-1]] = packed
+            self.__masks.update(((idx, label), mask) for label, mask in zip(missing, masks))
+
+    def reduce(self, labels: Sequence[int], reduction_op: np.ufunc) -> List[np.ndarray]:
+        """
+        Reduces the masks of all subjects for each label with reduction_op, which is np.bitwise_or or np.bitwise_and.
+        :return: Per label a bool volume that is set where the reduced mask is.
+        """
+        assert self.__volumes
+        self._update(labels)
+        width = next(iter(self.__volumes.values())).shape[-1]
+        results = []
+        for label in labels:
+            masks = [self.__masks[(idx, label)] for idx in self.__volumes]
+            result = masks[0].copy()
+            for mask in masks[1:]:
+                reduction_op(result, mask, out=result)
+
+            results.append(np.unpackbits(result.view(np.ubyte), axis=-1, count=width).view(np.bool_))
+
+        return results
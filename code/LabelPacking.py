@@ -0,0 +1,144 @@
+"""
+4 bit packed storage for label volumes with at most 16 labels, as the BrainWeb label maps. Two voxels share one byte,
+the voxel with the even flat index occupies the low nibble.
+"""
+from typing import Iterator, Tuple, Union
+
+import numpy as np
+from vtkmodules.util.numpy_support import vtk_to_numpy
+from vtkmodules.vtkCommonCore import vtkUnsignedCharArray
+
+from common import convert
+
+MAX_PACKED_LABEL = 15
+# Number of voxels that are unpacked at once when a packed volume is processed slab by slab.
+SLAB_VOXELS = 1 << 22
+
+
+def packed_size(shape: Tuple[int, ...]) -> int:
+    return (int(np.prod(shape)) + 1) // 2
+
+
+def pack_labels(volume: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """
+    Packs the volume into a flat uint8 array of packed_size(volume.shape) bytes.
+    """
+    flat = volume.ravel()
+    if flat.size and flat.max() > MAX_PACKED_LABEL:
+        raise ValueError('Labels above {} can not be packed'.format(MAX_PACKED_LABEL))
+
+    if out is None:
+        out = np.empty(packed_size(volume.shape), dtype=np.ubyte)
+
+    even = flat.size // 2
+    np.left_shift(flat[1:2 * even:2], 4, out=out[:even])
+    out[:even] |= flat[0:2 * even:2]
+    if flat.size % 2:
+        out[-1] = flat[-1]
+
+    return out
+
+
+def unpack_labels(packed: np.ndarray, begin: int, end: int) -> np.ndarray:
+    """
+    Unpacks the voxels with the flat indices [begin, end).
+    """
+    first, last = begin // 2, (end + 1) // 2
+    data = packed[first:last]
+    out = np.empty(2 * data.size, dtype=np.ubyte)
+    np.bitwise_and(data, 0x0F, out=out[0::2])
+    np.right_shift(data, 4, out=out[1::2])
+    offset = begin - 2 * first
+    return out[offset:offset + end - begin]
+
+
+class PackedVolume:
+    """
+    A label volume in packed storage. Behaves like a read-only uint8 array where it matters for the application,
+    converting it with np.asarray unpacks the whole volume.
+    """
+
+    def __init__(self, data: np.ndarray, shape: Tuple[int, ...]):
+        assert data.dtype == np.ubyte and data.size == packed_size(shape)
+        self.__data = data.reshape(-1)
+        self.__shape = tuple(shape)
+
+    @classmethod
+    def from_labels(cls, volume: np.ndarray) -> 'PackedVolume':
+        return cls(pack_labels(volume), volume.shape)
+
+    @property
+    def data(self) -> np.ndarray:
+        return self.__data
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.__shape
+
+    @property
+    def dtype(self):
+        return np.dtype(np.ubyte)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.__shape))
+
+    @property
+    def nbytes(self) -> int:
+        return self.__data.nbytes
+
+    def unpack(self) -> np.ndarray:
+        return unpack_labels(self.__data, 0, self.size).reshape(self.__shape)
+
+    def unpack_slab(self, start: int, stop: int) -> np.ndarray:
+        """
+        Unpacks the slab [start, stop) along the first axis.
+        """
+        slab_size = self.size // self.__shape[0]
+        return unpack_labels(self.__data, start * slab_size, stop * slab_size).reshape(
+            (stop - start,) + self.__shape[1:])
+
+    def __array__(self, dtype=None, copy=None):
+        volume = self.unpack()
+        return volume if dtype is None else volume.astype(dtype, copy=False)
+
+
+# Besides arrays and packed volumes, a volume may be a ChunkedVolume, which provides the same interface as PackedVolume.
+LabelVolume = Union[np.ndarray, PackedVolume]
+
+
+def get_slab(volume: LabelVolume, start: int, stop: int) -> np.ndarray:
+    """
+    Returns the slab [start, stop) along the first axis, which is only unpacked or read for a packed or chunked volume.
+    """
+    if not isinstance(volume, np.ndarray):
+        return volume.unpack_slab(start, stop)
+
+    return volume[start:stop]
+
+
+def iter_slabs(shape: Tuple[int, ...], slab_voxels: int = SLAB_VOXELS) -> Iterator[Tuple[int, int]]:
+    """
+    Splits the first axis into slabs of about slab_voxels voxels.
+    """
+    slab_size = int(np.prod(shape[1:]))
+    step = max(1, slab_voxels // max(1, slab_size))
+    for start in range(0, shape[0], step):
+        yield start, min(start + step, shape[0])
+
+
+def to_vtk_labels(volume: LabelVolume) -> vtkUnsignedCharArray:
+    """
+    Deep copies the volume into a VTK array. Packed and chunked volumes are unpacked slab by slab directly into the VTK
+    array.
+    """
+    if isinstance(volume, np.ndarray):
+        return convert(volume)
+
+    array = vtkUnsignedCharArray()
+    array.SetNumberOfTuples(volume.size)
+    target = vtk_to_numpy(array).reshape(volume.shape)
+    for start, stop in iter_slabs(volume.shape):
+        target[start:stop] = get_slab(volume, start, stop)
+
+    return array
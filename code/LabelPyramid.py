@@ -0,0 +1,159 @@
+"""
+Multi-resolution pyramids of label volumes for interactive previews. Coarser levels are computed by mode pooling, i.e.
+every voxel gets the most frequent label of the block of voxels it covers, so that a level only contains valid labels.
+"""
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PySide6.QtCore import QObject, Signal
+from vtkmodules.vtkCommonDataModel import vtkImageData
+
+from LabelPacking import LabelVolume
+from common import convert
+
+# number of levels besides the full resolution, level l has 2^l times larger voxels
+PYRAMID_LEVELS = 2
+
+
+def _sum_blocks(counts: np.ndarray) -> np.ndarray:
+    """
+    Sums the blocks of 2 x 2 x 2 elements of an array with even side lengths.
+    """
+    counts = counts[:, :, 0::2] + counts[:, :, 1::2]
+    counts = counts[:, 0::2] + counts[:, 1::2]
+    return counts[0::2] + counts[1::2]
+
+
+def downsample_labels(volume: np.ndarray, dim: Tuple[int, int, int], levels: int) -> List[np.ndarray]:
+    """
+    Mode pools blocks of 2^l x 2^l x 2^l voxels for every level l in [1, levels]. The voxel counts of a label are
+    computed once per label and summed up from level to level. Blocks at the upper borders are filled up by repeating
+    the last voxel, ties are resolved in favour of the smaller label.
+    :param volume: Volume of the shape dim in VTK order, i.e. with x running fastest.
+    :return: The pooled volumes with the shapes ceil(dim / 2^l), again in VTK order.
+    """
+    factor = 1 << levels
+    zyx = volume.reshape(dim[::-1])
+    pad = [(0, -n % factor) for n in zyx.shape]
+    if any(p for _, p in pad):
+        zyx = np.pad(zyx, pad, mode='edge')
+
+    count_type = np.ubyte if factor ** 3 <= np.iinfo(np.ubyte).max else np.uint32
+    shapes = [tuple(-(-n // (1 << level)) for n in dim[::-1]) for level in range(1, levels + 1)]
+    modes = [np.zeros(shape, dtype=np.ubyte) for shape in shapes]
+    mode_counts = [np.zeros(shape, dtype=count_type) for shape in shapes]
+    for label in np.flatnonzero(np.bincount(zyx.ravel(), minlength=1)):
+        counts = (zyx == label).astype(count_type)
+        for shape, mode, mode_count in zip(shapes, modes, mode_counts):
+            counts = _sum_blocks(counts)
+            # the padding may add blocks which lie completely outside the volume
+            level_counts = counts[:shape[0], :shape[1], :shape[2]]
+            more = level_counts > mode_count
+            mode[more] = label
+            mode_count[more] = level_counts[more]
+
+    return [mode.reshape(shape[::-1]) for mode, shape in zip(modes, shapes)]
+
+
+def _make_level_image(image: vtkImageData, factor: int) -> vtkImageData:
+    """
+    Returns an image without scalars that covers the same region as image with factor times larger voxels.
+    """
+    extent = image.GetExtent()
+    spacing = image.GetSpacing()
+    origin = image.GetOrigin()
+    level = vtkImageData()
+    level.SetDimensions(*(-(-n // factor) for n in image.GetDimensions()))
+    level.SetSpacing(*(s * factor for s in spacing))
+    # the center of a coarse voxel lies in the center of the block of voxels it was pooled from
+    level.SetOrigin(*(origin[i] + (extent[2 * i] + (factor - 1) / 2) * spacing[i] for i in range(3)))
+    return level
+
+
+class LabelPyramid:
+    """
+    The mode pooled levels of a volume. Level 0 is the full resolution, whose image every widget holds itself, such
+    that only the coarser levels 1 to levels are stored here.
+    """
+
+    def __init__(self, template: vtkImageData, volume: LabelVolume, levels: int = PYRAMID_LEVELS):
+        """
+        :param template: Image without scalars that describes the full resolution of the volume.
+        """
+        self.__dim = template.GetDimensions()
+        self.__images: List[vtkImageData] = []
+        for level, voxels in enumerate(downsample_labels(np.asarray(volume), self.__dim, levels), 1):
+            level_image = _make_level_image(template, 1 << level)
+            level_image.GetPointData().SetScalars(convert(voxels))
+            self.__images.append(level_image)
+
+    def __len__(self):
+        return len(self.__images) + 1
+
+    def __getitem__(self, level: int) -> vtkImageData:
+        assert level > 0
+        return self.__images[level - 1]
+
+    def dim(self, level: int) -> Tuple[int, int, int]:
+        return self.__images[level - 1].GetDimensions() if level > 0 else self.__dim
+
+
+class LabelPyramids(QObject):
+    """
+    The pyramids of the subjects, which are built once per volume on a background thread and shared by every widget
+    that shows the subject. The built signal is emitted on the thread the cache lives in. A pyramid is kept as long as
+    its volume is alive, e.g. until a lazily loaded volume is evicted.
+    """
+
+    built = Signal(int, object)
+    _built = Signal(int, object, object)
+
+    def __init__(self, template: vtkImageData, levels: int = PYRAMID_LEVELS):
+        super().__init__()
+        self.__template = template
+        self.__levels = levels
+        # the volume of a subject and its pyramid, which is None while it is being built
+        self.__pyramids: Dict[int, Tuple[weakref.ref, Optional[LabelPyramid]]] = {}
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+        self._built.connect(self.__on_built)
+
+    def request(self, idx: int, volume: LabelVolume) -> Optional[LabelPyramid]:
+        """
+        Returns the pyramid of the volume if it was built already. Otherwise building is started and the built signal
+        is emitted once the pyramid is available.
+        """
+        entry = self.__pyramids.get(idx, None)
+        if entry is not None and entry[0]() is volume:
+            return entry[1]
+
+        self.__pyramids[idx] = weakref.ref(volume), None
+        self.__executor.submit(self._build, idx, volume)
+        return None
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def _build(self, idx: int, volume: LabelVolume):
+        # runs on the worker thread
+        try:
+            pyramid = LabelPyramid(self.__template, volume, self.__levels)
+        except Exception as e:
+            print('Error: could not build the pyramid of volume {}: {}'.format(idx + 1, e))
+            pyramid = None
+
+        self._built.emit(idx, volume, pyramid)
+
+    def __on_built(self, idx: int, volume: LabelVolume, pyramid: Optional[LabelPyramid]):
+        entry = self.__pyramids.get(idx, None)
+        if entry is None or entry[0]() is not volume:
+            # the subject got another volume in the meantime
+            return
+
+        if pyramid is None:
+            del self.__pyramids[idx]
+            return
+
+        self.__pyramids[idx] = entry[0], pyramid
+        self.built.emit(idx, pyramid)
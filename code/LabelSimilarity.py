@@ -0,0 +1,178 @@
+"""
+Pairwise overlap of the labels of all subjects. The intersections of the label masks of every pair of subjects are
+counted with popcounts of the packed masks, slab by slab and on several threads, from which the Dice and Jaccard
+matrices of every label follow. Subjects that are not resident are packed into bitsets one at a time instead, see
+pack_label_masks.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+from LabelPacking import LabelVolume, get_slab, iter_slabs
+
+# Number of voxels per slab. The slabs of all subjects and their packed masks of one label stay in the cache while the
+# pairs are counted, and a volume yields enough slabs to keep all threads busy.
+SIMILARITY_SLAB_VOXELS = 1 << 18
+
+# number of set bits of every byte, for numpy versions without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """
+    Counts the set bits of the uint64 words along the last axis.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+    return _POPCOUNT_TABLE[words.view(np.ubyte)].sum(axis=-1, dtype=np.int64)
+
+
+class SimilarityMetric(IntEnum):
+    DICE = 0
+    JACCARD = 1
+
+
+class SimilarityMatrices(NamedTuple):
+    # indices of the subjects in the order of the rows and columns
+    subjects: List[int]
+    labels: List[int]
+    # number of voxels at which both subjects have the label, per label an N x N matrix whose diagonal holds the number
+    # of voxels of the label of each subject
+    intersections: np.ndarray
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return np.diagonal(self.intersections, axis1=1, axis2=2)
+
+    @property
+    def unions(self) -> np.ndarray:
+        sizes = self.sizes
+        return sizes[:, :, None] + sizes[:, None, :] - self.intersections
+
+    @property
+    def dice(self) -> np.ndarray:
+        """
+        2 |A & B| / (|A| + |B|) per label and pair of subjects, 1 if neither subject has the label.
+        """
+        sizes = self.sizes
+        return _ratio(2 * self.intersections, sizes[:, :, None] + sizes[:, None, :])
+
+    @property
+    def jaccard(self) -> np.ndarray:
+        """
+        |A & B| / |A | B| per label and pair of subjects, 1 if neither subject has the label.
+        """
+        return _ratio(self.intersections, self.unions)
+
+    def matrix(self, label: int, metric: SimilarityMetric) -> np.ndarray:
+        """
+        The N x N matrix of the metric for the label.
+        """
+        k = self.labels.index(label)
+        return self.dice[k] if metric == SimilarityMetric.DICE else self.jaccard[k]
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    # two empty masks are identical
+    result = np.ones(numerator.shape, dtype=np.float64)
+    np.divide(numerator, denominator, out=result, where=denominator > 0)
+    return result
+
+
+def _count_slab(volumes: Sequence[LabelVolume], labels: Sequence[int], start: int, stop: int) -> np.ndarray:
+    """
+    Counts the intersections of all pairs of subjects within the slab [start, stop) for each label, the upper triangle
+    only.
+    """
+    n = len(volumes)
+    slabs = [get_slab(volume, start, stop).reshape(-1) for volume in volumes]
+    # padded to whole words, the padding bits are 0 in all masks and do not count
+    words = -(-slabs[0].size // 64)
+    bits = np.zeros((n, words * 8), dtype=np.ubyte)
+    masks = bits.view(np.uint64)
+    counts = np.zeros((len(labels), n, n), dtype=np.int64)
+    for k, label in enumerate(labels):
+        for i, slab in enumerate(slabs):
+            packed = np.packbits(slab == label)
+            bits[i, :packed.size] = packed
+
+        for i in range(n):
+            counts[k, i, i:] = popcount(masks[i:] & masks[i])
+
+    return counts
+
+
+def pairwise_similarity(volumes: Sequence[LabelVolume], labels: Sequence[int], subjects: Sequence[int] = None,
+                        num_workers: int = 1) -> SimilarityMatrices:
+    """
+    Computes the intersections of the label masks of every pair of subjects in a single pass over the volumes. The
+    masks of one slab are packed into uint64 words, so a pair costs one AND and one popcount per 64 voxels. Slabs are
+    processed concurrently by num_workers threads, the memory besides the volumes is one slab per thread.
+    :param subjects: Indices of the subjects that label the rows and columns, by default their position in volumes.
+    """
+    assert volumes
+    labels = list(labels)
+    subjects = list(range(len(volumes)) if subjects is None else subjects)
+    assert len(subjects) == len(volumes)
+    n = len(volumes)
+    intersections = np.zeros((len(labels), n, n), dtype=np.int64)
+    slabs = list(iter_slabs(volumes[0].shape, SIMILARITY_SLAB_VOXELS))
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        for counts in executor.map(lambda slab: _count_slab(volumes, labels, *slab), slabs):
+            intersections += counts
+
+    return SimilarityMatrices(subjects, labels, _mirror(intersections))
+
+
+def _mirror(intersections: np.ndarray) -> np.ndarray:
+    # copies the upper triangle of every label into the lower one
+    lower = np.tril_indices(intersections.shape[1], -1)
+    intersections[:, lower[0], lower[1]] = intersections[:, lower[1], lower[0]]
+    return intersections
+
+
+def pack_label_masks(volume: LabelVolume, labels: Sequence[int]) -> np.ndarray:
+    """
+    Packs the masks of the labels of one subject into bitsets, slab by slab, such that the volume need not be kept
+    while the bitsets of the other subjects are computed. Every slab is padded to whole words, the padding bits are 0
+    and the layout only depends on the shape of the volume, so the bitsets of subjects of the same shape line up.
+    :return: A (labels, words) array of uint64 words, an eighth of the size of a label mask of the volume.
+    """
+    slabs = list(iter_slabs(volume.shape, SIMILARITY_SLAB_VOXELS))
+    plane = int(np.prod(volume.shape[1:]))
+    offsets = np.cumsum([0] + [-(-(stop - start) * plane // 64) for start, stop in slabs])
+    bits = np.zeros((len(labels), int(offsets[-1]) * 8), dtype=np.ubyte)
+    for (start, stop), offset in zip(slabs, offsets):
+        slab = get_slab(volume, start, stop).reshape(-1)
+        for k, label in enumerate(labels):
+            packed = np.packbits(slab == label)
+            bits[k, offset * 8:offset * 8 + packed.size] = packed
+
+    return bits.view(np.uint64)
+
+
+def mask_similarity(masks: Sequence[np.ndarray], labels: Sequence[int], subjects: Sequence[int] = None,
+                    num_workers: int = 1) -> SimilarityMatrices:
+    """
+    Computes the intersections of every pair of subjects from their bitsets, see pack_label_masks, with one AND and one
+    popcount per 64 voxels. The rows of the upper triangle are counted concurrently by num_workers threads.
+    :param subjects: Indices of the subjects that label the rows and columns, by default their position in masks.
+    """
+    assert masks
+    labels = list(labels)
+    subjects = list(range(len(masks)) if subjects is None else subjects)
+    assert len(subjects) == len(masks)
+    n = len(masks)
+    intersections = np.zeros((len(labels), n, n), dtype=np.int64)
+
+    def count_row(i: int):
+        for j in range(i, n):
+            intersections[:, i, j] = popcount(masks[i] & masks[j])
+
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        list(executor.map(count_row, range(n)))
+
+    return SimilarityMatrices(subjects, labels, _mirror(intersections))
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from PySide6.QtCore import QObject, Signal
+
+from VolumeCache import ImageGeometry
+
+
+class VolumeHeader(NamedTuple):
+    file: str
+    geometry: ImageGeometry
+    file_size: int
+
+
+class LazyVolumeStore(QObject):
+    """
+    Holds the headers of all volumes of the data set but decodes the voxels of a volume only once it is requested.
+    Decoding happens on a background thread, the loaded signal is emitted on the thread the store lives in.
+    Requested volumes are pinned until they are released. Volumes that are not pinned anymore stay resident until the
+    memory limit is exceeded and are then evicted in least recently used order.
+    """
+
+    loaded = Signal(int)
+    # emitted instead of loaded if the volume could not be decoded, the volume stays pinned until it is released
+    failed = Signal(int)
+    _decoded = Signal(int, object)
+
+    def __init__(self, data_path: str, headers: List[VolumeHeader],
+                 decoder: Callable[[str], Tuple[np.ndarray, ImageGeometry]], memory_limit: int):
+        """
+        :param decoder: Decodes the file at the given path and returns its voxels and geometry. Called on the worker
+        thread.
+        :param memory_limit: Limit in MB for the voxels of all resident volumes.
+        """
+        super().__init__()
+        self.__data_path = data_path
+        self.__headers = headers
+        self.__decoder = decoder
+        self.__memory_limit = memory_limit
+        self.__volumes: 'OrderedDict[int, np.ndarray]' = OrderedDict()
+        self.__pending: Set[int] = set()
+        self.__pinned: Set[int] = set()
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+        self._decoded.connect(self.__on_decoded)
+
+    def __len__(self):
+        return len(self.__headers)
+
+    def __getitem__(self, idx: int) -> Optional[np.ndarray]:
+        """
+        Returns the volume if it is resident, None otherwise.
+        """
+        volume = self.__volumes.get(idx, None)
+        if volume is not None:
+            self.__volumes.move_to_end(idx)
+
+        return volume
+
+    @property
+    def headers(self) -> List[VolumeHeader]:
+        return self.__headers
+
+    @property
+    def resident_size(self) -> int:
+        """
+        Size of all resident volumes in bytes.
+        """
+        return sum(v.nbytes for v in self.__volumes.values())
+
+    def is_loaded(self, idx: int) -> bool:
+        return idx in self.__volumes
+
+    def peek(self, idx: int) -> Optional[np.ndarray]:
+        """
+        Returns the volume if it is resident, None otherwise, without counting as a use for the eviction order.
+        """
+        return self.__volumes.get(idx, None)
+
+    def request(self, idx: int) -> Optional[np.ndarray]:
+        """
+        Pins the volume and returns it if it is resident. Otherwise decoding is started and the loaded signal is
+        emitted once the volume is available.
+        """
+        self.__pinned.add(idx)
+        volume = self[idx]
+        if volume is None and idx not in self.__pending:
+            self.__pending.add(idx)
+            self.__executor.submit(self._decode, idx)
+
+        return volume
+
+    def release(self, idx: int):
+        """
+        Unpins the volume such that it may be evicted.
+        """
+        self.__pinned.discard(idx)
+        self._evict()
+
+    def set_memory_limit(self, limit: int):
+        self.__memory_limit = limit
+        self._evict()
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def decode(self, idx: int) -> Optional[np.ndarray]:
+        """
+        Decodes the volume on the calling thread without making it resident, e.g. for a single pass over all volumes.
+        Returns None if it could not be decoded.
+        """
+        header = self.__headers[idx]
+        try:
+            volume, geometry = self.__decoder(self.__data_path + header.file)
+        except Exception as e:
+            print('Error: could not decode volume {}: {}'.format(header.file, e))
+            return None
+
+        if geometry.dim != header.geometry.dim:
+            print('Error: volume {} does not match the dimensions of the data set.'.format(header.file))
+            return None
+
+        return volume
+
+    def _decode(self, idx: int):
+        # runs on the worker thread
+        self._decoded.emit(idx, self.decode(idx))
+
+    def __on_decoded(self, idx: int, volume: Optional[np.ndarray]):
+        self.__pending.discard(idx)
+        if volume is None:
+            self.failed.emit(idx)
+            return
+
+        self.__volumes[idx] = volume
+        self._evict()
+        self.loaded.emit(idx)
+
+    def _evict(self):
+        limit = self.__memory_limit << 20
+        size = self.resident_size
+        for idx in [i for i in self.__volumes if i not in self.__pinned]:
+            if size <= limit:
+                break
+
+            size -= self.__volumes.pop(idx).nbytes
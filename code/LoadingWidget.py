@@ -7,9 +7,9 @@ from DataLoader import DataLoader
 
 class LoadingWidget(QWidget):
 
-    def __init__(self, cb: Callable[[], None]):
+    def __init__(self, cb: Callable[[], None], data_loader: DataLoader):
         super().__init__()
-        self.__data_loader = DataLoader()
+        self.__data_loader = data_loader
         self.__cb = cb
         self.__ready = False
         self.__label = QLabel()
@@ -22,7 +22,7 @@ class LoadingWidget(QWidget):
         self.__progress_bar.setValue(0)
         self.__data_loader.progress.connect(lambda p: self.__progress_bar.setValue(p))
         self.vertical_layout.addWidget(self.__progress_bar)
-        self.__data_loader.done.connect(self.__done)
+        self.__data_loader.ready.connect(self.__done)
         self.__data_loader.start()
 
     @property
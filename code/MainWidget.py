@@ -1,27 +1,50 @@
-from typing import List
+from typing import List, Optional, Set, Union
 
 import numpy as np
+from PySide6.QtCore import Qt
 from PySide6.QtGui import QGuiApplication
 from PySide6.QtWidgets import QWidget, QSplitter, QVBoxLayout, QTabWidget, QSizePolicy
 from vtkmodules.vtkCommonDataModel import vtkImageData
 
+from BrainWebLabelColorWidget import brainweb_label_settings
+from LazyVolumeStore import LazyVolumeStore
 from PreservingDataView import PreservingDataView
+from ProgressiveVolumeList import ProgressiveVolumeList
+from SimilarityWidget import SimilarityWidget
+from SurfaceCache import SurfaceCache
 from VolumeListWidget import VolumeListWidget
 from ExplicitEncodingDataView import ExplicitEncodingDataView
 
 
 class MainWidget(QWidget):
 
-    def __init__(self, image: vtkImageData, volume_list: List[np.ndarray], gpu_mem_limit: int):
+    def __init__(self, image: vtkImageData,
+                 volume_list: Union[List[np.ndarray], LazyVolumeStore, ProgressiveVolumeList], gpu_mem_limit: int,
+                 surface_workers: int = 1, surface_cache: Optional[SurfaceCache] = None, similarity_workers: int = 1,
+                 population_mem_limit: Optional[int] = None, operator_workers: int = 1):
+        """
+        :param surface_workers: Number of threads that extract surfaces in the explicit encoding view.
+        :param surface_cache: Cache of the surfaces of the explicit encoding view.
+        :param similarity_workers: Number of threads that compare the labels of the volumes.
+        :param population_mem_limit: Limit in MB for the operators of the explicit encoding view, which then stream the
+        volumes from disk. None keeps the label counts of the selected volumes in memory.
+        :param operator_workers: Number of processes that evaluate the operators of the explicit encoding view.
+        """
         super().__init__()
+        self.__volume_list = volume_list
         self.__volume_list_widget = VolumeListWidget(volume_list,
                                                      selection_added_cb=self.add_volume,
-                                                     selection_removed_cb=self.remove_volume)
+                                                     selection_removed_cb=self.remove_volume,
+                                                     selection_pending_cb=self.set_volume_pending)
         # Main Split
         self.setLayout(QVBoxLayout())
         self.layout().addWidget(splitter := QSplitter())
         splitter.setChildrenCollapsible(False)
-        splitter.addWidget(self.__volume_list_widget)
+        splitter.addWidget(volume_splitter := QSplitter(Qt.Vertical))
+        volume_splitter.addWidget(self.__volume_list_widget)
+        self.__similarity_widget = SimilarityWidget(volume_list, [(s.label, s.name) for s in brainweb_label_settings()],
+                                                    similarity_workers)
+        volume_splitter.addWidget(self.__similarity_widget)
 
         self.__dataViews = QTabWidget()
         splitter.addWidget(self.__dataViews)
@@ -29,24 +52,47 @@ class MainWidget(QWidget):
         splitter.setSizes([self.__volume_list_widget.sizeHint().width(), max_width])
 
         self.__dataViews.addTab(view := PreservingDataView(image, gpu_mem_limit), view.name)
-        self.__dataViews.addTab(view := ExplicitEncodingDataView(image, gpu_mem_limit), view.name)
+        self.__dataViews.addTab(view := ExplicitEncodingDataView(image, gpu_mem_limit, num_workers=surface_workers,
+                                                                 surface_cache=surface_cache,
+                                                                 memory_limit=population_mem_limit,
+                                                                 operator_workers=operator_workers), view.name)
         self.__last_tab_idx = 0
 
         self.__active_volumes = {}
+        self.__pending_volumes: Set[int] = set()
 
         self.__dataViews.currentChanged.connect(self._handle_data_view_changed)
         self.__dataViews.setCurrentIndex(self.__last_tab_idx)
-        self.__volume_list_widget.item(0).setSelected(True)
+        # start with a volume that is already available, which need not be the first one in a progressive load. A lazy
+        # store decodes its first volume once selected and deselects it again if that fails. A progressive load without
+        # an available volume selects the first one that arrives, and a data set without any selects none.
+        first = next((i for i in range(len(volume_list)) if volume_list[i] is not None), None)
+        if first is None and isinstance(volume_list, LazyVolumeStore) and len(volume_list):
+            first = 0
+        if first is not None:
+            self.__volume_list_widget.item(first).setSelected(True)
+        elif isinstance(volume_list, ProgressiveVolumeList):
+            volume_list.loaded.connect(self._select_first_volume)
+
+    def _select_first_volume(self, idx: int):
+        self.__volume_list.loaded.disconnect(self._select_first_volume)
+        # the user may have selected a volume that is still loading meanwhile
+        if not self.__volume_list_widget.selectedItems():
+            self.__volume_list_widget.item(idx).setSelected(True)
 
     def _handle_data_view_changed(self, idx: int):
         for i in self.__active_volumes:
             self.__dataViews.widget(self.__last_tab_idx).remove_volume(i)
+        for i in self.__pending_volumes:
+            self.__dataViews.widget(self.__last_tab_idx).remove_placeholder(i)
 
         self.__dataViews.widget(self.__last_tab_idx).active = False
         self.__last_tab_idx = idx
         self.__dataViews.widget(self.__last_tab_idx).active = True
         for i, volume in self.__active_volumes.items():
             self.__dataViews.widget(self.__last_tab_idx).add_volume(i, volume)
+        for i in self.__pending_volumes:
+            self.__dataViews.widget(self.__last_tab_idx).add_placeholder(i)
 
     def add_volume(self, idx: int, volume: np.ndarray):
         print('Volume {} added.'.format(idx))
@@ -58,6 +104,14 @@ class MainWidget(QWidget):
         del self.__active_volumes[idx]
         self.__dataViews.currentWidget().remove_volume(idx)
 
+    def set_volume_pending(self, idx: int, pending: bool):
+        if pending:
+            self.__pending_volumes.add(idx)
+            self.__dataViews.currentWidget().add_placeholder(idx)
+        else:
+            self.__pending_volumes.discard(idx)
+            self.__dataViews.currentWidget().remove_placeholder(idx)
+
     def gpu_mem_limit_changed(self, limit: int):
         print('GPU memory limit changed to {} MB'.format(limit))
         for idx in range(self.__dataViews.count()):
@@ -65,5 +119,6 @@ class MainWidget(QWidget):
 
     def closeEvent(self, event):
         super().closeEvent(event)
+        self.__similarity_widget.close()
         for idx in range(self.__dataViews.count()):
             self.__dataViews.widget(idx).close()
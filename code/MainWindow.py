@@ -3,8 +3,10 @@ from typing import Optional
 from PySide6.QtGui import QAction
 from PySide6.QtWidgets import QMainWindow, QApplication, QMenu
 
+from DataLoader import DataLoader
 from LoadingWidget import LoadingWidget
 from MainWidget import MainWidget
+from SurfaceCache import SurfaceCache
 from settings import Settings
 from settings.Popup import Popup
 
@@ -12,10 +14,21 @@ from settings.Popup import Popup
 class MainWindow(QMainWindow):
     def __init__(self, app: QApplication,  parent=None):
         super().__init__(parent)
-        self.__loading_widget = LoadingWidget(lambda: self.start_app(self.__loading_widget.result))
+        self.__settings = Settings()
+        # the loader is kept alive since it owns the memory of the loaded volumes
+        self.__data_loader = DataLoader(num_workers=self.__settings.loader_workers,
+                                        cache_dir=self.__settings.volume_cache_dir,
+                                        stack_file=self.__settings.volume_stack_file,
+                                        lazy=self.__settings.lazy_loading or self.__settings.population_mode,
+                                        memory_limit=self.__settings.volume_mem_limit,
+                                        progressive=self.__settings.progressive_loading,
+                                        packed=self.__settings.packed_volumes,
+                                        crop=self.__settings.crop_volumes,
+                                        population=self.__settings.population_mode)
+        self.__loading_widget = LoadingWidget(lambda: self.start_app(self.__loading_widget.result),
+                                              self.__data_loader)
         self.__main_widget: Optional[MainWidget] = None
         self.__app = app
-        self.__settings = Settings()
         self.__settings.gpu_mem_limit_changed += self.gpu_mem_limit_changed
         self._create_actions()
         self._create_menu_bar()
@@ -31,7 +44,16 @@ class MainWindow(QMainWindow):
         self.__loading_widget = None
 
         data, image = result
-        self.__main_widget = MainWidget(image, data, self.__settings.gpu_mem_limit)
+        # surfaces depend on the data set and on the geometry of the image, which changes with cropping
+        namespace = '{}:{}:{}:{}'.format(self.__data_loader.fingerprint, image.GetExtent(), image.GetSpacing(),
+                                          image.GetOrigin())
+        surface_cache = SurfaceCache(self.__settings.surface_cache_mem_limit, self.__settings.surface_cache_dir,
+                                     namespace)
+        # in population mode the operators stream the volumes within the limit instead of keeping label counts
+        population_mem_limit = self.__settings.population_mem_limit if self.__settings.population_mode else None
+        self.__main_widget = MainWidget(image, data, self.__settings.gpu_mem_limit, self.__settings.surface_workers,
+                                        surface_cache, self.__settings.similarity_workers, population_mem_limit,
+                                        self.__settings.operator_workers)
         self.setCentralWidget(self.__main_widget)
         screen_size = self.__app.primaryScreen().availableGeometry().size()
         self.resize(screen_size * 0.7)
@@ -53,5 +75,7 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         super().closeEvent(event)
-        self.__main_widget.close()
+        if self.__main_widget is not None:
+            self.__main_widget.close()
+        self.__data_loader.release()
         Popup.close_all()
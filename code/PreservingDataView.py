@@ -10,6 +10,7 @@ from vtkmodules.vtkCommonDataModel import vtkImageData, vtkColor3ub
 
 from BrainWebLabelColorWidget import BrainWebLabelColorWidget
 from InterchangeableViewHelper import InterchangeableView, SmoothType
+from LabelPyramid import LabelPyramid, LabelPyramids
 from RenderWidget import SynchronizedRenderWidget
 from common import DataView, combo_box_add_enum_items, FloatSlider
 
@@ -25,6 +26,9 @@ class PreservingDataView(DataView):
         self._interchangeableView: Optional[InterchangeableView] = None
         self.__template_image = image
         self.__render_widgets: Dict[int, SynchronizedRenderWidget] = {}
+        self.__placeholders: Dict[int, QLabel] = {}
+        self.__pyramids = LabelPyramids(image)
+        self.__pyramids.built.connect(self._set_pyramid)
         self.setLayout(layout := QVBoxLayout())
         self.__create_settings_ui(layout)
 
@@ -70,6 +74,9 @@ class PreservingDataView(DataView):
         self.__progressive_bt.setToolTip('Turn off if CPU renderers stay blurry. May stall the the application if the '
                                          'load is to heavy for the system. If possible, for best performance increase '
                                          'the GPU memory limit in the settings.')
+        self.__preview_btn = button('Low Resolution Preview', self._set_preview, True)
+        self.__preview_btn.setToolTip('Render downsampled volumes while the camera moves and in views that are too '
+                                      'small to show all voxels.')
         self.__interchangeable_btn = button('Interchangeable', self._set_interchangeable,
                                             toggled=self.is_interchangeable)
 
@@ -167,7 +174,7 @@ class PreservingDataView(DataView):
             render_widget = SynchronizedRenderWidget(
                 is_gpu, image, volume, idx, self.__label_color_widget.colors, self.__label_color_widget.opacities,
                 shaded=self.__shaded_btn.isChecked(), progressive=self.__progressive_bt.isChecked(),
-                off_screen=self.is_interchangeable
+                off_screen=self.is_interchangeable, preview=self.__preview_btn.isChecked()
             )
 
             render_widget.active = True
@@ -177,12 +184,19 @@ class PreservingDataView(DataView):
 
             self.__render_widgets[idx] = render_widget
 
+        if (pyramid := self.__pyramids.request(idx, volume)) is not None:
+            render_widget.set_pyramid(pyramid)
+
         self._layout_renderers()
 
         if self.is_interchangeable:
             self._interchangeableView.add(self.__render_widgets[idx])
             self.__interchangeable_slider.set_interval(0, max(0, self._interchangeableView.count - 1))
 
+    def _set_pyramid(self, idx: int, pyramid: LabelPyramid):
+        if idx in self.__render_widgets:
+            self.__render_widgets[idx].set_pyramid(pyramid)
+
     def remove_volume(self, idx: int):
         if idx in self.__render_widgets:
             renderer = self.__render_widgets[idx]
@@ -196,6 +210,19 @@ class PreservingDataView(DataView):
 
         self._layout_renderers()
 
+    def add_placeholder(self, idx: int):
+        if idx not in self.__placeholders:
+            self.__placeholders[idx] = placeholder = QLabel('Loading Volume {}...'.format(idx + 1))
+            placeholder.setAlignment(Qt.AlignCenter)
+            placeholder.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+            self._layout_renderers()
+
+    def remove_placeholder(self, idx: int):
+        if (placeholder := self.__placeholders.pop(idx, None)) is not None:
+            placeholder.setParent(None)
+            placeholder.deleteLater()
+            self._layout_renderers()
+
     def _update_iso_opacities(self, idx: int, opacity: float):
         for renderer in self.__render_widgets.values():
             renderer.update_label_opacity(idx, opacity)
@@ -212,6 +239,10 @@ class PreservingDataView(DataView):
         for renderer in self.__render_widgets.values():
             renderer.progressive = value
 
+    def _set_preview(self, value: bool):
+        for renderer in self.__render_widgets.values():
+            renderer.preview = value
+
     def _set_interchangeable(self, value: bool):
         if self.is_interchangeable != value:
             if value:
@@ -240,6 +271,8 @@ class PreservingDataView(DataView):
     def _layout_renderers(self):
         for renderer in self.__render_widgets.values():
             renderer.setParent(None)
+        for placeholder in self.__placeholders.values():
+            placeholder.setParent(None)
 
         if self.is_interchangeable:
             rect = self.__grid_container.contentsRect()
@@ -256,12 +289,12 @@ class PreservingDataView(DataView):
             self.__grid_container.setLayout(layout := QGridLayout())
             layout.setSpacing(0)
             layout.setContentsMargins(0, 0, 0, 0)
-            num_widgets = sum(1 for r in self.__render_widgets.values() if r.active)
-            layout_side_size = _next_square(num_widgets)
-            for i, renderer in enumerate(t for t in self.__render_widgets.values() if t.active):
+            widgets = [t for t in self.__render_widgets.values() if t.active] + list(self.__placeholders.values())
+            layout_side_size = _next_square(len(widgets))
+            for i, widget in enumerate(widgets):
                 row = i // layout_side_size
-                layout.addWidget(renderer, row, i - layout_side_size * row)
-                renderer.show()
+                layout.addWidget(widget, row, i - layout_side_size * row)
+                widget.show()
 
     def resizeEvent(self, event: QResizeEvent) -> None:
         if self.is_interchangeable:
@@ -283,6 +316,8 @@ class PreservingDataView(DataView):
         for renderer in self.__render_widgets.values():
             renderer.close()
 
+        self.__pyramids.shutdown()
+
 
 def _next_square(n: int):
     i = 0
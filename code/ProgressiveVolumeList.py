@@ -0,0 +1,56 @@
+from typing import List, Optional, Set
+
+import numpy as np
+from PySide6.QtCore import QObject, Signal
+
+from LazyVolumeStore import VolumeHeader
+
+
+class ProgressiveVolumeList(QObject):
+    """
+    The volumes of a load that is still running. Volumes are added as soon as they are decoded, which lets the views
+    start before the whole data set is loaded. Provides the same interface as LazyVolumeStore.
+    """
+
+    loaded = Signal(int)
+    # emitted instead of loaded if the volume could not be loaded, it is not loaded again
+    failed = Signal(int)
+
+    def __init__(self, headers: List[VolumeHeader]):
+        super().__init__()
+        self.__headers = headers
+        self.__volumes: List[Optional[np.ndarray]] = [None] * len(headers)
+        self.__failed: Set[int] = set()
+
+    def __len__(self):
+        return len(self.__headers)
+
+    def __getitem__(self, idx: int) -> Optional[np.ndarray]:
+        """
+        Returns the volume if it is already loaded, None otherwise.
+        """
+        return self.__volumes[idx]
+
+    @property
+    def headers(self) -> List[VolumeHeader]:
+        return self.__headers
+
+    def is_loaded(self, idx: int) -> bool:
+        return self.__volumes[idx] is not None
+
+    def is_failed(self, idx: int) -> bool:
+        return idx in self.__failed
+
+    def request(self, idx: int) -> Optional[np.ndarray]:
+        return self[idx]
+
+    def release(self, idx: int):
+        pass
+
+    def set_volume(self, idx: int, volume: np.ndarray):
+        self.__volumes[idx] = volume
+        self.loaded.emit(idx)
+
+    def set_failed(self, idx: int):
+        self.__failed.add(idx)
+        self.failed.emit(idx)
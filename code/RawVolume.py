@@ -0,0 +1,81 @@
+"""
+Uncompressed uint8 label volumes that can be memory-mapped without any decoding. A volume consists of the voxels,
+either as .npy file or as flat .raw file, and a .json header with the same name which holds the image geometry. The
+voxels are stored in VTK order, i.e. with x running fastest.
+"""
+import json
+import os
+from typing import Tuple
+
+import numpy as np
+
+from VolumeCache import ImageGeometry
+
+RAW_EXTENSIONS = ('.npy', '.raw')
+
+
+def is_raw_volume(path: str) -> bool:
+    return path.endswith(RAW_EXTENSIONS)
+
+
+def _header_path(path: str) -> str:
+    return os.path.splitext(path)[0] + '.json'
+
+
+def read_header(path: str) -> dict:
+    """
+    Reads the .json header of the volume at path.
+    """
+    with open(_header_path(path), 'r') as f:
+        header = json.load(f)
+
+    if header.get('dtype', 'uint8') != 'uint8':
+        raise ValueError('Volume {} does not contain uint8 labels'.format(path))
+
+    return header
+
+
+def write_header(path: str, geometry: ImageGeometry, **fields):
+    """
+    Writes the .json header of the volume at path, with fields as additional entries.
+    """
+    with open(_header_path(path), 'w') as f:
+        json.dump({
+            'dtype': 'uint8',
+            'extent': list(geometry.extent),
+            'spacing': list(geometry.spacing),
+            'origin': list(geometry.origin),
+            **fields
+        }, f, indent=4)
+
+
+def read_raw_header(path: str) -> ImageGeometry:
+    header = read_header(path)
+    return ImageGeometry(tuple(header['extent']), tuple(header['spacing']), tuple(header['origin']))
+
+
+def open_raw_volume(path: str) -> Tuple[np.ndarray, ImageGeometry]:
+    """
+    Memory-maps the volume read-only.
+    """
+    geometry = read_raw_header(path)
+    if path.endswith('.npy'):
+        volume = np.load(path, mmap_mode='r')
+        if volume.dtype != np.ubyte:
+            raise ValueError('Volume {} does not contain uint8 labels'.format(path))
+        volume = volume.reshape(geometry.dim)
+    else:
+        volume = np.memmap(path, dtype=np.ubyte, mode='r', shape=geometry.dim)
+
+    return volume, geometry
+
+
+def write_raw_volume(path: str, volume: np.ndarray, geometry: ImageGeometry):
+    assert is_raw_volume(path)
+    assert volume.dtype == np.ubyte and volume.shape == geometry.dim
+    if path.endswith('.npy'):
+        np.save(path, volume)
+    else:
+        volume.tofile(path)
+
+    write_header(path, geometry)
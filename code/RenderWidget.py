@@ -1,6 +1,7 @@
-from typing import List, Union, Set
+from typing import List, Optional, Union, Set
 
 import numpy as np
+from PySide6.QtCore import QTimer
 from PySide6.QtGui import QColor, Qt
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QSizePolicy
 from vtkmodules.vtkCommonColor import vtkNamedColors
@@ -10,8 +11,10 @@ from vtkmodules.vtkRenderingCore import vtkRenderer, vtkColorTransferFunction, v
     vtkLight, vtkWindowToImageFilter
 from vtkmodules.vtkRenderingVolumeOpenGL2 import vtkSmartVolumeMapper
 
+from LabelPacking import LabelVolume, to_vtk_labels
+from LabelPyramid import LabelPyramid
 from SynchronizedQVTKRenderWindowInteractor import SynchronizedQVTKRenderWindowInteractor, HookedInteractor
-from common import clamp, convert, make_opacity_value, make_color_value
+from common import clamp, make_opacity_value, make_color_value
 
 
 def init_color_transfer_function(func: vtkColorTransferFunction, values: List[vtkColor3ub]):
@@ -35,6 +38,11 @@ def init_opacity_transfer_function(func: vtkPiecewiseFunction, values: List[floa
 class SynchronizedRenderWidget(QWidget):
     camera = vtkCamera()
     active_widgets: Set['SynchronizedRenderWidget'] = set()
+    # True while the shared camera is moved in any of the widgets
+    interacting = False
+    # time without interaction after which the widgets switch back to full resolution
+    idle_delay_ms = 300
+    __idle_timer: Optional[QTimer] = None
 
     @classmethod
     def reset_camera(cls):
@@ -45,8 +53,39 @@ class SynchronizedRenderWidget(QWidget):
             r.GetActiveCamera().Elevation(30)
             r.ResetCameraClippingRange()
 
+    @classmethod
+    def _begin_interaction(cls):
+        if cls.__idle_timer is not None:
+            cls.__idle_timer.stop()
+
+        if not cls.interacting:
+            cls.interacting = True
+            for widget in cls.active_widgets:
+                widget._update_level()
+
+    @classmethod
+    def _end_interaction(cls):
+        if cls.__idle_timer is None:
+            cls.__idle_timer = QTimer()
+            cls.__idle_timer.setSingleShot(True)
+            cls.__idle_timer.timeout.connect(cls._on_idle)
+
+        cls.__idle_timer.start(cls.idle_delay_ms)
+
+    @classmethod
+    def _on_idle(cls):
+        cls.interacting = False
+        changed = [widget for widget in cls.active_widgets if widget._update_level()]
+        if changed:
+            # renders all synchronized widgets
+            changed[0].renderWindowWidget.on_change(None)
+
     def __init__(self, is_gpu: bool, image: vtkImageData, volume: np.ndarray, volume_idx: int, color_list: List[QColor],
-                 iso_opacities: List[float], shaded=False, progressive=True, off_screen=False):
+                 iso_opacities: List[float], shaded=False, progressive=True, off_screen=False, preview=True):
+        """
+        :param preview: If True, a mode pooled level of the volume is rendered while the camera moves and while the
+        widget is too small to show the full resolution.
+        """
         super().__init__()
 
         self.__volume_idx = volume_idx
@@ -54,6 +93,9 @@ class SynchronizedRenderWidget(QWidget):
         self.__shaded = not shaded
         self.__active = False
         self.__off_screen = not off_screen
+        self.__preview = preview
+        self.__pyramid: Optional[LabelPyramid] = None
+        self.__level = 0
 
         self.__dummy_widget = QWidget()
         self.image = image
@@ -110,6 +152,49 @@ class SynchronizedRenderWidget(QWidget):
             if self.active:
                 self.renderWindowWidget.on_change(None)
 
+    @property
+    def preview(self) -> bool:
+        return self.__preview
+
+    @preview.setter
+    def preview(self, value: bool):
+        if value != self.__preview:
+            self.__preview = value
+            if self._update_level():
+                self.renderWindowWidget.on_change(None)
+
+    def _select_level(self) -> int:
+        pyramid = self.__pyramid
+        if not self.__preview or pyramid is None:
+            return 0
+
+        level = min(1, len(pyramid) - 1) if self.interacting else 0
+        if self.isVisible():
+            # the coarsest level that still has about one voxel per pixel
+            side = min(self.width(), self.height()) * self.devicePixelRatioF()
+            while level + 1 < len(pyramid) and max(pyramid.dim(level + 1)) >= side:
+                level += 1
+
+        return level
+
+    def _update_level(self, force=False) -> bool:
+        """
+        Switches the rendered pyramid level if needed. Returns True if the widget has to be rendered again.
+        """
+        level = self._select_level()
+        if level == self.__level and not force:
+            return False
+
+        self.__level = level
+        if not self.active:
+            return False
+
+        self.volumeMapper.SetInputDataObject(0, self._level_image(level))
+        return True
+
+    def _level_image(self, level: int) -> vtkImageData:
+        return self.__pyramid[level] if level > 0 else self.image
+
     @property
     def off_screen(self):
         return self.__off_screen
@@ -208,7 +293,14 @@ class SynchronizedRenderWidget(QWidget):
         self.renderWindowWidget = SynchronizedQVTKRenderWindowInteractor()
         self.renderWindowWidget.setToolTip("Volume " + str(volume_idx + 1))
         self.renderWindowWidget.GetRenderWindow().AddRenderer(self.ren)
-        self.volumeMapper.SetInputDataObject(0, self.image)
+        interactor = self.renderWindowWidget.interactor
+        for button in ('Left', 'Middle', 'Right'):
+            interactor.AddObserver(button + 'ButtonPressEvent', lambda *_: self._begin_interaction())
+            interactor.AddObserver(button + 'ButtonReleaseEvent', lambda *_: self._end_interaction())
+        for wheel in ('MouseWheelForwardEvent', 'MouseWheelBackwardEvent'):
+            interactor.AddObserver(wheel, lambda *_: (self._begin_interaction(), self._end_interaction()))
+        self.__level = self._select_level()
+        self.volumeMapper.SetInputDataObject(0, self._level_image(self.__level))
         self._adjust_volume_mapper()
 
         self.volume.SetMapper(self.volumeMapper)
@@ -273,9 +365,27 @@ class SynchronizedRenderWidget(QWidget):
         """
         return self.image.GetActualMemorySize() / (1 << 10)
 
-    def set_volume(self, volume: np.ndarray):
-        self.image.GetPointData().SetScalars(convert(volume))
+    def set_volume(self, volume: LabelVolume):
+        """
+        Shows the volume at full resolution until its pyramid is passed to set_pyramid.
+        """
+        self.image.GetPointData().SetScalars(to_vtk_labels(volume))
+        self.__pyramid = None
         print('setting volume of {} MB'.format(self.image.GetActualMemorySize() / 1024))
+        self._update_level(force=True)
+
+    def set_pyramid(self, pyramid: LabelPyramid):
+        """
+        :param pyramid: The coarser levels of the current volume, which may be shared with other widgets.
+        """
+        self.__pyramid = pyramid
+        if self._update_level():
+            self.renderWindowWidget.on_change(None)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self._update_level():
+            self.renderWindowWidget.Render()
 
     def closeEvent(self, evt):
         super().closeEvent(evt)
@@ -0,0 +1,155 @@
+"""
+Label volumes that worker processes can open without pickling their voxels. Volumes that are memory-mapped from a file
+or read from a chunked file are opened from the same file. Volumes in memory are opened from the shared memory block
+they lie in, like the volume stack of a parallel load, or copied into a shared memory block once.
+"""
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from ChunkedVolume import ChunkedVolume
+from LabelPacking import LabelVolume, PackedVolume, packed_size
+from VolumeCropping import Bounds
+
+
+class VolumeSource(NamedTuple):
+    # 'shm' for a shared memory block, 'file' for a memory-mapped file or 'chunked' for a chunked volume
+    kind: str
+    # name of the shared memory block or path of the file
+    name: str
+    shape: Tuple[int, ...]
+    # byte offset of the voxels within the file or the shared memory block
+    offset: int = 0
+    # whether the voxels are stored with two per byte, see PackedVolume
+    packed: bool = False
+    # the region of a chunked volume, see ChunkedVolume
+    crop: Optional[Bounds] = None
+
+
+# Shared memory blocks of this process that hold volumes already, by name with their address and size. Volumes within
+# them are shared by their offset instead of being copied, see register_shared_memory.
+_shared_blocks: Dict[str, Tuple[int, int]] = {}
+
+
+def register_shared_memory(shm: SharedMemory):
+    """
+    Announces a block whose volumes, e.g. the views of a volume stack, worker processes may open by its name.
+    """
+    _shared_blocks[shm.name] = np.frombuffer(shm.buf, dtype=np.ubyte).ctypes.data, shm.size
+
+
+def unregister_shared_memory(shm: SharedMemory):
+    _shared_blocks.pop(shm.name, None)
+
+
+def _shared_offset(array: np.ndarray) -> Optional[Tuple[str, int]]:
+    """
+    Returns the name of the registered block that contains the contiguous array and its offset within the block.
+    """
+    if not isinstance(array, np.ndarray) or not array.flags.c_contiguous:
+        return None
+
+    address = array.ctypes.data
+    for name, (start, size) in _shared_blocks.items():
+        if start <= address and address + array.nbytes <= start + size:
+            return name, address - start
+
+    return None
+
+
+def _memmap_offset(array: np.ndarray) -> Optional[int]:
+    """
+    Returns the byte offset of the array within the file it is mapped from, or None if it is not a contiguous view of a
+    memory-mapped file. Views of a np.memmap keep the offset of the map they were taken from, so the offset is derived
+    from the distance to the map that owns the file mapping.
+    """
+    if not isinstance(array, np.memmap) or not array.flags.c_contiguous:
+        return None
+
+    root = array
+    while isinstance(root.base, np.memmap):
+        root = root.base
+
+    return root.offset + array.ctypes.data - root.ctypes.data
+
+
+def share_volume(volume: LabelVolume) -> Tuple[VolumeSource, Optional[SharedMemory]]:
+    """
+    Describes the volume for worker processes. Volumes in memory that are not within a registered block are copied into
+    a new shared memory block, which is returned as well and has to be unlinked by the caller.
+    """
+    if isinstance(volume, ChunkedVolume):
+        return VolumeSource('chunked', volume.path, volume.shape, crop=volume.crop), None
+
+    packed = isinstance(volume, PackedVolume)
+    data = volume.data if packed else volume
+    if (offset := _memmap_offset(data)) is not None:
+        return VolumeSource('file', data.filename, volume.shape, offset, packed), None
+    if (block := _shared_offset(data)) is not None:
+        return VolumeSource('shm', block[0], volume.shape, block[1], packed), None
+
+    data = np.asarray(data, dtype=np.ubyte)
+    shm = SharedMemory(create=True, size=max(1, data.nbytes))
+    np.ndarray(data.shape, dtype=np.ubyte, buffer=shm.buf)[...] = data
+    return VolumeSource('shm', shm.name, volume.shape, 0, packed), shm
+
+
+def open_source(source: VolumeSource) -> Tuple[Optional[SharedMemory], LabelVolume]:
+    """
+    Opens the volume that is described by source. The shared memory block, if any, has to be closed once the volume is
+    not referenced anymore.
+    """
+    if source.kind == 'chunked':
+        return None, ChunkedVolume(source.name, source.crop)
+
+    shape = (packed_size(source.shape),) if source.packed else source.shape
+    shm = None
+    if source.kind == 'file':
+        data = np.memmap(source.name, dtype=np.ubyte, mode='r', offset=source.offset, shape=shape)
+    else:
+        shm = SharedMemory(name=source.name)
+        data = np.ndarray(shape, dtype=np.ubyte, buffer=shm.buf, offset=source.offset)
+
+    return shm, PackedVolume(data, source.shape) if source.packed else data
+
+
+def close_shared_memory(shm: SharedMemory, unlink: bool = False):
+    """
+    Closes the block, which fails while arrays still reference it. Such a mapping stays until the process exits.
+    """
+    try:
+        shm.close()
+    except BufferError:
+        pass
+    if unlink:
+        shm.unlink()
+
+
+class SharedVolumes:
+    """
+    The sources of a set of subjects, which are kept up to date when subjects are added or removed such that every
+    volume is shared only once.
+    """
+
+    def __init__(self):
+        self.__sources: Dict[int, Tuple[VolumeSource, Optional[SharedMemory]]] = {}
+
+    def __len__(self):
+        return len(self.__sources)
+
+    @property
+    def sources(self) -> List[VolumeSource]:
+        return [source for source, _ in self.__sources.values()]
+
+    def add(self, idx: int, volume: LabelVolume):
+        self.remove(idx)
+        self.__sources[idx] = share_volume(volume)
+
+    def remove(self, idx: int):
+        if (entry := self.__sources.pop(idx, None)) is not None and entry[1] is not None:
+            close_shared_memory(entry[1], unlink=True)
+
+    def clear(self):
+        for idx in list(self.__sources):
+            self.remove(idx)
@@ -0,0 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PySide6.QtCore import Qt, Signal
+from PySide6.QtGui import QColor
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QPushButton, QLabel, QTableWidget, \
+    QTableWidgetItem, QAbstractItemView, QHeaderView
+
+from LabelSimilarity import SimilarityMatrices, SimilarityMetric, mask_similarity, pack_label_masks, pairwise_similarity
+from LazyVolumeStore import LazyVolumeStore
+from ProgressiveVolumeList import ProgressiveVolumeList
+from common import combo_box_add_enum_items
+
+
+class SimilarityWidget(QWidget):
+    """
+    Shows the pairwise Dice or Jaccard similarity of one label over all subjects as a heatmap table. Each row is
+    a subject, the Mean column holds its mean similarity to all other subjects, so sorting by it brings outliers to the
+    top. The matrices of all labels are computed at once in the background, switching the label or metric only
+    refills the table.
+    """
+
+    # emitted on the worker thread, the slot runs on the UI thread
+    _computed = Signal(object)
+
+    def __init__(self, volume_list: Union[List[np.ndarray], LazyVolumeStore, ProgressiveVolumeList],
+                 labels: Sequence[Tuple[int, str]], num_workers: int = 1, parent=None):
+        """
+        :param volume_list: The volumes of the data set. Volumes of a lazy load that are not resident are decoded one at
+        a time for the comparison and only their label bitsets are kept, of a progressive load only those that are
+        loaded already are compared.
+        :param labels: The labels and their names.
+        :param num_workers: Number of threads that count the overlaps.
+        """
+        super().__init__(parent)
+        self.__volume_list = volume_list
+        self.__num_workers = num_workers
+        self.__matrices: Optional[SimilarityMatrices] = None
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+        self._computed.connect(self.__set_matrices)
+
+        self.setLayout(QVBoxLayout())
+        self.layout().addLayout(controls := QHBoxLayout())
+        self.__label_box = box = QComboBox()
+        for label, name in labels:
+            box.addItem(name, label)
+        box.currentIndexChanged.connect(self._update_table)
+        controls.addWidget(box)
+        self.__metric_box = box = QComboBox()
+        combo_box_add_enum_items(box, SimilarityMetric)
+        box.currentIndexChanged.connect(self._update_table)
+        controls.addWidget(box)
+        self.__compute_btn = btn = QPushButton(text='Compute Similarity')
+        btn.setToolTip('Computes the Dice and Jaccard similarity of all labels between all volumes.')
+        btn.clicked.connect(self.compute)
+        controls.addWidget(btn)
+        self.__status = QLabel()
+        self.layout().addWidget(self.__status)
+        self.__table = table = QTableWidget()
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.verticalHeader().hide()
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.layout().addWidget(table)
+
+    @property
+    def label(self) -> int:
+        return self.__label_box.currentData(Qt.UserRole)
+
+    @property
+    def metric(self) -> SimilarityMetric:
+        return self.__metric_box.currentData(Qt.UserRole)
+
+    @property
+    def matrices(self) -> Optional[SimilarityMatrices]:
+        return self.__matrices
+
+    def compute(self):
+        volume_list = self.__volume_list
+        if isinstance(volume_list, LazyVolumeStore):
+            # resident volumes are taken as they are, the others are decoded by the worker
+            loaded = [(idx, volume_list.peek(idx) if volume_list.is_loaded(idx) else None)
+                      for idx in range(len(volume_list))]
+        else:
+            loaded = [(idx, volume) for idx in range(len(volume_list)) if (volume := volume_list[idx]) is not None]
+        if len(loaded) < 2:
+            self.__status.setText('At least two volumes must be loaded.')
+            return
+
+        labels = [self.__label_box.itemData(i, Qt.UserRole) for i in range(self.__label_box.count())]
+        self.__compute_btn.setEnabled(False)
+        decoded = sum(volume is None for _, volume in loaded)
+        if decoded:
+            self.__status.setText('Decoding {} and comparing {} volumes...'.format(decoded, len(loaded)))
+        else:
+            self.__status.setText('Comparing {} volumes...'.format(len(loaded)))
+        self.__executor.submit(self._compute, loaded, labels)
+
+    def _compute(self, loaded: List[Tuple[int, Optional[np.ndarray]]], labels: List[int]):
+        try:
+            if any(volume is None for _, volume in loaded):
+                # one subject at a time, a decoded volume is dropped once its bitsets are packed, which are all that
+                # stays besides the resident volumes
+                subjects, masks = [], []
+                for idx, volume in loaded:
+                    if volume is None and (volume := self.__volume_list.decode(idx)) is None:
+                        # volumes that cannot be decoded are left out
+                        continue
+                    subjects.append(idx)
+                    masks.append(pack_label_masks(volume, labels))
+                if len(masks) < 2:
+                    raise ValueError('less than two volumes could be decoded')
+
+                matrices = mask_similarity(masks, labels, subjects, self.__num_workers)
+            else:
+                matrices = pairwise_similarity([volume for _, volume in loaded], labels, [idx for idx, _ in loaded],
+                                               self.__num_workers)
+            self._computed.emit(matrices)
+        except Exception as e:
+            print('Could not compute the label similarity: {}'.format(e))
+            self._computed.emit(None)
+
+    def __set_matrices(self, matrices: Optional[SimilarityMatrices]):
+        self.__compute_btn.setEnabled(True)
+        self.__matrices = matrices
+        if matrices is not None:
+            n = len(matrices.subjects)
+            self.__status.setText('{} volumes, {} pairwise overlaps per label.'.format(n, n * (n - 1) // 2))
+        else:
+            self.__status.setText('Computing the similarity failed.')
+        self._update_table()
+
+    def _update_table(self, *_):
+        table = self.__table
+        # items must not move while they are set
+        table.setSortingEnabled(False)
+        table.clear()
+        if self.__matrices is None:
+            table.setRowCount(0)
+            table.setColumnCount(0)
+            return
+
+        subjects = self.__matrices.subjects
+        matrix = self.__matrices.matrix(self.label, self.metric)
+        n = len(subjects)
+        off_diagonal = ~np.eye(n, dtype=bool)
+        means = (matrix * off_diagonal).sum(axis=1) / max(1, n - 1)
+        low, high = matrix[off_diagonal].min(), matrix[off_diagonal].max()
+        table.setRowCount(n)
+        table.setColumnCount(n + 2)
+        table.setHorizontalHeaderLabels(['Volume', 'Mean'] + [str(idx + 1) for idx in subjects])
+        for row, idx in enumerate(subjects):
+            table.setItem(row, 0, _number_item(idx + 1))
+            table.setItem(row, 1, _heat_item(means[row], low, high))
+            for col in range(n):
+                table.setItem(row, col + 2, _heat_item(matrix[row, col], low, high))
+        table.setSortingEnabled(True)
+
+    def closeEvent(self, event):
+        super().closeEvent(event)
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _number_item(value) -> QTableWidgetItem:
+    # numbers as display data sort numerically
+    item = QTableWidgetItem()
+    item.setData(Qt.DisplayRole, value)
+    return item
+
+
+def _heat_item(value: float, low: float, high: float) -> QTableWidgetItem:
+    """
+    A cell with the value rounded to 3 digits and colored from red at low to green at high.
+    """
+    item = _number_item(round(float(value), 3))
+    t = min(max((value - low) / (high - low), 0), 1) if high > low else 1
+    item.setBackground(QColor.fromHsvF(t / 3, 0.5, 1))
+    item.setForeground(QColor(Qt.black))
+    return item
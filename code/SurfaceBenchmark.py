@@ -0,0 +1,116 @@
+"""
+Measures the surface engines of VolumeOperators on the operator results of the loaded volumes, and the distance methods
+of SurfaceDistance on the surfaces of two subjects, so the fastest engine and method of the machine can be chosen.
+"""
+import time
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+from vtkmodules.vtkCommonDataModel import vtkImageData
+
+from LabelPacking import LabelVolume
+from SurfaceDistance import DistanceMethod, build_locator, label_mask_surface, locator_distances, \
+    mask_distance_transform, transform_distances
+from VolumeOperators import SurfaceEngine, extract_surfaces
+
+
+class EngineTiming(NamedTuple):
+    engine: SurfaceEngine
+    # the best wall time of all runs
+    seconds: float
+    triangles: int
+
+    @property
+    def triangles_per_second(self) -> float:
+        return self.triangles / self.seconds if self.seconds > 0 else float('inf')
+
+
+def benchmark_surface_engines(images: Sequence[vtkImageData], labels: Sequence[int], value: float, repeats: int = 3,
+                              engines: Sequence[SurfaceEngine] = tuple(SurfaceEngine)) -> List[EngineTiming]:
+    """
+    Extracts the surfaces of all labels with each engine repeats times.
+    :param images: The operator results of the labels as passed to extract_surfaces.
+    :return: The timings in the order of engines.
+    """
+    timings = []
+    for engine in engines:
+        best = float('inf')
+        triangles = 0
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            surfaces = extract_surfaces(images, labels, value, engine)
+            best = min(best, time.perf_counter() - start)
+            triangles = sum(s.GetNumberOfCells() for s in surfaces)
+
+        timings.append(EngineTiming(engine, best, triangles))
+
+    return timings
+
+
+def format_timings(timings: Sequence[EngineTiming]) -> str:
+    lines = ['{:<24}{:>12}{:>12}{:>16}'.format('Engine', 'Time [ms]', 'Triangles', 'Triangles/s')]
+    for t in timings:
+        lines.append('{:<24}{:>12.1f}{:>12}{:>16.0f}'.format(t.engine.name, t.seconds * 1000, t.triangles,
+                                                              t.triangles_per_second))
+
+    return '\n'.join(lines)
+
+
+class DistanceTiming(NamedTuple):
+    method: DistanceMethod
+    # the best wall times of all runs of building the locator or distance transform and of querying all points
+    build_seconds: float
+    query_seconds: float
+    queries: int
+
+    @property
+    def queries_per_second(self) -> float:
+        return self.queries / self.query_seconds if self.query_seconds > 0 else float('inf')
+
+    @property
+    def seconds(self) -> float:
+        return self.build_seconds + self.query_seconds
+
+
+def benchmark_surface_distance(volume: LabelVolume, other: LabelVolume, label: int, template_image: vtkImageData,
+                               engine: SurfaceEngine = SurfaceEngine.FLYING_EDGES, repeats: int = 3,
+                               methods: Sequence[DistanceMethod] = tuple(DistanceMethod)) -> List[DistanceTiming]:
+    """
+    Measures the distance methods on the surface of the label in volume to the one in other, repeats times each. The
+    surfaces are extracted once beforehand.
+    :return: The timings in the order of methods.
+    """
+    mask = np.asarray(volume) == label
+    other_mask = np.asarray(other) == label
+    surface = label_mask_surface(mask, template_image, engine)
+    other_surface = label_mask_surface(other_mask, template_image, engine)
+    timings = []
+    for method in methods:
+        best_build = best_query = float('inf')
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            if method == DistanceMethod.POINT_LOCATOR:
+                target = build_locator(other_surface)
+            else:
+                target = mask_distance_transform(other_mask, template_image, mask)
+            built = time.perf_counter()
+            if method == DistanceMethod.POINT_LOCATOR:
+                locator_distances(surface, target)
+            else:
+                transform_distances(surface, target)
+            best_build = min(best_build, built - start)
+            best_query = min(best_query, time.perf_counter() - built)
+
+        timings.append(DistanceTiming(method, best_build, best_query, surface.GetNumberOfPoints()))
+
+    return timings
+
+
+def format_distance_timings(timings: Sequence[DistanceTiming]) -> str:
+    lines = ['{:<24}{:>12}{:>12}{:>12}{:>16}'.format('Method', 'Build [ms]', 'Query [ms]', 'Points', 'Queries/s')]
+    for t in timings:
+        lines.append('{:<24}{:>12.1f}{:>12.1f}{:>12}{:>16.0f}'.format(t.method.name, t.build_seconds * 1000,
+                                                                      t.query_seconds * 1000, t.queries,
+                                                                      t.queries_per_second))
+
+    return '\n'.join(lines)
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import uuid
+from collections import OrderedDict
+from typing import FrozenSet, NamedTuple, Optional, Union
+
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.vtkIOXML import vtkXMLPolyDataReader, vtkXMLPolyDataWriter
+
+
+class SurfaceKey(NamedTuple):
+    # indices of the selected subjects
+    subjects: FrozenSet[int]
+    label: int
+    operator: int
+    # the contour value, which is only meaningful for ADDITION and the variability operators
+    value: float
+    engine: int
+    # the selected labels that mask the single surface of the variability operators, empty for the other operators
+    labels: FrozenSet[int] = frozenset()
+
+
+class DistanceKey(NamedTuple):
+    # the subject whose surface is colored by its distance to the surface of the target subject
+    source: int
+    target: int
+    label: int
+    method: int
+    engine: int
+
+
+CacheKey = Union[SurfaceKey, DistanceKey]
+
+
+class SurfaceCache:
+    """
+    Least recently used cache of extracted surfaces, bounded by the memory of the cached vtkPolyData. With a cache_dir,
+    every surface is also written as binary VTK XML file, such that surfaces that were evicted or extracted in an
+    earlier session are read instead of extracted again. get and put are meant to be called from the UI thread, load
+    and store may be called from other threads.
+    """
+
+    def __init__(self, mem_limit: int, cache_dir: Optional[str] = None, namespace: str = ''):
+        """
+        :param mem_limit: Limit in MB for the cached surfaces in memory.
+        :param cache_dir: Directory of the disk tier. No disk tier is used if None.
+        :param namespace: Identifies the data set and image geometry, such that files of other data are not used.
+        """
+        self.__mem_limit = mem_limit << 20
+        self.__cache_dir = cache_dir
+        self.__namespace = namespace
+        self.__surfaces: 'OrderedDict[CacheKey, vtkPolyData]' = OrderedDict()
+        self.__nbytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.__surfaces)
+
+    def __contains__(self, key: CacheKey):
+        return key in self.__surfaces
+
+    @property
+    def nbytes(self) -> int:
+        return self.__nbytes
+
+    @staticmethod
+    def _size(surface: vtkPolyData) -> int:
+        return surface.GetActualMemorySize() << 10
+
+    def _file_path(self, key: CacheKey) -> str:
+        if isinstance(key, SurfaceKey):
+            name = repr((self.__namespace, sorted(key.subjects), key.label, key.operator, float(key.value), key.engine)
+                        + ((sorted(key.labels),) if key.labels else ()))
+        else:
+            name = repr((self.__namespace, type(key).__name__) + tuple(key))
+        return os.path.join(self.__cache_dir, hashlib.sha1(name.encode('utf-8')).hexdigest() + '.vtp')
+
+    def get(self, key: CacheKey, load: bool = True) -> Optional[vtkPolyData]:
+        """
+        Returns the surface from memory or from the disk tier, or None if it is in neither.
+        :param load: Whether the disk tier is looked up, pass False to look up the surface in memory only.
+        """
+        if (surface := self.__surfaces.get(key)) is not None:
+            self.__surfaces.move_to_end(key)
+            return surface
+
+        if load and (surface := self.load(key)) is not None:
+            self.put(key, surface, store=False)
+
+        return surface
+
+    def put(self, key: CacheKey, surface: vtkPolyData, store: bool = True):
+        """
+        :param store: Whether the surface is written to the disk tier, pass False if store was already called.
+        """
+        if (old := self.__surfaces.pop(key, None)) is not None:
+            self.__nbytes -= self._size(old)
+
+        self.__surfaces[key] = surface
+        self.__nbytes += self._size(surface)
+        # the surface that was just added is kept even if it exceeds the limit on its own
+        while self.__nbytes > self.__mem_limit and len(self.__surfaces) > 1:
+            _, evicted = self.__surfaces.popitem(last=False)
+            self.__nbytes -= self._size(evicted)
+
+        if store:
+            self.store(key, surface)
+
+    def load(self, key: CacheKey) -> Optional[vtkPolyData]:
+        if self.__cache_dir is None or not os.path.exists(path := self._file_path(key)):
+            return None
+
+        reader = vtkXMLPolyDataReader()
+        reader.SetFileName(path)
+        reader.Update()
+        if reader.GetErrorCode() != 0:
+            print('Could not read cached surface {}.'.format(path))
+            return None
+
+        surface = vtkPolyData()
+        surface.ShallowCopy(reader.GetOutput())
+        return surface
+
+    def store(self, key: CacheKey, surface: vtkPolyData):
+        """
+        Writes the surface to the disk tier, if there is one.
+        """
+        if self.__cache_dir is None:
+            return
+
+        path = self._file_path(key)
+        # written to a temporary first such that an interrupted write never leaves a valid looking file behind
+        tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        writer = vtkXMLPolyDataWriter()
+        writer.SetFileName(tmp)
+        writer.SetInputDataObject(0, surface)
+        writer.SetDataModeToBinary()
+        writer.SetCompressorTypeToZLib()
+        if writer.Write() != 1:
+            print('Could not cache surface {}.'.format(path))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        os.replace(tmp, path)
@@ -0,0 +1,193 @@
+"""
+Distances from the label surface of one subject to the one of another subject, stored as point data of the first
+surface such that it can be colored by them.
+"""
+from enum import IntEnum
+from typing import Optional
+
+import numpy as np
+from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+from vtkmodules.vtkCommonDataModel import vtkImageData, vtkPolyData, vtkStaticPointLocator
+from vtkmodules.vtkFiltersCore import vtkProbeFilter
+from vtkmodules.vtkFiltersPoints import vtkPointInterpolator, vtkVoronoiKernel
+from vtkmodules.vtkImagingGeneral import vtkImageEuclideanDistance
+
+from LabelPacking import LabelVolume
+from VolumeCropping import bounding_box
+from VolumeOperators import Operator, SurfaceEngine, contour_value, extract_surface, padded_bounds, region_image
+
+# name of the point array of the distances
+DISTANCE_ARRAY = 'Distance'
+# name of the point array of the other surface that holds its point coordinates
+_NEAREST_ARRAY = 'Nearest'
+
+
+class DistanceMethod(IntEnum):
+    # distance to the nearest vertex of the other surface, found with a prebuilt vtkStaticPointLocator
+    POINT_LOCATOR = 0
+    # signed Euclidean distance transform of the other mask, interpolated at the vertices
+    DISTANCE_TRANSFORM = 1
+
+
+def build_locator(surface: vtkPolyData) -> vtkStaticPointLocator:
+    """
+    Builds a point locator of the surface, which is passed to locator_distances. The surface gets the array of its
+    point coordinates that the queries return.
+    """
+    points = surface.GetPoints()
+    if points is not None:
+        nearest = numpy_to_vtk(vtk_to_numpy(points.GetData()), deep=True)
+        nearest.SetName(_NEAREST_ARRAY)
+        surface.GetPointData().AddArray(nearest)
+
+    locator = vtkStaticPointLocator()
+    locator.SetDataSet(surface)
+    if surface.GetNumberOfPoints() > 0:
+        locator.BuildLocator()
+    return locator
+
+
+def locator_distances(surface: vtkPolyData, locator: vtkStaticPointLocator) -> np.ndarray:
+    """
+    Returns the distance of every point of the surface to the nearest point of the surface of the locator. All points
+    are queried in one multithreaded pass of a vtkPointInterpolator that fetches the coordinates of the nearest point.
+    """
+    other = locator.GetDataSet()
+    if surface.GetNumberOfPoints() == 0 or other.GetNumberOfPoints() == 0:
+        return np.full(surface.GetNumberOfPoints(), np.nan, dtype=np.float32)
+
+    interpolator = vtkPointInterpolator()
+    interpolator.SetInputDataObject(0, surface)
+    interpolator.SetSourceData(other)
+    # the locator is built already and not built again as long as its data set is the source
+    interpolator.SetLocator(locator)
+    interpolator.SetKernel(vtkVoronoiKernel())
+    interpolator.PassPointArraysOff()
+    interpolator.PassCellArraysOff()
+    interpolator.PassFieldArraysOff()
+    interpolator.Update()
+    nearest = vtk_to_numpy(interpolator.GetOutput().GetPointData().GetArray(_NEAREST_ARRAY))
+    points = vtk_to_numpy(surface.GetPoints().GetData())
+    return np.linalg.norm(points - nearest, axis=1).astype(np.float32)
+
+
+def _squared_distances(sources: np.ndarray, image: vtkImageData) -> np.ndarray:
+    """
+    Returns the squared Euclidean distance in world units from every voxel of the image to the nearest source voxel.
+    vtkImageEuclideanDistance applies the spacing only along the axis of its last iteration, so every axis is
+    transformed in a pass of its own. The lines along the axis are laid out as the y axis of an image with a single
+    column, whose x axis iteration leaves them unchanged, and the squared distances are passed on to the next pass.
+    :param sources: A bool array over the voxels of the image in VTK order.
+    """
+    spacing = image.GetSpacing()
+    # (Z, Y, X) order, the first pass initializes the distances from the sources
+    distances = (~sources).view(np.ubyte).reshape(image.GetDimensions()[::-1])
+    for axis in (2, 1, 0):
+        moved = np.ascontiguousarray(np.moveaxis(distances, axis, 2))
+        source = vtkImageData()
+        source.SetDimensions(1, moved.shape[2], moved.shape[0] * moved.shape[1])
+        source.SetSpacing(1, spacing[2 - axis], 1)
+        source.GetPointData().SetScalars(numpy_to_vtk(moved.ravel(), deep=True))
+        edt = vtkImageEuclideanDistance()
+        edt.SetInputData(source)
+        edt.SetDimensionality(2)
+        edt.SetInitialize(axis == 2)
+        edt.ConsiderAnisotropyOn()
+        edt.Update()
+        distances = vtk_to_numpy(edt.GetOutput().GetPointData().GetScalars()).reshape(moved.shape)
+        distances = np.moveaxis(distances, 2, axis)
+
+    return distances.astype(np.float32).ravel()
+
+
+def mask_distance_transform(mask: np.ndarray, template_image: vtkImageData,
+                            region_mask: Optional[np.ndarray] = None) -> Optional[vtkImageData]:
+    """
+    Returns the signed distance to the boundary of the mask, negative inside, as float image on the grid of
+    template_image. It is derived from the Euclidean distance transforms of the inside and of its outermost voxels and
+    crosses zero at the centers of the outermost inside voxels, where the surface of the mask at contour_value(UNION)
+    lies.
+    Distances are in world units, also for anisotropic voxels.
+    :param mask: A bool volume with the shape of the volumes.
+    :param region_mask: The image only covers the padded bounding box of mask and region_mask, which has to contain the
+    points that are interpolated.
+    :return: None if the mask is empty.
+    """
+    dim = template_image.GetDimensions()
+    if (bounds := bounding_box(mask.reshape(dim[::-1]))) is None:
+        return None
+    if region_mask is not None:
+        bounds = bounding_box((mask | region_mask).reshape(dim[::-1]))
+
+    image = region_image(mask, template_image, padded_bounds(bounds, dim))
+    inside = vtk_to_numpy(image.GetPointData().GetScalars()) != 0
+    # the outermost inside voxels, which have an outside voxel as face neighbor, the image border counts as inside
+    zyx = inside.reshape(image.GetDimensions()[::-1])
+    padded = np.pad(zyx, 1, mode='edge')
+    interior = zyx.copy()
+    for axis in range(3):
+        for shift in (0, 2):
+            interior &= padded[tuple(slice(shift, shift + n) if a == axis else slice(1, n + 1)
+                                     for a, n in enumerate(zyx.shape))]
+    outermost = (zyx & ~interior).ravel()
+    to_inside, to_outermost = (np.sqrt(_squared_distances(sources, image)) for sources in (inside, outermost))
+    # the surface passes through the centers of the outermost inside voxels, so inside it is the distance to them
+    signed = np.where(inside, -to_outermost, to_inside)
+    result = vtkImageData()
+    result.CopyStructure(image)
+    result.GetPointData().SetScalars(numpy_to_vtk(signed, deep=True))
+    return result
+
+
+def transform_distances(surface: vtkPolyData, distance_image: Optional[vtkImageData]) -> np.ndarray:
+    """
+    Returns the unsigned distance at every point of the surface, trilinearly interpolated from distance_image.
+    """
+    if surface.GetNumberOfPoints() == 0 or distance_image is None:
+        return np.full(surface.GetNumberOfPoints(), np.nan, dtype=np.float32)
+
+    probe = vtkProbeFilter()
+    probe.SetInputDataObject(0, surface)
+    probe.SetSourceData(distance_image)
+    probe.PassPointArraysOff()
+    probe.PassCellArraysOff()
+    probe.Update()
+    return np.abs(vtk_to_numpy(probe.GetOutput().GetPointData().GetScalars())).astype(np.float32)
+
+
+def with_distances(surface: vtkPolyData, distances: np.ndarray) -> vtkPolyData:
+    """
+    Returns a shallow copy of the surface with the distances as active point scalars.
+    """
+    result = vtkPolyData()
+    result.ShallowCopy(surface)
+    array = numpy_to_vtk(distances, deep=True)
+    array.SetName(DISTANCE_ARRAY)
+    result.GetPointData().SetScalars(array)
+    return result
+
+
+def label_mask_surface(mask: np.ndarray, template_image: vtkImageData, engine: SurfaceEngine) -> vtkPolyData:
+    """
+    Extracts the surface of a bool volume within its padded bounding box.
+    """
+    dim = template_image.GetDimensions()
+    image = region_image(mask, template_image, padded_bounds(bounding_box(mask.reshape(dim[::-1])), dim))
+    return extract_surface(image, contour_value(Operator.UNION, 0), engine)
+
+
+def label_surface_distance(volume: LabelVolume, other: LabelVolume, label: int, template_image: vtkImageData,
+                           method: DistanceMethod, engine: SurfaceEngine) -> vtkPolyData:
+    """
+    Extracts the surface of the label in volume and computes the distance of its points to the surface of the label in
+    other. Points get NaN as distance if other does not have the label.
+    """
+    mask = np.asarray(volume) == label
+    other_mask = np.asarray(other) == label
+    surface = label_mask_surface(mask, template_image, engine)
+    if method == DistanceMethod.POINT_LOCATOR:
+        distances = locator_distances(surface, build_locator(label_mask_surface(other_mask, template_image, engine)))
+    else:
+        distances = transform_distances(surface, mask_distance_transform(other_mask, template_image, mask))
+
+    return with_distances(surface, distances)
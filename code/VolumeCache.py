@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+class ImageGeometry(NamedTuple):
+    extent: Tuple[int, int, int, int, int, int]
+    spacing: Tuple[float, float, float]
+    origin: Tuple[float, float, float]
+
+    @property
+    def dim(self) -> Tuple[int, int, int]:
+        ext = self.extent
+        return ext[1] - ext[0] + 1, ext[3] - ext[2] + 1, ext[5] - ext[4] + 1
+
+    def crop(self, bounds: Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]) -> 'ImageGeometry':
+        """
+        Returns the geometry of the [begin, end) voxel ranges along x, y and z. The origin is moved such that the
+        cropped voxels keep their world coordinates.
+        """
+        extent = []
+        origin = []
+        for axis, (begin, end) in enumerate(bounds):
+            extent += [0, end - begin - 1]
+            origin.append(self.origin[axis] + (self.extent[2 * axis] + begin) * self.spacing[axis])
+
+        return ImageGeometry(tuple(extent), self.spacing, tuple(origin))
+
+
+class VolumeCache:
+    """
+    On-disk cache of decoded label volumes. Every source file has one entry consisting of the raw voxels as .npy file
+    and a .json file with the key and the image geometry. An entry is only valid as long as path, size and modification
+    time of the source file match the key. Hits are memory-mapped read-only instead of read.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.__cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _key(path: str) -> dict:
+        stat = os.stat(path)
+        return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    def _entry_path(self, path: str) -> str:
+        name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.__cache_dir, name)
+
+    def get(self, path: str) -> Optional[Tuple[np.ndarray, ImageGeometry]]:
+        entry = self._entry_path(path)
+        try:
+            with open(entry + '.json', 'r') as f:
+                meta = json.load(f)
+
+            if meta['key'] != self._key(path):
+                return None
+
+            volume = np.load(entry + '.npy', mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None
+
+        geometry = ImageGeometry(tuple(meta['extent']), tuple(meta['spacing']), tuple(meta['origin']))
+        if volume.dtype != np.ubyte or volume.shape != geometry.dim:
+            return None
+
+        return volume, geometry
+
+    def put(self, path: str, volume: np.ndarray, geometry: ImageGeometry):
+        entry = self._entry_path(path)
+        meta = {
+            'key': self._key(path),
+            'extent': list(geometry.extent),
+            'spacing': list(geometry.spacing),
+            'origin': list(geometry.origin),
+        }
+        # write to temporaries first such that an interrupted write never leaves a valid looking entry behind
+        with open(entry + '.npy.tmp', 'wb') as f:
+            np.save(f, volume)
+        with open(entry + '.json.tmp', 'w') as f:
+            json.dump(meta, f)
+
+        os.replace(entry + '.npy.tmp', entry + '.npy')
+        os.replace(entry + '.json.tmp', entry + '.json')
@@ -0,0 +1,51 @@
+"""
+Cropping of label volumes to the bounding box of their non-background voxels.
+
+The volumes have the shape (X, Y, Z) but hold their voxels in VTK order, with x running fastest. Spatially, their axes
+are the ones of volume.reshape((Z, Y, X)), which is the view the functions below work on.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+from LabelPacking import unpack_labels
+
+# [begin, end) voxel ranges along x, y and z
+Bounds = Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]
+
+
+def union_bounding_box(stack: np.ndarray, dim: Tuple[int, int, int], packed: bool = False) -> Optional[Bounds]:
+    """
+    Returns the bounding box of the voxels that are not background (label 0) in any volume of the stack, which is
+    computed in a single pass over all subjects. Returns None if all voxels are background.
+    """
+    union = np.bitwise_or.reduce(stack, axis=0)
+    if packed:
+        # a nibble of the combined bytes is not zero exactly if the voxel is not zero in any subject
+        union = unpack_labels(union, 0, dim[0] * dim[1] * dim[2])
+
+    return bounding_box(union.reshape(dim[::-1]) != 0)
+
+
+def bounding_box(mask: np.ndarray) -> Optional[Bounds]:
+    """
+    Returns the bounding box of the set voxels of a (Z, Y, X) mask or None if no voxel is set.
+    """
+    if not mask.any():
+        return None
+
+    bounds = []
+    for axis in (2, 1, 0):
+        occupied = np.flatnonzero(np.any(mask, axis=tuple(a for a in range(3) if a != axis)))
+        bounds.append((int(occupied[0]), int(occupied[-1]) + 1))
+
+    return tuple(bounds)
+
+
+def crop_volume(volume: np.ndarray, dim: Tuple[int, int, int], bounds: Bounds) -> np.ndarray:
+    """
+    Returns a contiguous copy of the part of the volume within bounds, again with the shape (X, Y, Z).
+    """
+    (x0, x1), (y0, y1), (z0, z1) = bounds
+    cropped = volume.reshape(dim[::-1])[z0:z1, y0:y1, x0:x1].copy()
+    return cropped.reshape((x1 - x0, y1 - y0, z1 - z0))
@@ -12,6 +12,7 @@ class VolumeListItem(QWidget):
         self.__horizontal_layout.addWidget(self.__icon_label)
         self.__horizontal_layout.addWidget(self.__label)
         self.setLayout(self.__horizontal_layout)
+        self.__loading = False
         self.selected = False
         self.sizePolicy().setHorizontalPolicy(QSizePolicy.Minimum)
 
@@ -29,5 +30,21 @@ class VolumeListItem(QWidget):
     @selected.setter
     def selected(self, value: bool):
         self.__selected = value
-        icon = self.style().standardIcon(QStyle.SP_DialogApplyButton if self.selected else QStyle.SP_DialogCancelButton)
+        self._update_icon()
+
+    @property
+    def loading(self):
+        return self.__loading
+
+    @loading.setter
+    def loading(self, value: bool):
+        self.__loading = value
+        self._update_icon()
+
+    def _update_icon(self):
+        if self.loading:
+            icon = self.style().standardIcon(QStyle.SP_BrowserReload)
+        else:
+            icon = self.style().standardIcon(QStyle.SP_DialogApplyButton if self.selected
+                                             else QStyle.SP_DialogCancelButton)
         self.__icon_label.setPixmap(icon.pixmap(QSize(10, 10)))
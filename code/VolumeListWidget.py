@@ -1,32 +1,66 @@
 from itertools import chain
-from typing import List, Callable
+from typing import List, Callable, Optional, Set, Union
 
 import numpy as np
-from PySide6.QtCore import QItemSelection
+from PySide6.QtCore import QItemSelection, Qt
 from PySide6.QtWidgets import QListWidgetItem, QListWidget, QAbstractItemView
 
+from LazyVolumeStore import LazyVolumeStore
+from ProgressiveVolumeList import ProgressiveVolumeList
 from VolumeListItem import VolumeListItem
 
 
 class VolumeListWidget(QListWidget):
-    def __init__(self, volume_list: List[np.ndarray], parent=None,
+    def __init__(self, volume_list: Union[List[np.ndarray], LazyVolumeStore, ProgressiveVolumeList], parent=None,
                  selection_added_cb: Callable[[int, np.ndarray], None] = None,
-                 selection_removed_cb: Callable[[int], None] = None):
+                 selection_removed_cb: Callable[[int], None] = None,
+                 selection_pending_cb: Callable[[int, bool], None] = None):
+        """
+        :param volume_list: The volumes, a store that loads them once they are selected or a list that is still being
+        filled.
+        :param selection_pending_cb: Called with True when a selected volume starts loading and with False when it is
+        either loaded, deselected before it was loaded or could not be loaded.
+        """
         super().__init__(parent)
         self.__volume_list = volume_list
         self.__selection_added_cb = selection_added_cb
         self.__selection_removed_cb = selection_removed_cb
+        self.__selection_pending_cb = selection_pending_cb
+        # volumes that were handed to selection_added_cb
+        self.__added: Set[int] = set()
+        # selected volumes that are not loaded yet
+        self.__pending: Set[int] = set()
         self.setSelectionMode(QAbstractItemView.SelectionMode.MultiSelection)
         for idx in range(len(volume_list)):
             custom_widget = VolumeListItem(idx, self)
             custom_widget.set_text('Volume ' + str(idx + 1))
+            if self.is_streamed:
+                header = volume_list.headers[idx]
+                custom_widget.setToolTip('{}\n{} x {} x {} voxels\n{:.1f} MB'.format(
+                    header.file, *header.geometry.dim, header.file_size / (1 << 20)))
             item = QListWidgetItem(self)
             item.setSizeHint(custom_widget.sizeHint())
             self.addItem(item)
             self.setItemWidget(item, custom_widget)
             item.setSelected(custom_widget.selected)
+            if not self.is_streamed and volume_list[idx] is None or (
+                    isinstance(volume_list, ProgressiveVolumeList) and volume_list.is_failed(idx)):
+                self._disable(idx)
 
-    def __getitem__(self, idx):
+        if self.is_streamed:
+            volume_list.loaded.connect(self._handle_volume_loaded)
+            volume_list.failed.connect(self._handle_volume_failed)
+            for idx in range(len(volume_list)):
+                self._update_loading(idx)
+
+    @property
+    def is_streamed(self) -> bool:
+        """
+        True if volumes may become available only after the widget was created.
+        """
+        return isinstance(self.__volume_list, (LazyVolumeStore, ProgressiveVolumeList))
+
+    def __getitem__(self, idx) -> Optional[np.ndarray]:
         assert isinstance(idx, int)
         assert idx < len(self.__volume_list)
         return self.__volume_list[idx]
@@ -38,11 +72,69 @@ class VolumeListWidget(QListWidget):
         for idx in selected_indices:
             volume_list_item = self.itemWidget(self.item(idx))
             volume_list_item.selected = True
-            if self.__selection_added_cb is not None:
-                self.__selection_added_cb(idx, self[idx])
+            volume = self.__volume_list.request(idx) if self.is_streamed else self[idx]
+            if volume is None:
+                self.__pending.add(idx)
+                self._update_loading(idx)
+                if self.__selection_pending_cb is not None:
+                    self.__selection_pending_cb(idx, True)
+            else:
+                self._add(idx, volume)
 
         for idx in deselected_indices:
             volume_list_item = self.itemWidget(self.item(idx))
             volume_list_item.selected = False
-            if self.__selection_removed_cb is not None:
-                self.__selection_removed_cb(idx)
+            if idx in self.__pending:
+                self.__pending.remove(idx)
+                self._update_loading(idx)
+                if self.__selection_pending_cb is not None:
+                    self.__selection_pending_cb(idx, False)
+            elif idx in self.__added:
+                self.__added.remove(idx)
+                if self.__selection_removed_cb is not None:
+                    self.__selection_removed_cb(idx)
+
+            if self.is_streamed:
+                self.__volume_list.release(idx)
+
+    def _add(self, idx: int, volume: np.ndarray):
+        self.__added.add(idx)
+        if self.__selection_added_cb is not None:
+            self.__selection_added_cb(idx, volume)
+
+    def _update_loading(self, idx: int):
+        # items of a progressive load show their loading state also while they are not selected
+        volume_list = self.__volume_list
+        self.itemWidget(self.item(idx)).loading = idx in self.__pending or (
+                isinstance(volume_list, ProgressiveVolumeList) and not volume_list.is_loaded(idx)
+                and not volume_list.is_failed(idx))
+
+    def _handle_volume_loaded(self, idx: int):
+        was_pending = idx in self.__pending
+        self.__pending.discard(idx)
+        self._update_loading(idx)
+        if not was_pending:
+            return
+
+        if self.__selection_pending_cb is not None:
+            self.__selection_pending_cb(idx, False)
+
+        self._add(idx, self[idx])
+
+    def _handle_volume_failed(self, idx: int):
+        # deselecting clears the pending state and releases the volume in the store
+        if idx in self.__pending:
+            self.item(idx).setSelected(False)
+        # a lazy store tries again on the next selection, a progressive load does not
+        if isinstance(self.__volume_list, ProgressiveVolumeList):
+            self._disable(idx)
+            self._update_loading(idx)
+
+    def _disable(self, idx: int):
+        """
+        Marks a volume that could not be loaded, which cannot be selected anymore.
+        """
+        item = self.item(idx)
+        item.setFlags(item.flags() & ~(Qt.ItemIsSelectable | Qt.ItemIsEnabled))
+        self.itemWidget(item).setToolTip('Volume {} could not be loaded.'.format(idx + 1))
+        self.itemWidget(item).setEnabled(False)
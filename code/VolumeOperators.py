@@ -1,11 +1,25 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from enum import IntEnum
-from typing import List, Sequence
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 import vtk
-from vtkmodules.vtkCommonDataModel import vtkImageData
-from vtkmodules.vtkFiltersCore import vtkMarchingCubes
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray, vtk_to_numpy
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkImageData, vtkPolyData
+from vtkmodules.vtkCommonExecutionModel import vtkPolyDataAlgorithm
+from vtkmodules.vtkFiltersCore import vtkFlyingEdges3D, vtkMarchingCubes, vtkPolyDataNormals, vtkQuadricClustering
+from vtkmodules.vtkFiltersGeneral import vtkDiscreteFlyingEdges3D
+from vtkmodules.vtkFiltersPoints import vtkPointInterpolator, vtkVoronoiKernel
 
+from LabelMasks import LabelMasks
+from LabelPacking import MAX_PACKED_LABEL, LabelVolume, get_slab, iter_slabs
+from SharedVolumes import SharedVolumes, VolumeSource, close_shared_memory, open_source
+from VolumeCropping import Bounds, bounding_box, crop_volume
 from common import convert
 
 
@@ -13,46 +27,714 @@ class Operator(IntEnum):
     UNION = 0
     INTERSECTION = 1
     ADDITION = 2
+    # variability of the label distribution over the subjects, see label_variability
+    ENTROPY = 3
+    DISAGREEMENT = 4
 
 
-def rebuild(volumes: Sequence[np.ndarray], labels: List[int], operator: Operator, template_image, iso_value: float):
+VARIABILITY_OPERATORS = (Operator.ENTROPY, Operator.DISAGREEMENT)
+# the label of the single result of the variability operators in surface keys and label maps, which no volume uses
+VARIABILITY_LABEL = 255
+
+
+def has_iso_value(operator: Operator) -> bool:
+    """
+    Whether the results of the operator are scalar and contoured at a chosen iso value instead of being masks.
+    """
+    return operator == Operator.ADDITION or operator in VARIABILITY_OPERATORS
+
+
+class SurfaceEngine(IntEnum):
+    MARCHING_CUBES = 0
+    # multithreaded with vtkSMPTools
+    FLYING_EDGES = 1
+    # extracts all labels from one label map, see extract_surfaces
+    DISCRETE_FLYING_EDGES = 2
+
+
+# Number of voxels per slab of the fused reduction, small enough that the slabs of a subject and of the results stay in
+# the cache while all labels are processed.
+REDUCE_SLAB_VOXELS = 1 << 18
+
+_VTK_TYPES = {
+    np.dtype(np.bool_): vtk.VTK_UNSIGNED_CHAR,
+    np.dtype(np.uint8): vtk.VTK_UNSIGNED_CHAR,
+    np.dtype(np.uint16): vtk.VTK_UNSIGNED_SHORT,
+    np.dtype(np.uint32): vtk.VTK_UNSIGNED_INT,
+    np.dtype(np.float32): vtk.VTK_FLOAT,
+}
+
+
+def count_dtype(num_subjects: int) -> np.dtype:
+    """
+    The smallest unsigned type that counts up to num_subjects without wrapping.
+    """
+    return next(np.dtype(t) for t in (np.uint8, np.uint16, np.uint32) if num_subjects <= np.iinfo(t).max)
+
+
+def _reduction(operator: Operator, num_subjects: int) -> Tuple[np.ufunc, np.dtype]:
+    """
+    Returns the binary reduction of the label masks of the subjects and the type of its results. The variability
+    operators reduce the masks of the voxels that have the label in any subject.
+    """
+    if operator == Operator.UNION:
+        return np.bitwise_or, np.dtype(np.bool_)
+    if operator == Operator.INTERSECTION:
+        return np.bitwise_and, np.dtype(np.bool_)
+    if operator == Operator.ADDITION:
+        # np.ubyte would wrap above 255 subjects
+        return np.add, count_dtype(num_subjects)
+    if operator in VARIABILITY_OPERATORS:
+        return np.bitwise_or, np.dtype(np.bool_)
+
+    raise RuntimeError('Unknown volume operator')
+
+
+def _result_type(operator: Operator, num_subjects: int) -> np.dtype:
+    return np.dtype(np.float32) if operator in VARIABILITY_OPERATORS else _reduction(operator, num_subjects)[1]
+
+
+def _result_count(operator: Operator, labels: Sequence[int]) -> int:
+    # the variability operators yield one result for all labels
+    return 1 if operator in VARIABILITY_OPERATORS else len(labels)
+
+
+def _reduce_slab(volumes: Sequence[LabelVolume], labels: List[int], reduction_op: np.ufunc,
+                 targets: List[np.ndarray], start: int, stop: int):
+    """
+    Reduces the slab [start, stop) of the volumes for each label into targets, which hold the identity of reduction_op.
+    """
+    for volume in volumes:
+        slab = get_slab(volume, start, stop)
+        for label, target in zip(labels, targets):
+            reduction_op(target, slab == label, out=target)
+
+
+def _reduce(volumes: Sequence[LabelVolume], labels: List[int], reduction_op: np.ufunc, numpy_type,
+            slab_voxels: int = REDUCE_SLAB_VOXELS) -> List[np.ndarray]:
+    """
+    Reduces the volumes for each label with the binary reduction_op in a single pass over the subjects, which updates
+    the results of all labels slab by slab. Neither the stacked volumes nor a mask of all subjects are materialized,
+    the memory besides the results is one slab. Packed and chunked volumes are unpacked or read slab by slab as well.
+    """
+    shape = volumes[0].shape
+    results = [np.full(shape, reduction_op.identity, dtype=numpy_type) for _ in labels]
+    for start, stop in iter_slabs(shape, slab_voxels):
+        _reduce_slab(volumes, labels, reduction_op, [result[start:stop] for result in results], start, stop)
+
+    return results
+
+
+def label_variability(volumes: Sequence[LabelVolume], operator: Operator, slab_voxels: int = REDUCE_SLAB_VOXELS,
+                      labels: Optional[Sequence[int]] = None) -> np.ndarray:
+    """
+    Computes the variability of the labels of the subjects at each voxel from the histogram of their labels, in a single
+    pass over the subjects and slab by slab. Each subject adds its labels to the histogram with one scattered increment,
+    so the cost is linear in subjects times voxels and only one slab of one subject is read at a time. The histogram
+    counts with count_dtype of the number of subjects and has a row per label up to the largest one seen.
+    :param operator: ENTROPY for the Shannon entropy of the label distribution, normalized by log2 of the number of
+    subjects, or DISAGREEMENT for the fraction of subjects that do not have the most frequent label.
+    :param labels: If given, the variability is 0 outside the voxels that have any of the labels in any subject. The
+    histogram has this mask already, so it costs no further pass.
+    :return: A float32 volume with values in [0, 1] and the shape of the volumes.
+    """
+    assert operator in VARIABILITY_OPERATORS
+    result = np.zeros(volumes[0].shape, dtype=np.float32)
+    if len(volumes) < 2:
+        return result
+
+    for start, stop in iter_slabs(result.shape, slab_voxels):
+        _slab_variability(volumes, operator, result[start:stop].reshape(-1), start, stop, labels)
+
+    return result
+
+
+def _slab_variability(volumes: Sequence[LabelVolume], operator: Operator, target: np.ndarray, start: int, stop: int,
+                      labels: Optional[Sequence[int]] = None):
+    """
+    Writes the variability of the slab [start, stop) into the flat target, see label_variability.
+    """
+    n = len(volumes)
+    hist_type = count_dtype(n)
+    voxels = np.arange(target.size)
+    hist = np.zeros((MAX_PACKED_LABEL + 1, target.size), dtype=hist_type)
+    rows = 1
+    for volume in volumes:
+        slab = get_slab(volume, start, stop).reshape(-1)
+        rows = max(rows, int(slab.max()) + 1)
+        if rows > len(hist):
+            hist = np.concatenate([hist, np.zeros((rows - len(hist), target.size), dtype=hist_type)])
+        # every voxel occurs once per subject, so the increments do not collide
+        hist[slab, voxels] += 1
+
+    # the float temporaries are bounded by the chunks, independently of the size of the slab
+    for begin in range(0, target.size, REDUCE_SLAB_VOXELS):
+        end = min(begin + REDUCE_SLAB_VOXELS, target.size)
+        counts = hist[:rows, begin:end]
+        if operator == Operator.ENTROPY:
+            p = counts.astype(np.float32)
+            p /= n
+            log_p = np.zeros_like(p)
+            np.log2(p, out=log_p, where=p > 0)
+            p *= log_p
+            np.sum(p, axis=0, out=target[begin:end])
+            target[begin:end] *= -1 / np.log2(n)
+        else:
+            target[begin:end] = 1 - counts.max(axis=0) / np.float32(n)
+        if labels is not None:
+            target[begin:end][~counts[[label for label in labels if label < rows]].any(axis=0)] = 0
+
+
+class LabelCounts:
+    """
+    Per-label count volumes of a set of subjects, i.e. the number of subjects that have the label at a voxel. The counts
+    of a label are computed when the label is first requested and then kept up to date when subjects are added or
+    removed, which only has to process the changed subject.
+    """
+
+    def __init__(self):
+        self.__volumes: Dict[int, LabelVolume] = {}
+        self.__counts: Dict[int, np.ndarray] = {}
+
+    def __len__(self):
+        return len(self.__volumes)
+
+    def add(self, idx: int, volume: LabelVolume):
+        self.remove(idx)
+        self.__volumes[idx] = volume
+        # widened once the number of subjects does not fit anymore
+        dtype = count_dtype(len(self.__volumes))
+        for label, count in self.__counts.items():
+            if count.dtype.itemsize < dtype.itemsize:
+                self.__counts[label] = count.astype(dtype)
+        _accumulate(volume, self.__counts, 1)
+
+    def remove(self, idx: int):
+        if (volume := self.__volumes.pop(idx, None)) is not None:
+            _accumulate(volume, self.__counts, -1)
+
+    def discard(self, label: int):
+        """
+        Stops tracking the label.
+        """
+        self.__counts.pop(label, None)
+
+    def counts(self, labels: Sequence[int], pool: Optional['OperatorPool'] = None) -> List[np.ndarray]:
+        """
+        Returns the count volumes of the labels with count_dtype of the number of subjects, which must not be modified.
+        :param pool: Worker processes that share the same subjects. If given, the counts of labels that are not tracked
+        yet are evaluated by the workers as ADDITION of all subjects.
+        """
+        missing = [label for label in labels if label not in self.__counts]
+        if missing and self.__volumes:
+            if pool is not None:
+                assert len(pool) == len(self.__volumes)
+                with pool.evaluate(missing, Operator.ADDITION) as (results, _):
+                    counts = {label: result.copy() for label, result in zip(missing, results)}
+                    del results
+            else:
+                shape = next(iter(self.__volumes.values())).shape
+                counts = {label: np.zeros(shape, dtype=count_dtype(len(self.__volumes))) for label in missing}
+                for volume in self.__volumes.values():
+                    _accumulate(volume, counts, 1)
+            self.__counts.update(counts)
+
+        return [self.__counts[label] for label in labels]
+
+
+def _accumulate(volume: LabelVolume, counts: Dict[int, np.ndarray], delta: int):
+    """
+    Adds delta, 1 or -1, to the counts of each label where the volume has the label.
+    """
+    op = np.add if delta > 0 else np.subtract
+    for start, stop in iter_slabs(volume.shape):
+        slab = get_slab(volume, start, stop)
+        for label, count in counts.items():
+            op(count[start:stop], slab == label, out=count[start:stop])
+
+
+def _evaluate_range(volumes: Sequence[LabelVolume], labels: List[int], operator: Operator, results: np.ndarray,
+                    start: int, stop: int, slab_voxels: int):
+    """
+    Writes the results of the operator within [start, stop) along the first axis into the (labels, X, Y, Z) results,
+    slab by slab. The variability operators yield a single result, the variability within the voxels that have any of
+    the labels in any subject.
+    """
+    reduction_op, numpy_type = _reduction(operator, len(volumes))
+    shape = volumes[0].shape
+    for begin, end in iter_slabs((stop - start,) + shape[1:], slab_voxels):
+        begin, end = begin + start, end + start
+        targets = results[:, begin:end]
+        if operator in VARIABILITY_OPERATORS:
+            targets[...] = 0
+            if len(volumes) > 1:
+                _slab_variability(volumes, operator, targets[0].reshape(-1), begin, end, labels)
+        else:
+            targets[...] = reduction_op.identity
+            _reduce_slab(volumes, labels, reduction_op, list(targets), begin, end)
+
+
+# Every worker process keeps the volumes of its latest task open, since consecutive tasks read the same subjects.
+_worker_volumes: Dict[VolumeSource, Tuple[Optional[SharedMemory], LabelVolume]] = {}
+
+
+def _open_volumes(sources: List[VolumeSource]) -> List[LabelVolume]:
+    for source in [source for source in _worker_volumes if source not in sources]:
+        if (shm := _worker_volumes.pop(source)[0]) is not None:
+            close_shared_memory(shm)
+
+    for source in sources:
+        if source not in _worker_volumes:
+            _worker_volumes[source] = open_source(source)
+
+    return [_worker_volumes[source][1] for source in sources]
+
+
+def _range_bounds(mask: np.ndarray, offset: int, dim: Tuple[int, int, int]) -> Optional[Bounds]:
+    """
+    Returns the bounding box of the set voxels of the flat mask, which starts at the voxel offset of a volume with the
+    dimensions dim, or None if no voxel is set. The range need not start or end at a slice of the (Z, Y, X) volume.
+    """
+    plane = dim[0] * dim[1]
+    first, lead = divmod(offset, plane)
+    planes = -(-(lead + mask.size) // plane)
+    padded = np.zeros(planes * plane, dtype=np.bool_)
+    padded[lead:lead + mask.size] = mask
+    if (bounds := bounding_box(padded.reshape(planes, dim[1], dim[0]))) is None:
+        return None
+
+    (x0, x1), (y0, y1), (z0, z1) = bounds
+    return (x0, x1), (y0, y1), (first + z0, first + z1)
+
+
+def _merge_bounds(a: Optional[Bounds], b: Optional[Bounds]) -> Optional[Bounds]:
+    if a is None or b is None:
+        return a if b is None else b
+
+    return tuple((min(begin_a, begin_b), max(end_a, end_b)) for (begin_a, end_a), (begin_b, end_b) in zip(a, b))
+
+
+def _evaluate_task(sources: List[VolumeSource], labels: List[int], operator: Operator, output: str, dtype: str,
+                   start: int, stop: int, slab_voxels: int) -> List[Optional[Bounds]]:
+    """
+    Evaluates the operator within [start, stop) into the shared memory block output and returns the bounding boxes of
+    the voxels of the results within the range that are not 0. Runs in a worker process.
+    """
+    volumes = _open_volumes(sources)
+    shape = volumes[0].shape
+    shm = SharedMemory(name=output)
+    try:
+        results = np.ndarray((_result_count(operator, labels),) + shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        _evaluate_range(volumes, labels, operator, results, start, stop, slab_voxels)
+        offset = start * int(np.prod(shape[1:]))
+        bounds = [_range_bounds(result[start:stop].reshape(-1) != 0, offset, shape) for result in results]
+        del results
+    finally:
+        close_shared_memory(shm)
+
+    return bounds
+
+
+class OperatorPool:
+    """
+    Worker processes that evaluate the operators for a set of subjects, which are kept up to date like LabelCounts.
+    The subjects are shared with the workers once, see SharedVolumes, and the results are written into a shared memory
+    block. A task covers a slab along the first axis of all subjects and results, so neither voxels nor results are
+    pickled and the workers never write to the same memory.
+    """
+
+    def __init__(self, num_workers: int):
+        self.__num_workers = max(1, num_workers)
+        self.__volumes = SharedVolumes()
+        # spawn instead of fork, forking a process that runs Qt and VTK threads is not safe
+        self.__pool = ProcessPoolExecutor(max_workers=self.__num_workers, mp_context=get_context('spawn'))
+
+    def __len__(self):
+        return len(self.__volumes)
+
+    @property
+    def num_workers(self) -> int:
+        return self.__num_workers
+
+    def add(self, idx: int, volume: LabelVolume):
+        self.__volumes.add(idx, volume)
+
+    def remove(self, idx: int):
+        self.__volumes.remove(idx)
+
+    def shutdown(self):
+        self.__pool.shutdown(wait=False, cancel_futures=True)
+        self.__volumes.clear()
+
+    @contextmanager
+    def evaluate(self, labels: List[int], operator: Operator,
+                 slab_voxels: int = REDUCE_SLAB_VOXELS) -> Iterator[Tuple[List[np.ndarray], List[Optional[Bounds]]]]:
+        """
+        Evaluates the operator for the labels and yields the results and the bounding boxes of their voxels that are not
+        0, which the workers determine for their slabs. The variability operators yield one result for all labels. The
+        results are views of the shared memory block that is released on exit and must not be referenced afterwards.
+        :param slab_voxels: Number of voxels that a worker reads at a time.
+        """
+        sources = self.__volumes.sources
+        shape = sources[0].shape
+        numpy_type = _result_type(operator, len(sources))
+        size = int(np.prod(shape))
+        count = _result_count(operator, labels)
+        shm = SharedMemory(create=True, size=max(1, count * size * numpy_type.itemsize))
+        try:
+            results = np.ndarray((count,) + shape, dtype=numpy_type, buffer=shm.buf)
+            # a few tasks per worker balance the load
+            task_voxels = min(slab_voxels, -(-size // (4 * self.__num_workers)))
+            futures = [self.__pool.submit(_evaluate_task, sources, labels, operator, shm.name, numpy_type.str, start,
+                                          stop, slab_voxels) for start, stop in iter_slabs(shape, task_voxels)]
+            bounds = [None] * count
+            try:
+                for future in futures:
+                    bounds = [_merge_bounds(a, b) for a, b in zip(bounds, future.result())]
+            finally:
+                for future in futures:
+                    future.cancel()
+
+            yield list(results), bounds
+            del results
+        finally:
+            close_shared_memory(shm, unlink=True)
+
+
+def reduce_labels(volumes: Sequence[LabelVolume], labels: List[int], operator: Operator, template_image,
+                  counts: Optional[LabelCounts] = None, memory_limit: Optional[int] = None,
+                  pool: Optional[OperatorPool] = None, masks: Optional[LabelMasks] = None) -> List[vtkImageData]:
+    """
+    Applies the operator to the volumes for each label and returns the results as images with the origin and spacing of
+    template_image, or a single image of all labels for ENTROPY and DISAGREEMENT. An image only covers the bounding box
+    of the voxels where its result is not 0, padded by a voxel such that surfaces stay closed, so small structures are
+    contoured on a small sub-extent. Its extent is the one of the sub-extent within template_image, which keeps the
+    world coordinates.
+    The results of ADDITION count with count_dtype of the number of subjects. The result of ENTROPY and DISAGREEMENT
+    is the variability of all labels, see label_variability, within the voxels that have any of the labels in any
+    subject.
+    :param counts: Label counts of the same subjects as volumes. If given, the results of UNION, INTERSECTION and
+    ADDITION are derived from them.
+    :param memory_limit: Limit in MB for the results and the slab that is streamed from the volumes, which sets the
+    size of the slabs. Since only one slab of one subject is read at a time, memory-mapped or chunked volumes of cohorts
+    of any size are reduced within the limit. Slabs of REDUCE_SLAB_VOXELS are used if None.
+    :param pool: Worker processes that share the same subjects as volumes, see OperatorPool. If given, the workers
+    compute the counts of labels that counts does not track yet, and without counts or for the variability operators
+    they reduce the slabs into shared results.
+    :param masks: Label masks of the same subjects as volumes. If given and counts is not, UNION and INTERSECTION are
+    reduced from their bitsets as long as the masks of the labels fit into their limit, see LabelMasks.
+    """
     if not volumes or not labels:
         return []
 
     shape = volumes[0].shape
     assert all(v.shape == shape for v in volumes)
 
-    if operator == Operator.UNION:
-        numpy_type = np.bool
-        reduction_op = np.bitwise_or.reduce
-        vtk_type = vtk.VTK_UNSIGNED_CHAR
-    elif operator == Operator.INTERSECTION:
-        numpy_type = np.bool
-        reduction_op = np.bitwise_and.reduce
-        vtk_type = vtk.VTK_UNSIGNED_CHAR
-    elif operator == Operator.ADDITION:
-        numpy_type = np.ubyte
-        reduction_op = np.sum
-        vtk_type = vtk.VTK_UNSIGNED_CHAR
+    reduction_op, numpy_type = _reduction(operator, len(volumes))
+    # per voxel, the results and their images, and a slab of a subject with its mask or unpacked copy
+    result_bytes = 2 * _result_count(operator, labels) * _result_type(operator, len(volumes)).itemsize
+    slab_bytes = 3
+    if operator in VARIABILITY_OPERATORS:
+        # the histogram rows of the usual labels with the voxel indices
+        slab_bytes = (MAX_PACKED_LABEL + 1) * count_dtype(len(volumes)).itemsize + 9
+
+    if masks is not None and counts is None and operator in (Operator.UNION, Operator.INTERSECTION) \
+            and masks.fits(labels):
+        assert len(masks) == len(volumes)
+        return _result_images(masks.reduce(labels, reduction_op), template_image)
+
+    if pool is not None and (counts is None or operator in VARIABILITY_OPERATORS):
+        assert len(pool) == len(volumes)
+        # the shared results and their images, and a slab per worker
+        slab_voxels = _slab_voxels(shape, result_bytes, slab_bytes * pool.num_workers, memory_limit)
+        with pool.evaluate(labels, operator, slab_voxels) as (results, bounds):
+            images = _result_images(results, template_image, bounds)
+            del results
+        return images
+
+    if operator in VARIABILITY_OPERATORS:
+        results = [label_variability(volumes, operator, _slab_voxels(shape, result_bytes, slab_bytes, memory_limit),
+                                     labels)]
+    elif counts is not None:
+        assert len(counts) == len(volumes)
+        results = counts.counts(labels, pool)
+        if operator == Operator.UNION:
+            results = [c > 0 for c in results]
+        elif operator == Operator.INTERSECTION:
+            results = [c == len(volumes) for c in results]
     else:
-        raise RuntimeError('Unknown volume operator')
+        results = _reduce(volumes, labels, reduction_op, numpy_type,
+                          _slab_voxels(shape, result_bytes, slab_bytes, memory_limit))
+
+    return _result_images(results, template_image)
+
+
+def _result_images(results: Sequence[np.ndarray], template_image: vtkImageData,
+                   bounds: Optional[Sequence[Optional[Bounds]]] = None) -> List[vtkImageData]:
+    """
+    Copies the padded bounding box of the voxels of each result that are not 0 into an image, see reduce_labels.
+    :param bounds: The bounding boxes if they are known already.
+    """
+    dim = template_image.GetDimensions()
+    if bounds is None:
+        bounds = [bounding_box(result.reshape(dim[::-1]) != 0) for result in results]
+
+    return [region_image(result, template_image, padded_bounds(box, dim), _VTK_TYPES[result.dtype])
+            for result, box in zip(results, bounds)]
+
+
+def _slab_voxels(shape: Tuple[int, ...], result_bytes: int, slab_bytes: int, memory_limit: Optional[int]) -> int:
+    """
+    Returns the number of voxels per slab such that results of result_bytes per voxel and a slab of slab_bytes per
+    voxel fit into memory_limit MB, but at least one slice along the first axis.
+    """
+    if memory_limit is None:
+        return REDUCE_SLAB_VOXELS
+
+    size = int(np.prod(shape))
+    slice_voxels = size // shape[0]
+    window = (memory_limit << 20) - size * result_bytes
+    if window < slice_voxels * slab_bytes:
+        print('The memory limit of {} MB does not fit the {:.1f} MB of the operator results.'.format(
+            memory_limit, size * result_bytes / (1 << 20)))
+
+    return max(slice_voxels, window // slab_bytes)
+
+
+def region_image(volume: np.ndarray, template_image: vtkImageData, bounds: Bounds,
+                 vtk_type=vtk.VTK_UNSIGNED_CHAR) -> vtkImageData:
+    """
+    Returns the part of the volume within bounds as image on the grid of template_image. Its extent is the one of the
+    sub-extent within template_image, which keeps the world coordinates.
+    """
+    dim = template_image.GetDimensions()
+    image = vtkImageData()
+    image.CopyStructure(template_image)
+    extent = template_image.GetExtent()
+    image.SetExtent(*(extent[2 * axis] + b for axis, (begin, end) in enumerate(bounds) for b in (begin, end - 1)))
+    # the cropped volume is a copy already, which the image keeps
+    image.GetPointData().SetScalars(convert(crop_volume(volume, dim, bounds), dtype=vtk_type, deep=False))
+    return image
+
+
+def padded_bounds(bounds: Optional[Bounds], dim: Tuple[int, int, int]) -> Bounds:
+    """
+    Pads the bounds by a voxel within dim. Empty results get a box of at most 2^3 voxels, which has no surface.
+    """
+    if bounds is None:
+        return tuple((0, min(2, n)) for n in dim)
+
+    return tuple((max(0, begin - 1), min(n, end + 1)) for (begin, end), n in zip(bounds, dim))
+
+
+def contour_value(operator: Operator, iso_value: float) -> float:
+    """
+    Returns the value at which the result images of the operator are contoured. The counts of ADDITION are integers, so
+    all iso values in (k - 1, k] enclose the voxels of at least k subjects and are contoured at the level k - 0.5, see
+    iso_levels. Contouring the counts exactly at k would put vertices onto voxel centers and yield degenerate triangles.
+    """
+    if operator in VARIABILITY_OPERATORS:
+        return iso_value
+    if operator != Operator.ADDITION:
+        return 1
 
-    source = np.stack(volumes, axis=-1)
-    fes = []
+    # the slider does not hit the levels exactly, and at least one subject has to have the label
+    return max(1, math.ceil(iso_value - 1e-3)) - 0.5
+
+
+def iso_levels(num_subjects: int) -> List[float]:
+    """
+    The contour values of ADDITION that produce a surface, from at least one to all subjects, see contour_value.
+    """
+    return [k - 0.5 for k in range(1, num_subjects + 1)]
+
+
+def make_surface_filter(image: vtkImageData, value: float,
+                        engine: SurfaceEngine = SurfaceEngine.MARCHING_CUBES) -> vtkPolyDataAlgorithm:
+    """
+    :param engine: For DISCRETE_FLYING_EDGES, image has to be a label map and value the label, see label_map.
+    """
+    if engine == SurfaceEngine.MARCHING_CUBES:
+        fe = vtkMarchingCubes()
+    elif engine == SurfaceEngine.FLYING_EDGES:
+        fe = vtkFlyingEdges3D()
+    elif engine == SurfaceEngine.DISCRETE_FLYING_EDGES:
+        fe = vtkDiscreteFlyingEdges3D()
+    else:
+        raise RuntimeError('Unknown surface engine')
+
+    fe.SetNumberOfContours(1)
+    fe.SetValue(0, value)
+    fe.SetInputDataObject(0, image)
+    return fe
+
+
+def extract_surface(image: vtkImageData, value: float,
+                    engine: SurfaceEngine = SurfaceEngine.MARCHING_CUBES) -> vtkPolyData:
+    """
+    Extracts the surface of the image at value with a filter of its own, so surfaces can be extracted from several
+    threads at once. VTK releases the GIL while the filter runs.
+    """
+    fe = make_surface_filter(image, value, engine)
+    fe.Update()
+    surface = vtkPolyData()
+    surface.ShallowCopy(fe.GetOutput())
+    return surface
+
+
+def label_map(images: Sequence[vtkImageData], labels: Sequence[int], value: float) -> Optional[vtkImageData]:
+    """
+    Combines the operator results of the labels into one label map in which a voxel holds the label whose result
+    reaches value there. The other voxels hold the smallest value that is not one of the labels. The label map covers
+    the union of the extents of the images, which have to lie on the same grid.
+    :return: The label map or None if the results of several labels reach value at the same voxel.
+    """
+    if not images:
+        return None
+
+    background = next(i for i in range(256) if i not in labels)
+    extents = [image.GetExtent() for image in images]
+    extent = tuple((min if i % 2 == 0 else max)(e[i] for e in extents) for i in range(6))
+    combined = np.full((extent[5] - extent[4] + 1, extent[3] - extent[2] + 1, extent[1] - extent[0] + 1), background,
+                       dtype=np.ubyte)
+    for image, label, e in zip(images, labels, extents):
+        region = combined[e[4] - extent[4]:e[5] - extent[4] + 1, e[2] - extent[2]:e[3] - extent[2] + 1,
+                          e[0] - extent[0]:e[1] - extent[0] + 1]
+        inside = vtk_to_numpy(image.GetPointData().GetScalars()).reshape(region.shape) >= value
+        if np.any(region[inside] != background):
+            return None
+
+        region[inside] = label
+
+    result = vtkImageData()
+    result.CopyStructure(images[0])
+    result.SetExtent(*extent)
+    result.GetPointData().SetScalars(convert(combined, dtype=vtk.VTK_UNSIGNED_CHAR))
+    return result
+
+
+def extract_label_surfaces(labels_image: vtkImageData, labels: Sequence[int]) -> List[vtkPolyData]:
+    """
+    Extracts the surfaces of all labels from the label map in a single execution of vtkDiscreteFlyingEdges3D and
+    splits its output by label.
+    """
+    fe = vtkDiscreteFlyingEdges3D()
+    fe.SetNumberOfContours(len(labels))
+    for i, label in enumerate(labels):
+        fe.SetValue(i, label)
+    fe.ComputeScalarsOn()
+    fe.SetInputDataObject(0, labels_image)
+    fe.Update()
+    output = fe.GetOutput()
+    if output.GetNumberOfCells() == 0:
+        return [vtkPolyData() for _ in labels]
+
+    # the output consists of triangles whose points carry the label of their surface
+    triangles = vtk_to_numpy(output.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    point_labels = vtk_to_numpy(output.GetPointData().GetScalars())
+    triangle_labels = point_labels[triangles[:, 0]]
+    points = vtk_to_numpy(output.GetPoints().GetData())
+    normals = output.GetPointData().GetNormals()
+    normals = vtk_to_numpy(normals) if normals is not None else None
+    surfaces = []
     for label in labels:
-        result = reduction_op(source == label, axis=3, dtype=numpy_type)
-        image = vtkImageData()
-        image.CopyStructure(template_image)
-        image.GetPointData().SetScalars(convert(result, dtype=vtk_type))
-        fe = vtkMarchingCubes() # vtkDiscreteFlyingEdges3D()
-        fe.SetNumberOfContours(1)
-        if operator == Operator.ADDITION:
-            fe.SetValue(0, iso_value)
-        else:
-            fe.SetValue(0, 1)
+        surface = vtkPolyData()
+        surfaces.append(surface)
+        selected = triangles[triangle_labels == label]
+        if not selected.size:
+            continue
+
+        # the points of a label are generated in one run, keeping the range that they span makes remapping a shift
+        begin, end = selected.min(), selected.max() + 1
+        surface.SetPoints(vtkPoints())
+        surface.GetPoints().SetData(numpy_to_vtk(points[begin:end], deep=True))
+        polys = vtkCellArray()
+        polys.SetData(numpy_to_vtkIdTypeArray(np.arange(0, selected.size + 1, 3, dtype=selected.dtype), deep=True),
+                      numpy_to_vtkIdTypeArray((selected - begin).reshape(-1), deep=True))
+        surface.SetPolys(polys)
+        if normals is not None:
+            surface.GetPointData().SetNormals(numpy_to_vtk(normals[begin:end], deep=True))
+
+    return surfaces
+
+
+def extract_surfaces(images: Sequence[vtkImageData], labels: Sequence[int], value: float,
+                     engine: SurfaceEngine = SurfaceEngine.MARCHING_CUBES) -> List[vtkPolyData]:
+    """
+    Extracts the surfaces of the operator results of all labels at value. DISCRETE_FLYING_EDGES combines the results
+    into one label map and extracts all labels from it in one pass, results that overlap each other, which UNION and
+    ADDITION may produce, are extracted from a label map per label instead.
+    """
+    if engine != SurfaceEngine.DISCRETE_FLYING_EDGES:
+        return [extract_surface(image, value, engine) for image in images]
+
+    if (combined := label_map(images, labels, value)) is not None:
+        return extract_label_surfaces(combined, labels)
+
+    return [extract_label_surfaces(label_map([image], [label], value), [label])[0]
+            for image, label in zip(images, labels)]
+
+
+def decimate_surface(surface: vtkPolyData, max_triangles: int, point_arrays: Sequence[str] = ()) -> vtkPolyData:
+    """
+    Returns a version of the surface with at most about max_triangles triangles, or the surface itself if it is not
+    larger. Uses vertex clustering, which is fast enough for meshes of millions of triangles but only approximates the
+    budget, the number of bins is corrected until the result fits.
+    :param point_arrays: Names of point arrays of the surface that the decimated surface gets as well, each point takes
+    the values of the nearest point of the surface. The first one becomes the active scalars.
+    """
+    if (triangles := surface.GetNumberOfCells()) <= max_triangles:
+        return surface
+
+    clustering = vtkQuadricClustering()
+    clustering.SetInputDataObject(0, surface)
+    # the triangles of a clustered surface grow with the square of the divisions, about 8 per squared division
+    divisions = max(2.0, math.sqrt(max_triangles / 8))
+    for _ in range(4):
+        clustering.SetNumberOfDivisions(*(int(divisions),) * 3)
+        clustering.Update()
+        if (triangles := clustering.GetOutput().GetNumberOfCells()) <= max_triangles or divisions <= 2:
+            break
+
+        divisions = max(2.0, divisions * math.sqrt(max_triangles / triangles) * 0.95)
+
+    normals = vtkPolyDataNormals()
+    normals.SetInputConnection(clustering.GetOutputPort())
+    normals.SplittingOff()
+    normals.Update()
+    result = vtkPolyData()
+    result.ShallowCopy(normals.GetOutput())
+    if point_arrays:
+        # the clustered points are new, the arrays are taken over from the nearest original point
+        interpolator = vtkPointInterpolator()
+        interpolator.SetInputDataObject(0, result)
+        interpolator.SetSourceData(surface)
+        interpolator.SetKernel(vtkVoronoiKernel())
+        interpolator.PassPointArraysOff()
+        interpolator.Update()
+        for i, name in enumerate(point_arrays):
+            if (array := interpolator.GetOutput().GetPointData().GetArray(name)) is not None:
+                result.GetPointData().AddArray(array)
+                if i == 0:
+                    result.GetPointData().SetActiveScalars(name)
+
+    return result
+
 
-        fe.SetInputDataObject(0, image)
-        image.Modified()
-        fes.append(fe)
+def rebuild(volumes: Sequence[LabelVolume], labels: List[int], operator: Operator, template_image, iso_value: float,
+            counts: Optional[LabelCounts] = None, masks: Optional[LabelMasks] = None,
+            engine: SurfaceEngine = SurfaceEngine.MARCHING_CUBES) -> List[vtkPolyDataAlgorithm]:
+    """
+    Returns a surface filter for each label, or a single one of all labels for ENTROPY and DISAGREEMENT, which is
+    executed by the pipeline that it is connected to. The filters of DISCRETE_FLYING_EDGES contour a label map of their
+    own label, use extract_surfaces for a single pass.
+    """
+    images = reduce_labels(volumes, labels, operator, template_image, counts, masks=masks)
+    value = contour_value(operator, iso_value)
+    if operator in VARIABILITY_OPERATORS:
+        labels = [VARIABILITY_LABEL]
+    if engine == SurfaceEngine.DISCRETE_FLYING_EDGES:
+        return [make_surface_filter(label_map([image], [label], value), label, engine)
+                for image, label in zip(images, labels)]
 
-    return fes
+    return [make_surface_filter(image, value, engine) for image in images]
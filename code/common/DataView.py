@@ -48,6 +48,15 @@ class DataView(QWidget, metaclass=WidgetMeta):
     def remove_volume(self, idx: int):
         pass
 
+    def add_placeholder(self, idx: int):
+        """
+        Called for a selected volume that is still being loaded. add_volume or remove_placeholder follow.
+        """
+        pass
+
+    def remove_placeholder(self, idx: int):
+        pass
+
     @property
     @abc.abstractmethod
     def name(self):
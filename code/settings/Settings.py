@@ -1,4 +1,5 @@
-from typing import Callable
+import os
+from typing import Callable, Optional
 
 from PySide6.QtWidgets import QLabel
 from common import Delegate
@@ -10,6 +11,21 @@ class Settings:
     def __init__(self):
         self.__gpu_mem_limit = 1 << 10
         self.__on_gpu_mem_limit_changed = Delegate()
+        self.__loader_workers = os.cpu_count() or 1
+        self.__volume_cache_dir = '../Cache/'
+        self.__volume_stack_file = None
+        self.__lazy_loading = False
+        self.__volume_mem_limit = 1 << 11
+        self.__progressive_loading = True
+        self.__packed_volumes = False
+        self.__crop_volumes = True
+        self.__surface_workers = os.cpu_count() or 1
+        self.__surface_cache_mem_limit = 1 << 9
+        self.__surface_cache_dir = '../Cache/Surfaces/'
+        self.__similarity_workers = os.cpu_count() or 1
+        self.__population_mode = False
+        self.__population_mem_limit = 1 << 10
+        self.__operator_workers = os.cpu_count() or 1
 
     def set_gpu_mem_limit_ui(self):
         SetGpuMemLimitUI(self)
@@ -31,6 +47,182 @@ class Settings:
     def gpu_mem_limit_changed(self, value):
         assert value is self.__on_gpu_mem_limit_changed
 
+    @property
+    def loader_workers(self) -> int:
+        """
+        Number of processes that decode volume files in parallel at startup.
+        """
+        return self.__loader_workers
+
+    @loader_workers.setter
+    def loader_workers(self, value: int):
+        assert value >= 0
+        self.__loader_workers = value
+
+    @property
+    def volume_cache_dir(self) -> Optional[str]:
+        """
+        Directory in which decoded volumes are cached across restarts. None disables the cache.
+        """
+        return self.__volume_cache_dir
+
+    @volume_cache_dir.setter
+    def volume_cache_dir(self, value: Optional[str]):
+        self.__volume_cache_dir = value
+
+    @property
+    def volume_stack_file(self) -> Optional[str]:
+        """
+        File to which the stack of all loaded volumes is memory-mapped. If None, the stack is held in memory.
+        """
+        return self.__volume_stack_file
+
+    @volume_stack_file.setter
+    def volume_stack_file(self, value: Optional[str]):
+        self.__volume_stack_file = value
+
+    @property
+    def lazy_loading(self) -> bool:
+        """
+        If True, only the volume headers are read at startup and volumes are decoded once they are selected. Lazy
+        loading takes precedence over the other loading modes: it disables progressive loading and the decoding by
+        loader_workers into the volume stack. Otherwise all volumes are decoded at startup into the stack.
+        """
+        return self.__lazy_loading
+
+    @lazy_loading.setter
+    def lazy_loading(self, value: bool):
+        self.__lazy_loading = value
+
+    @property
+    def volume_mem_limit(self) -> int:
+        """
+        Limit in MB for the decoded volumes that are kept in memory when loading lazily. Selected volumes are never
+        evicted.
+        """
+        return self.__volume_mem_limit
+
+    @volume_mem_limit.setter
+    def volume_mem_limit(self, value: int):
+        self.__volume_mem_limit = value
+
+    @property
+    def progressive_loading(self) -> bool:
+        """
+        If True and volumes are not loaded lazily, the main window opens as soon as the first volume is decoded and
+        the remaining volumes are added while they are decoded.
+        """
+        return self.__progressive_loading
+
+    @progressive_loading.setter
+    def progressive_loading(self, value: bool):
+        self.__progressive_loading = value
+
+    @property
+    def packed_volumes(self) -> bool:
+        """
+        If True, volumes are held in memory with two voxels per byte, which requires labels below 16.
+        """
+        return self.__packed_volumes
+
+    @packed_volumes.setter
+    def packed_volumes(self, value: bool):
+        self.__packed_volumes = value
+
+    @property
+    def crop_volumes(self) -> bool:
+        """
+        If True, all volumes are cropped to the common bounding box of the non-background voxels. Chunked volumes are
+        cropped with the bounding boxes in their headers in every loading mode. Other volumes can only be cropped once
+        the whole data set is loaded, so they are not cropped for lazy or progressive loading.
+        """
+        return self.__crop_volumes
+
+    @crop_volumes.setter
+    def crop_volumes(self, value: bool):
+        self.__crop_volumes = value
+
+    @property
+    def surface_workers(self) -> int:
+        """
+        Number of threads that extract the surfaces of the labels concurrently.
+        """
+        return self.__surface_workers
+
+    @surface_workers.setter
+    def surface_workers(self, value: int):
+        self.__surface_workers = value
+
+    @property
+    def surface_cache_mem_limit(self) -> int:
+        """
+        Limit in MB for the extracted surfaces that are kept in memory.
+        """
+        return self.__surface_cache_mem_limit
+
+    @surface_cache_mem_limit.setter
+    def surface_cache_mem_limit(self, value: int):
+        assert value >= 0
+        self.__surface_cache_mem_limit = value
+
+    @property
+    def surface_cache_dir(self) -> Optional[str]:
+        """
+        Directory in which extracted surfaces are cached across restarts. None disables the disk cache.
+        """
+        return self.__surface_cache_dir
+
+    @surface_cache_dir.setter
+    def surface_cache_dir(self, value: Optional[str]):
+        self.__surface_cache_dir = value
+
+    @property
+    def similarity_workers(self) -> int:
+        """
+        Number of threads that count the overlaps of the labels of all pairs of volumes.
+        """
+        return self.__similarity_workers
+
+    @similarity_workers.setter
+    def similarity_workers(self, value: int):
+        self.__similarity_workers = value
+
+    @property
+    def population_mode(self) -> bool:
+        """
+        If True, volumes stay on disk and the operators stream them slab by slab, for cohorts that do not fit into
+        memory. Implies lazy loading. MINC volumes are decoded into the volume cache once and memory-mapped from there.
+        """
+        return self.__population_mode
+
+    @population_mode.setter
+    def population_mode(self, value: bool):
+        self.__population_mode = value
+
+    @property
+    def population_mem_limit(self) -> int:
+        """
+        Limit in MB for the results and slabs of the operators in population mode.
+        """
+        return self.__population_mem_limit
+
+    @population_mem_limit.setter
+    def population_mem_limit(self, value: int):
+        self.__population_mem_limit = value
+
+    @property
+    def operator_workers(self) -> int:
+        """
+        Number of worker processes that evaluate the operators slab by slab on shared volumes. Outside of population
+        mode they compute the label counts of newly shown labels and the variability, the counts are then updated per
+        added or removed volume. A volume stack of a parallel load is shared with the workers without a copy.
+        """
+        return self.__operator_workers
+
+    @operator_workers.setter
+    def operator_workers(self, value: int):
+        self.__operator_workers = value
+
 
 class SetGpuMemLimitUI(Popup):
     def __init__(self, settings: Settings, cb: Callable[[], None] = None):
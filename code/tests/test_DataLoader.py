@@ -0,0 +1,66 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from vtkmodules.util.numpy_support import numpy_to_vtk
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkIOMINC import vtkMINCImageWriter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import DataLoader as data_loader  # noqa: E402
+from DataLoader import DataLoader, decode_minc_file  # noqa: E402
+
+DIM = (8, 6, 4)
+
+
+def _write_minc(path: str, label: int):
+    image = vtkImageData()
+    image.SetDimensions(*DIM)
+    voxels = np.zeros(DIM[::-1], dtype=np.ubyte)
+    voxels[1:3, 1:5, 2:6] = label
+    image.GetPointData().SetScalars(numpy_to_vtk(voxels.ravel(), deep=True))
+    writer = vtkMINCImageWriter()
+    writer.SetInputData(image)
+    writer.SetFileName(path)
+    writer.Write()
+
+
+@pytest.fixture
+def data_set(tmp_path, monkeypatch):
+    """
+    Two valid volumes and a corrupt one between them, which is read after a valid one by the same reader pipeline.
+    """
+    (tmp_path / 'code').mkdir()
+    (tmp_path / 'Data').mkdir()
+    _write_minc(str(tmp_path / 'Data' / 'a.mnc'), 1)
+    _write_minc(str(tmp_path / 'Data' / 'c.mnc'), 2)
+    (tmp_path / 'Data' / 'broken.mnc').write_bytes(os.urandom(4096))
+    monkeypatch.chdir(tmp_path / 'code')
+    monkeypatch.setattr(data_loader, '_list_data_files', lambda _: ['a.mnc', 'broken.mnc', 'c.mnc'])
+    return tmp_path
+
+
+def test_decode_corrupt_file_raises(data_set):
+    with pytest.raises(RuntimeError):
+        decode_minc_file(str(data_set / 'Data' / 'broken.mnc'))
+
+
+@pytest.mark.parametrize('options', [{}, {'progressive': True}, {'num_workers': 2}])
+def test_corrupt_file_is_skipped(data_set, options):
+    cache_dir = str(data_set / 'cache')
+    loader = DataLoader(cache_dir=cache_dir, **options)
+    failed, done = [], []
+    loader.volume_failed.connect(failed.append)
+    loader.done.connect(lambda: done.append(True))
+    loader.run()
+    loader.release()
+
+    assert failed == [1]
+    assert done == [True]
+    data = loader.data
+    assert data[1] is None
+    assert [int(np.asarray(data[idx]).max()) for idx in (0, 2)] == [1, 2]
+    # the corrupt file must not be cached as a copy of the previous volume
+    assert len([f for f in os.listdir(cache_dir) if f.endswith('.npy')]) == 2